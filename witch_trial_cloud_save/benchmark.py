@@ -0,0 +1,422 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import atexit
+import tempfile
+import subprocess
+import statistics
+import tracemalloc
+from pathlib import Path
+from datetime import datetime
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from compress import CompressManager
+from chunk_store import ChunkStore
+from file_index import scan_save_dir
+
+# 合成存档的规模：(存档槽数量, 每个槽的文件数, 大文件数量, 大文件大小)
+SCALES = {
+    "tiny": (4, 2, 1, 256 * 1024),
+    "small": (20, 3, 2, 2 * 1024 * 1024),
+    "default": (60, 4, 4, 8 * 1024 * 1024),
+    "large": (200, 5, 8, 32 * 1024 * 1024),
+}
+DEFAULT_SEED = 20240101
+# GitAPI 测试使用的模拟网络条件：往返延迟（秒）和带宽（字节/秒），可用命令行参数修改
+NETWORK = {"latency": 0.05, "bandwidth": 8 * 1024 * 1024}
+RESULTS_DIR = Path(__file__).resolve().parent / "benchmark_results"
+
+
+def _random_bytes(rng, size):
+    return rng.getrandbits(size * 8).to_bytes(size, "little") if size else b""
+
+
+def _slot_data(rng, size):
+    """类似游戏存档的结构化数据：重复的字段名、少量变化的数值和一段随机数据"""
+    out = bytearray()
+    while len(out) < size:
+        out += f'{{"flag_{rng.randrange(500)}": {rng.randrange(100000)}, "scene": "chapter_{rng.randrange(12)}"}}\n'.encode()
+        if rng.random() < 0.1:
+            out += _random_bytes(rng, rng.randrange(16, 256))
+    return bytes(out[:size])
+
+
+def generate_save_tree(root, scale="default", seed=DEFAULT_SEED):
+    """在 root 下生成合成的 Saves_v1 目录，相同的 seed 生成完全相同的内容
+
+    包含大量小存档槽（可压缩）、若干大文件（一半不可压缩的截图，一半可压缩
+    的日志）和一个全局设置文件。返回 {"files": 文件数, "bytes": 总字节数}。
+    """
+    slots, files_per_slot, large_files, large_size = SCALES[scale]
+    rng = random.Random(seed)
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    files = 0
+    total = 0
+
+    def write(rel_path, data):
+        nonlocal files, total
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        files += 1
+        total += len(data)
+
+    write("system.dat", _slot_data(rng, 4096))
+    for slot in range(slots):
+        for index in range(files_per_slot):
+            write(f"slot_{slot:03d}/save_{index}.dat", _slot_data(rng, rng.randrange(2 * 1024, 64 * 1024)))
+    for index in range(large_files):
+        if index % 2 == 0:
+            write(f"screenshots/shot_{index:02d}.png", _random_bytes(rng, large_size))
+        else:
+            write(f"logs/backlog_{index:02d}.log", _slot_data(rng, large_size))
+    return {"files": files, "bytes": total}
+
+
+def _modify_tree(root, seed, count=3):
+    """修改少量存档槽，模拟两次备份之间的游戏进度"""
+    rng = random.Random(seed + 1)
+    paths = sorted(p for p in Path(root).rglob("save_*.dat"))
+    for path in rng.sample(paths, min(count, len(paths))):
+        data = bytearray(path.read_bytes())
+        data[rng.randrange(len(data))] ^= 0xFF
+        path.write_bytes(bytes(data))
+
+
+def _peak_rss():
+    """进程的峰值内存占用（字节），无法获取时返回None"""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+        return None
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 的单位是字节，Linux 是KB
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# 各项测试：setup(存档目录, 工作目录) 做不计时的准备，返回 (run, 处理的字节数)，run() 可重复调用
+
+def bench_create_backup(save_dir, work_dir):
+    counter = iter(range(1000))
+
+    def run():
+        CompressManager.create_backup(save_dir, Path(work_dir) / f"zip_{next(counter)}")
+    return run, None
+
+
+def bench_build_snapshot(save_dir, work_dir):
+    def run():
+        ChunkStore.build_snapshot(save_dir)
+    return run, None
+
+
+def bench_restore_full(save_dir, work_dir):
+    zip_path = Path(work_dir) / "backup.zip"
+    zip_path.write_bytes(b"".join(CompressManager.iter_backup(save_dir)))
+    counter = iter(range(1000))
+
+    def run():
+        CompressManager.restore_backup(zip_path, Path(work_dir) / f"restore_{next(counter)}")
+    return run, None
+
+
+def bench_restore_unchanged(save_dir, work_dir):
+    # 恢复到内容相同的存档：差异恢复应当几乎不写入
+    zip_path = Path(work_dir) / "backup.zip"
+    zip_path.write_bytes(b"".join(CompressManager.iter_backup(save_dir)))
+    target = Path(work_dir) / "restore_target"
+    shutil.copytree(save_dir, target)
+
+    def run():
+        CompressManager.restore_backup(zip_path, target)
+    return run, None
+
+
+def bench_restore_changed(save_dir, work_dir):
+    # 恢复到少量存档槽不同的存档：替代原先的“删除旧存档再解压”
+    zip_path = Path(work_dir) / "backup.zip"
+    zip_path.write_bytes(b"".join(CompressManager.iter_backup(save_dir)))
+    target = Path(work_dir) / "restore_target"
+    shutil.copytree(save_dir, target)
+    seeds = iter(range(1000))
+
+    def run():
+        _modify_tree(target, next(seeds))
+        CompressManager.restore_backup(zip_path, target)
+    return run, None
+
+
+def bench_get_current_files(save_dir, work_dir):
+    from monitor import SaveMonitor
+    monitor = SaveMonitor(str(save_dir), lambda changed: None)
+
+    def run():
+        monitor.get_current_files()
+    return run, None
+
+
+# GitAPI 测试：连接本地的模拟GitHub服务器（fake_github.py），run() 返回往返次数和传输字节数
+
+def _start_fake_github(work_dir):
+    from fake_github import FakeGitHub
+    github = FakeGitHub(latency=NETWORK["latency"], bandwidth=NETWORK["bandwidth"])
+    github.start()
+    atexit.register(github.stop)
+    git_api = github.client(blob_cache_file=Path(work_dir) / "blob_cache.json")
+    return github, git_api
+
+
+def _api_run(github, state, call):
+    """还原仓库状态后执行一次 GitAPI 调用，返回本次调用的网络统计"""
+    def run():
+        github.import_state(state)
+        github.reset_stats()
+        if not call():
+            raise RuntimeError("GitAPI 调用失败")
+        stats = github.snapshot_stats()
+        return {key: stats[key] for key in ("round_trips", "bytes_sent", "bytes_received")}
+    return run
+
+
+def _upload_backups(save_dir, work_dir, git_api, count):
+    """上传 count 个备份，返回最后一个备份的压缩包路径"""
+    data = b"".join(CompressManager.iter_backup(save_dir))
+    for index in range(count):
+        folder = Path(work_dir) / f"2024-01-01_00-00-{index:02d}"
+        folder.mkdir()
+        zip_path = folder / "backup.zip"
+        zip_path.write_bytes(data)
+        if not git_api.upload_file(zip_path, "准备测试数据", catalog_entry={"name": folder.name}):
+            raise RuntimeError("准备测试数据失败")
+    return zip_path
+
+
+def bench_api_upload_file(save_dir, work_dir):
+    github, git_api = _start_fake_github(work_dir)
+    _upload_backups(save_dir, work_dir, git_api, 1)
+    zip_path = Path(work_dir) / "2024-01-02_00-00-00" / "backup.zip"
+    zip_path.parent.mkdir()
+    zip_path.write_bytes(b"".join(CompressManager.iter_backup(save_dir)))
+    run = _api_run(github, github.export_state(), lambda: git_api.upload_file(
+        zip_path, "测试备份", catalog_entry={"name": zip_path.parent.name}))
+    return run, zip_path.stat().st_size
+
+
+def bench_api_list_backups(save_dir, work_dir):
+    github, git_api = _start_fake_github(work_dir)
+    _upload_backups(save_dir, work_dir, git_api, 3)
+    return _api_run(github, github.export_state(), lambda: len(git_api.list_backups()) == 3), 0
+
+
+def bench_api_download_backup(save_dir, work_dir):
+    github, git_api = _start_fake_github(work_dir)
+    zip_path = _upload_backups(save_dir, work_dir, git_api, 1)
+    output_path = Path(work_dir) / "download.zip"
+    run = _api_run(github, github.export_state(), lambda: git_api.download_backup(zip_path.parent.name, output_path))
+    return run, zip_path.stat().st_size
+
+
+def bench_api_delete_all_backups(save_dir, work_dir):
+    github, git_api = _start_fake_github(work_dir)
+    _upload_backups(save_dir, work_dir, git_api, 3)
+    return _api_run(github, github.export_state(), git_api.delete_all_backups), 0
+
+
+BENCHMARKS = {
+    "create_backup": bench_create_backup,
+    "build_snapshot": bench_build_snapshot,
+    "restore_full": bench_restore_full,
+    "restore_unchanged": bench_restore_unchanged,
+    "restore_changed": bench_restore_changed,
+    "get_current_files": bench_get_current_files,
+    "api_upload_file": bench_api_upload_file,
+    "api_list_backups": bench_api_list_backups,
+    "api_download_backup": bench_api_download_backup,
+    "api_delete_all_backups": bench_api_delete_all_backups,
+}
+
+
+def run_benchmark(name, save_dir, repeat=3):
+    """在当前进程中运行一项测试，返回耗时、吞吐量和内存统计
+
+    run() 返回字典时（GitAPI 测试的往返次数和传输字节数），合并到结果中。
+    """
+    files_info = scan_save_dir(save_dir)
+    tree_bytes = sum(size for size, _ in files_info.values())
+    with tempfile.TemporaryDirectory() as work_dir:
+        run, processed = BENCHMARKS[name](save_dir, work_dir)
+        if processed is None:
+            processed = tree_bytes
+
+        times = []
+        extra = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            extra = run()
+            times.append(time.perf_counter() - started)
+
+        # 单独运行一次统计内存分配，tracemalloc 会拖慢执行，不计入耗时
+        tracemalloc.start()
+        run()
+        _, peak_alloc = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    seconds = statistics.median(times)
+    peak_rss = _peak_rss()
+    result = {
+        "seconds": round(seconds, 6),
+        "min_seconds": round(min(times), 6),
+        "bytes": processed,
+        "mb_per_s": round(processed / 1024 / 1024 / seconds, 2) if processed else None,
+        "files_per_s": round(len(files_info) / seconds, 1),
+        "peak_rss_mb": round(peak_rss / 1024 / 1024, 1) if peak_rss else None,
+        "peak_alloc_mb": round(peak_alloc / 1024 / 1024, 2),
+    }
+    result.update(extra or {})
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(names=None, scale="default", seed=DEFAULT_SEED, repeat=3, isolate=True):
+    """生成合成存档并运行各项测试，返回可保存为JSON的结果
+
+    isolate 为True时每项测试在单独的进程中运行，峰值内存互不影响。
+    """
+    names = names or list(BENCHMARKS)
+    with tempfile.TemporaryDirectory() as tmp:
+        save_dir = Path(tmp) / "Saves_v1"
+        tree = generate_save_tree(save_dir, scale=scale, seed=seed)
+        results = {}
+        for name in names:
+            if isolate:
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--worker", name,
+                     "--save-dir", str(save_dir), "--repeat", str(repeat),
+                     "--latency", str(NETWORK["latency"] * 1000), "--bandwidth", str((NETWORK["bandwidth"] or 0) / 1024 / 1024)],
+                    capture_output=True,
+                    text=True,
+                    check=True
+                ).stdout
+                results[name] = json.loads(output.strip().splitlines()[-1])
+            else:
+                results[name] = run_benchmark(name, save_dir, repeat=repeat)
+            print(f"{name}: {_format_result(results[name])}", file=sys.stderr)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "scale": scale,
+            "seed": seed,
+            "repeat": repeat,
+            "tree": tree,
+            "network": dict(NETWORK),
+        },
+        "results": results,
+    }
+
+
+def _format_result(result):
+    text = f"{result['seconds'] * 1000:.1f} 毫秒"
+    if result.get("mb_per_s"):
+        text += f", {result['mb_per_s']} MB/s"
+    if result.get("round_trips") is not None:
+        text += f", {result['round_trips']} 次往返, 发送 {result['bytes_sent']} 字节, 接收 {result['bytes_received']} 字节"
+    if result.get("peak_rss_mb"):
+        text += f", 峰值内存 {result['peak_rss_mb']} MB"
+    return text + f", 峰值分配 {result['peak_alloc_mb']} MB"
+
+
+def compare(old, new):
+    """比较两次结果的耗时，返回 {测试名: 新耗时/旧耗时}"""
+    ratios = {}
+    for name, result in new["results"].items():
+        before = old["results"].get(name)
+        if before and before["seconds"]:
+            ratios[name] = round(result["seconds"] / before["seconds"], 3)
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description="备份流程性能测试")
+    parser.add_argument("--scale", choices=list(SCALES), default="default", help="合成存档的规模")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--repeat", type=int, default=3, help="每项测试的计时次数，取中位数")
+    parser.add_argument("--only", nargs="*", choices=list(BENCHMARKS), help="只运行指定的测试")
+    parser.add_argument("--out", help="结果JSON路径，默认 benchmark_results/<提交>.json")
+    parser.add_argument("--compare", help="与之前的结果JSON比较耗时")
+    parser.add_argument("--no-isolate", action="store_true", help="所有测试在同一个进程中运行")
+    parser.add_argument("--latency", type=float, default=NETWORK["latency"] * 1000, help="GitAPI 测试的模拟往返延迟（毫秒）")
+    parser.add_argument("--bandwidth", type=float, default=NETWORK["bandwidth"] / 1024 / 1024, help="GitAPI 测试的模拟带宽（MB/s），0 表示不限速")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--save-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    NETWORK["latency"] = args.latency / 1000
+    NETWORK["bandwidth"] = args.bandwidth * 1024 * 1024 or None
+
+    if args.worker:
+        # 由 run_suite 启动的子进程：运行一项测试并输出JSON
+        print(json.dumps(run_benchmark(args.worker, args.save_dir, repeat=args.repeat)))
+        return
+
+    result = run_suite(args.only, scale=args.scale, seed=args.seed, repeat=args.repeat, isolate=not args.no_isolate)
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{result['meta']['commit'] or 'local'}_{args.scale}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, ensure_ascii=False, indent=1), encoding="utf-8")
+    print(f"结果已保存到 {out}")
+
+    if args.compare:
+        old = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        for name, ratio in compare(old, result).items():
+            print(f"{name}: {ratio:.2f}x 耗时（相对 {old['meta'].get('commit')}）")
+
+
+if __name__ == "__main__":
+    main()
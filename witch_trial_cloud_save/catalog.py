@@ -0,0 +1,88 @@
+import json
+import time
+import hashlib
+import platform
+from datetime import datetime
+
+# 仓库根目录下的备份目录文件，每次备份提交时同步更新
+CATALOG_PATH = "index.json"
+CATALOG_VERSION = 1
+
+
+def empty_catalog():
+    return {"version": CATALOG_VERSION, "backups": []}
+
+
+def content_hash(files):
+    """根据文件路径和内容哈希计算整个存档的内容哈希，与备份格式无关"""
+    digest = hashlib.sha256()
+    for entry in sorted(files, key=lambda e: e["path"]):
+        digest.update(f"{entry['path']}\0{entry['sha256']}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def make_entry(name, files, started, backup_format):
+    """生成一条备份记录，耗时在写入提交时由 finalize_entry 计算"""
+    return {
+        "name": name,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "size": sum(entry["size"] for entry in files),
+        "file_count": len(files),
+        "content_hash": content_hash(files),
+        "machine": platform.node(),
+        "format": backup_format,
+        "_started": started
+    }
+
+
+def finalize_entry(entry):
+    """把开始时间换算为备份耗时（秒）"""
+    entry = dict(entry)
+    started = entry.pop("_started", None)
+    if started is not None:
+        entry["duration"] = round(time.time() - started, 3)
+    return entry
+
+
+def parse_catalog(payload):
+    """解析备份目录，格式不正确时返回None"""
+    try:
+        catalog = json.loads(payload.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(catalog, dict) or not isinstance(catalog.get("backups"), list):
+        return None
+    return catalog
+
+
+def dump_catalog(catalog):
+    return json.dumps(catalog, ensure_ascii=False, indent=1).encode('utf-8')
+
+
+def update_catalog(catalog, add=None, remove=()):
+    """添加或删除备份记录，返回新的备份目录"""
+    removed = set(remove)
+    if add is not None:
+        removed.add(add["name"])
+    backups = [entry for entry in catalog.get("backups", []) if entry.get("name") not in removed]
+    if add is not None:
+        backups.append(finalize_entry(add))
+    # 按日期时间排序，最新的在前面
+    backups.sort(key=lambda entry: entry["name"], reverse=True)
+    return {"version": CATALOG_VERSION, "backups": backups}
+
+
+def format_entry(entry):
+    """备份列表中显示的文字"""
+    parts = [entry["name"]]
+    if entry.get("size") is not None:
+        size = entry["size"]
+        if size >= 1024 * 1024:
+            parts.append(f"{size / (1024 * 1024):.1f} MB")
+        else:
+            parts.append(f"{size / 1024:.1f} KB")
+    if entry.get("file_count") is not None:
+        parts.append(f"{entry['file_count']} 个文件")
+    if entry.get("machine"):
+        parts.append(entry["machine"])
+    return "    ".join(parts)
@@ -0,0 +1,501 @@
+import os
+import json
+import bisect
+import zlib
+import hashlib
+from pathlib import Path
+from datetime import datetime
+from file_index import FileIndex, scan_save_dir, read_stable
+from restore_stage import RestoreStage
+import tracing
+
+# 仓库中存放数据块的目录
+CHUNKS_DIR = "chunks"
+# 快照清单文件名
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# 内容定义分块参数（FastCDC 风格的归一化分块）
+MIN_CHUNK_SIZE = 16 * 1024
+AVG_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+
+# 并发下载数据块和快照清单的线程数
+FETCH_WORKERS = 8
+
+_MASK_64 = (1 << 64) - 1
+
+
+def _build_gear_table():
+    """生成固定的 Gear 哈希表，保证不同机器上的切分点一致"""
+    table = []
+    for i in range(256):
+        digest = hashlib.sha256(f"manosaba-gear-{i}".encode()).digest()
+        table.append(int.from_bytes(digest[:8], "little"))
+    return table
+
+
+_GEAR = _build_gear_table()
+
+
+def _make_mask(bits):
+    """取哈希高位作为判定位，高位受最近 64 字节影响"""
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def iter_chunks(data, min_size=MIN_CHUNK_SIZE, avg_size=AVG_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE):
+    """按内容定义分块切分数据，逐个返回 (起始偏移, 长度)
+
+    插入或删除少量字节只会影响附近的切分点，未变化的区域仍会得到相同的数据块。
+    安装了 numpy 时批量计算哈希，否则逐字节计算，两者的切分点完全相同。
+    """
+    if len(data) <= min_size:
+        if data:
+            yield 0, len(data)
+        return
+    numpy = _load_numpy()
+    if numpy is None:
+        yield from _iter_chunks_python(data, min_size, avg_size, max_size)
+    else:
+        yield from _iter_chunks_numpy(numpy, data, min_size, avg_size, max_size)
+
+
+def _masks(avg_size):
+    bits = avg_size.bit_length() - 1
+    # 平均长度之前使用更严格的掩码，之后使用更宽松的掩码，使块长度更集中
+    return _make_mask(bits + 1), _make_mask(bits - 1)
+
+
+def _iter_chunks_python(data, min_size, avg_size, max_size):
+    length = len(data)
+    mask_strict, mask_loose = _masks(avg_size)
+    gear = _GEAR
+    mask_64 = _MASK_64
+
+    start = 0
+    while start < length:
+        remaining = length - start
+        if remaining <= min_size:
+            yield start, remaining
+            return
+
+        end = start + min(remaining, max_size)
+        normal = start + min(remaining, avg_size)
+        h = 0
+        cut = end
+        # 最小块长度以内不可能切分，直接跳过
+        scan = start + min_size
+        for i, byte in enumerate(data[scan:normal], scan):
+            h = ((h << 1) + gear[byte]) & mask_64
+            if not h & mask_strict:
+                cut = i + 1
+                break
+        else:
+            scan = max(scan, normal)
+            for i, byte in enumerate(data[scan:end], scan):
+                h = ((h << 1) + gear[byte]) & mask_64
+                if not h & mask_loose:
+                    cut = i + 1
+                    break
+
+        yield start, cut - start
+        start = cut
+
+
+# 哈希每次左移一位，64位之后最早的字节已被移出，位置 i 的哈希只取决于之前 64 个字节
+_WINDOW = 64
+# numpy 每次计算哈希的字节数，限制临时数组的内存占用
+_NUMPY_BLOCK = 1024 * 1024
+
+_numpy = None
+
+
+def _load_numpy():
+    """numpy 是可选依赖，只在第一次分块时尝试导入"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+def _candidates(numpy, data, mask_strict, mask_loose):
+    """计算每个位置完整 64 字节窗口的哈希，返回满足宽松掩码和严格掩码的位置列表
+
+    窗口哈希用倍增法计算：窗口为 w 的哈希加上左移 w 位的前 w 个位置的哈希，
+    得到窗口为 2w 的哈希，6 次后窗口为 64。严格掩码的位数更多，满足它的位置
+    一定也满足宽松掩码。
+    """
+    table = numpy.array(_GEAR, dtype=numpy.uint64)
+    view = numpy.frombuffer(data, dtype=numpy.uint8)
+    strict = []
+    loose = []
+    for block_start in range(0, len(view), _NUMPY_BLOCK):
+        # 向前多取 63 个字节，使块开头的位置也是完整窗口
+        lo = max(0, block_start - (_WINDOW - 1))
+        h = table[view[lo:block_start + _NUMPY_BLOCK]]
+        width = 1
+        while width < _WINDOW:
+            h[width:] += h[:-width] << numpy.uint64(width)
+            width *= 2
+        h = h[block_start - lo:]
+        found = numpy.flatnonzero((h & numpy.uint64(mask_loose)) == 0)
+        hashes = h[found]
+        found += block_start
+        loose.extend(found.tolist())
+        strict.extend(found[(hashes & numpy.uint64(mask_strict)) == 0].tolist())
+    return strict, loose
+
+
+def _iter_chunks_numpy(numpy, data, min_size, avg_size, max_size):
+    """与 _iter_chunks_python 的结果相同
+
+    每个块从 start + min_size 开始计算哈希，前 63 个位置的窗口不完整，逐字节计算；
+    之后的位置哈希与完整窗口哈希相同，直接在预先算好的候选位置中查找。
+    """
+    length = len(data)
+    mask_strict, mask_loose = _masks(avg_size)
+    strict, loose = _candidates(numpy, data, mask_strict, mask_loose)
+    gear = _GEAR
+    mask_64 = _MASK_64
+
+    start = 0
+    while start < length:
+        remaining = length - start
+        if remaining <= min_size:
+            yield start, remaining
+            return
+
+        end = start + min(remaining, max_size)
+        normal = start + min(remaining, avg_size)
+        scan = start + min_size
+        full = min(scan + _WINDOW - 1, end)
+        h = 0
+        cut = None
+        for i in range(scan, full):
+            h = ((h << 1) + gear[data[i]]) & mask_64
+            if not h & (mask_strict if i < normal else mask_loose):
+                cut = i + 1
+                break
+
+        if cut is None:
+            j = bisect.bisect_left(strict, full)
+            if j < len(strict) and strict[j] < normal:
+                cut = strict[j] + 1
+            else:
+                j = bisect.bisect_left(loose, max(full, normal))
+                cut = loose[j] + 1 if j < len(loose) and loose[j] < end else end
+
+        yield start, cut - start
+        start = cut
+
+
+def chunk_path(chunk_hash):
+    """数据块在仓库中的路径，按哈希前两位分目录"""
+    return f"{CHUNKS_DIR}/{chunk_hash[:2]}/{chunk_hash}"
+
+
+def encode_chunk(data):
+    """压缩数据块用于上传"""
+    return zlib.compress(data, 6)
+
+
+def decode_chunk(payload, expected_hash=None):
+    """解压数据块并校验哈希"""
+    data = zlib.decompress(payload)
+    if expected_hash and hashlib.sha256(data).hexdigest() != expected_hash:
+        raise ValueError(f"数据块校验失败: {expected_hash}")
+    return data
+
+
+class ChunkStore:
+    def __init__(self, git_api, debug=False):
+        """基于内容寻址的数据块存储，快照只保存一个记录块哈希的清单"""
+        self.git_api = git_api
+        self.debug = debug
+
+    @staticmethod
+    def _chunk_file(src_path, chunks):
+        """读取单个文件并切分，数据块写入 chunks，返回 (块哈希列表, 文件SHA256, 大小, 修改时间纳秒)"""
+        data, stat = read_stable(src_path)
+
+        chunk_hashes = []
+        for offset, size in iter_chunks(data):
+            piece = data[offset:offset + size]
+            chunk_hash = hashlib.sha256(piece).hexdigest()
+            chunks.setdefault(chunk_hash, piece)
+            chunk_hashes.append(chunk_hash)
+        return chunk_hashes, hashlib.sha256(data).hexdigest(), len(data), stat.st_mtime_ns
+
+    @staticmethod
+    def build_snapshot(save_dir, previous=None, files_info=None, debug=False):
+        """扫描存档目录，返回 (清单, {块哈希: 块数据})
+
+        previous 为文件索引中上次上传的状态，大小和修改时间未变的文件直接沿用
+        上次的块列表，不再读取内容，因此 chunks 中只包含变化文件的数据块。
+        files_info 为已扫描的 {相对路径: (大小, 修改时间纳秒)}，省略时扫描整个目录。
+        文件一直被占用（PermissionError）或一直在被写入（TornReadError）时抛出异常，
+        放弃本次快照：恢复时会替换整个存档目录，缺少文件的快照会删掉用户的存档。
+        """
+        previous = previous or {}
+        files = []
+        chunks = {}
+        total_size = 0
+        reused = 0
+
+        if files_info is None:
+            files_info = scan_save_dir(save_dir)
+
+        for rel_path, (size, mtime_ns) in sorted(files_info.items()):
+            old = previous.get(rel_path)
+            if FileIndex.stat_matches(old, size, mtime_ns) and old.get("chunks") is not None:
+                files.append(old)
+                total_size += size
+                reused += 1
+                continue
+
+            src_path = os.path.join(save_dir, rel_path)
+            try:
+                # 记录读取时的大小和修改时间，扫描后又被写入的文件以实际读到的内容为准
+                chunk_hashes, sha256, size, mtime_ns = ChunkStore._chunk_file(src_path, chunks)
+            except FileNotFoundError:
+                # 扫描后被删除的文件不在存档中，清单里也不应有它
+                if debug:
+                    print(f"[调试] 文件已被删除，跳过: {src_path}")
+                continue
+
+            files.append({
+                "path": rel_path,
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "sha256": sha256,
+                "chunks": chunk_hashes
+            })
+            total_size += size
+
+            if debug:
+                print(f"[调试] 分块文件: {rel_path}, 大小: {size}字节, 块数: {len(chunk_hashes)}")
+
+        if debug:
+            print(f"[调试] 未变化文件: {reused}, 重新读取: {len(files) - reused}")
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "created": datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
+            "total_size": total_size,
+            "files": files
+        }
+        return manifest, chunks
+
+    def upload_snapshot(self, save_dir, manifest, chunks, snapshot_name, message, catalog_entry=None):
+        """上传快照：远端缺失的数据块、清单和备份目录记录在一次提交中写入
+
+        成功时返回统计信息字典，失败时返回 None
+        """
+        if self.debug:
+            print(f"[调试] 上传快照 - 存档目录: {save_dir}, 快照名: {snapshot_name}")
+
+        manifest["created"] = snapshot_name
+
+        remote_chunks = self.git_api.list_chunk_hashes()
+        if remote_chunks is None:
+            if self.debug:
+                print(f"[调试] 无法获取远端数据块列表，将上传全部数据块")
+            remote_chunks = set()
+
+        # 保持清单中的顺序去重
+        missing = list(dict.fromkeys(
+            h for entry in manifest["files"] for h in entry["chunks"] if h not in remote_chunks
+        ))
+        missing_set = set(missing)
+
+        # 未变化的文件没有被读取，但远端可能已缺少它们的数据块（例如备份被全部删除），需补读
+        for entry in manifest["files"]:
+            if any(h in missing_set and h not in chunks for h in entry["chunks"]):
+                if self.debug:
+                    print(f"[调试] 远端缺少未变化文件的数据块，重新读取: {entry['path']}")
+                try:
+                    chunk_hashes, sha256, size, mtime_ns = self._chunk_file(os.path.join(save_dir, entry["path"]), chunks)
+                except OSError as e:
+                    if self.debug:
+                        print(f"[调试] 读取文件失败: {entry['path']}, 错误信息: {e}")
+                    return None
+                if sha256 != entry["sha256"]:
+                    # 文件在扫描后又被修改，本次快照不再一致
+                    return None
+
+        if self.debug:
+            print(f"[调试] 需要上传的数据块: {len(missing)}")
+
+        # 缺失的数据块和清单在同一次提交中写入
+        files = {chunk_path(h): encode_chunk(chunks[h]) for h in missing}
+        files[f"{snapshot_name}/{MANIFEST_NAME}"] = json.dumps(manifest, ensure_ascii=False, indent=1).encode('utf-8')
+        uploaded_bytes = sum(len(data) for data in files.values())
+
+        builder = self.git_api.new_commit(message)
+        for repo_path, data in files.items():
+            builder.add_file(repo_path, data)
+        if catalog_entry is not None:
+            self.git_api.stage_catalog_update(builder, add=catalog_entry)
+
+        if builder.commit() is None:
+            if not builder.branch_missing:
+                if self.debug:
+                    print(f"[调试] 快照提交失败: {snapshot_name}")
+                return None
+            # 空仓库没有分支：先通过内容API创建第一个文件，再一次性提交其余文件
+            first_path = next(iter(files))
+            if not self.git_api.upload_bytes(first_path, files[first_path], message):
+                return None
+            builder = self.git_api.new_commit(message)
+            for repo_path, data in files.items():
+                if repo_path != first_path:
+                    builder.add_file(repo_path, data)
+            if catalog_entry is not None:
+                self.git_api.stage_catalog_update(builder, add=catalog_entry)
+            if (len(files) > 1 or catalog_entry is not None) and builder.commit() is None:
+                if self.debug:
+                    print(f"[调试] 快照提交失败: {snapshot_name}")
+                return None
+
+        stats = {
+            "uploaded_chunks": len(missing),
+            "uploaded_bytes": uploaded_bytes,
+            "total_size": manifest["total_size"]
+        }
+        if self.debug:
+            print(f"[调试] 快照上传成功: {stats}")
+        return stats
+
+    def fetch_manifest(self, snapshot_name):
+        """下载快照清单，旧版 zip 备份或下载失败时返回 None"""
+        payload = self.git_api.get_file_bytes(f"{snapshot_name}/{MANIFEST_NAME}")
+        if payload is None:
+            return None
+        try:
+            return json.loads(payload.decode('utf-8'))
+        except ValueError as e:
+            if self.debug:
+                print(f"[调试] 快照清单解析失败: {e}")
+            return None
+
+    def fetch_chunks(self, manifest):
+        """并发下载清单引用的全部数据块，任一失败则返回 None"""
+        from concurrent.futures import ThreadPoolExecutor
+        hashes = list(dict.fromkeys(h for entry in manifest.get("files", []) for h in entry["chunks"]))
+        if not hashes:
+            return {}
+        # 工作线程中的请求记录在当前追踪段下
+        parent = tracing.current()
+
+        def fetch(chunk_hash):
+            with tracing.span("chunk", parent=parent):
+                payload = self.git_api.get_file_bytes(chunk_path(chunk_hash))
+            if payload is None:
+                if self.debug:
+                    print(f"[调试] 数据块下载失败: {chunk_hash}")
+                return None
+            return decode_chunk(payload, chunk_hash)
+
+        with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(hashes))) as executor:
+            results = list(executor.map(fetch, hashes))
+        if any(data is None for data in results):
+            return None
+        return dict(zip(hashes, results))
+
+    def collect_garbage(self):
+        """删除不再被任何快照清单引用的数据块，返回删除的块数，失败时返回 None
+
+        删除备份只删除备份文件夹，数据块可能仍被其他快照引用，需要读取所有剩余
+        快照的清单才能确定哪些块可以删除。列表和清单都读取同一个提交，分支在此
+        期间被更新（例如其他设备上传了引用这些块的快照）时放弃本次清理。
+        """
+        head_sha = self.git_api.get_head()
+        if head_sha is None:
+            return None
+        files = self.git_api.list_tree(ref=head_sha)
+        if files is None:
+            return None
+
+        stored = {path.rsplit("/", 1)[-1]: path for path in files if path.startswith(f"{CHUNKS_DIR}/")}
+        if not stored:
+            return 0
+        manifests = [path for path in files if path.count("/") == 1 and path.endswith(f"/{MANIFEST_NAME}")]
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        def load(path):
+            payload = self.git_api.get_file_bytes(path, ref=head_sha)
+            if payload is None:
+                return None
+            try:
+                return json.loads(payload.decode('utf-8'))
+            except ValueError:
+                return None
+
+        referenced = set()
+        if manifests:
+            with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(manifests))) as executor:
+                for path, manifest in zip(manifests, executor.map(load, manifests)):
+                    if manifest is None:
+                        # 无法确认这个快照引用了哪些块，不能删除任何块
+                        if self.debug:
+                            print(f"[调试] 读取快照清单失败，跳过清理: {path}")
+                        return None
+                    referenced.update(h for entry in manifest.get("files", []) for h in entry["chunks"])
+
+        unused = sorted(set(stored) - referenced)
+        if self.debug:
+            print(f"[调试] 远端数据块: {len(stored)}, 未被引用: {len(unused)}")
+        if not unused:
+            return 0
+
+        builder = self.git_api.new_commit(f"清理 {len(unused)} 个未引用的数据块", base=head_sha)
+        for chunk_hash in unused:
+            builder.delete_file(stored[chunk_hash])
+        if builder.commit() is None:
+            return None
+        return len(unused)
+
+    @staticmethod
+    def restore_snapshot(manifest, chunks, save_dir, debug=False):
+        """按清单把数据块拼回存档文件，返回是否实际替换了存档
+
+        文件在暂存目录中拼接并校验，与当前存档相同的文件不重新写入，全部
+        成功后才替换存档目录。
+        """
+        if debug:
+            print(f"[调试] 恢复快照 - 目标目录: {save_dir}")
+
+        with RestoreStage(save_dir, debug=debug) as stage:
+            for entry in manifest.get("files", []):
+                if stage.keep(entry["path"], size=entry["size"], sha256=entry["sha256"]):
+                    continue
+
+                dst_path = stage.path(entry["path"])
+                digest = hashlib.sha256()
+                with open(dst_path, 'wb') as f:
+                    for chunk_hash in entry["chunks"]:
+                        data = chunks[chunk_hash]
+                        digest.update(data)
+                        f.write(data)
+
+                if digest.hexdigest() != entry["sha256"]:
+                    raise ValueError(f"文件校验失败: {entry['path']}")
+
+                # 还原修改时间，使恢复后的文件与文件索引一致，下次备份无需重新读取
+                if entry.get("mtime_ns"):
+                    os.utime(dst_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+                if debug:
+                    print(f"[调试] 恢复文件: {entry['path']}")
+
+            replaced = stage.commit()
+
+        if debug:
+            print(f"[调试] 快照恢复成功")
+
+        return replaced
@@ -1,12 +1,317 @@
 import os
+import json
+import time
+import zlib
+import mmap
+import hashlib
+import struct
 import zipfile
-import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
+from file_index import read_stable, open_stable, check_unchanged
+from restore_stage import RestoreStage
+from delta import encode_delta, delta_blocks, apply_delta, DELTA_DIR, DELTA_INDEX, DELTA_INDEX_VERSION, KEYFRAME_INTERVAL, DELTA_MAX_RATIO, DELTA_MAX_FILE_SIZE
+import tracing
+
+try:
+    import zstandard
+except ImportError:
+    # zstd是可选依赖，未安装时不提供该压缩方式
+    zstandard = None
+
+# 流式压缩时每次产出的数据块大小
+STREAM_BLOCK_SIZE = 256 * 1024
+# 不超过此大小的文件整体读入内存后再压缩，可以在读到写了一半的文件时重新读取
+STABLE_READ_LIMIT = 32 * 1024 * 1024
+
+# zip格式中zstd的压缩方法编号（APPNOTE 4.4.5）
+ZIP_ZSTD = 93
+
+# 可选的压缩方式，auto 为按文件自动选择
+CODECS = ["store"] + [f"deflate-{level}" for level in range(1, 10)] + ["lzma", "zstd"]
+DEFAULT_CODEC = "auto"
+# 自动选择时比较的压缩方式
+AUTO_CANDIDATES = ["deflate-1", "deflate-6", "deflate-9", "lzma", "zstd"]
+# 自动选择时假定的上传速度（字节/秒），用于在压缩耗时和上传字节之间取舍
+AUTO_UPLOAD_SPEED = 1024 * 1024
+
+# 小于此大小的文件压缩节省的字节抵不过开销，直接存储
+MIN_COMPRESS_SIZE = 256
+# 采样时从文件开头、中间、末尾各取一段
+SAMPLE_SIZE = 16 * 1024
+# 样本快速压缩后仍大于此比例，认为是已压缩或加密的数据，直接存储
+INCOMPRESSIBLE_RATIO = 0.95
+
+
+def default_workers():
+    """默认压缩线程数：保留一半CPU核心给正在运行的游戏"""
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def available_codecs():
+    """当前环境可用的压缩方式"""
+    return [codec for codec in CODECS if codec != "zstd" or zstandard is not None]
+
+
+def _codec_method(codec):
+    """压缩方式对应的zip压缩方法编号和标志位"""
+    if codec == "store":
+        return zipfile.ZIP_STORED, 0
+    if codec.startswith("deflate-"):
+        return zipfile.ZIP_DEFLATED, 0
+    if codec == "lzma":
+        # LZMA数据带结束标记
+        return zipfile.ZIP_LZMA, 0x02
+    if codec == "zstd":
+        return ZIP_ZSTD, 0
+    raise ValueError(f"未知的压缩方式: {codec}")
+
+
+def _compressor(codec):
+    """返回带 compress()/flush() 的流式压缩器，直接存储时返回None"""
+    if codec == "store":
+        return None
+    if codec.startswith("deflate-"):
+        # zip中的deflate数据不带zlib头
+        return zlib.compressobj(int(codec[len("deflate-"):]), zlib.DEFLATED, -15)
+    if codec == "lzma":
+        return zipfile.LZMACompressor()
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    raise ValueError(f"未知的压缩方式: {codec}")
+
+
+def compress_data(data, codec):
+    """用指定方式压缩整段数据"""
+    compressor = _compressor(codec)
+    if compressor is None:
+        return data
+    return compressor.compress(data) + compressor.flush()
+
+
+def _sample(data):
+    """取文件开头、中间、末尾各一段作为样本"""
+    if len(data) <= SAMPLE_SIZE * 4:
+        return data
+    middle = len(data) // 2 - SAMPLE_SIZE // 2
+    return data[:SAMPLE_SIZE] + data[middle:middle + SAMPLE_SIZE] + data[-SAMPLE_SIZE:]
+
+
+def choose_codec(data, codec=DEFAULT_CODEC, total_size=None):
+    """为单个文件选择压缩方式
+
+    太小的文件和采样后不可压缩的文件直接存储；auto 时在样本上试压缩各候选方式，
+    按 压缩耗时 + 压缩后大小 / 上传速度 估算整个文件的代价，选择代价最小的。
+    data 可以只是文件的开头部分，此时 total_size 为文件的实际大小。
+    """
+    total_size = len(data) if total_size is None else total_size
+    if codec == "store" or total_size < MIN_COMPRESS_SIZE or not data:
+        return "store"
+    if codec == "zstd" and zstandard is None:
+        codec = "deflate-6"
+
+    sample = _sample(data)
+    if len(compress_data(sample, "deflate-1")) > len(sample) * INCOMPRESSIBLE_RATIO:
+        return "store"
+    if codec != "auto":
+        return codec
+
+    scale = total_size / len(sample)
+    best, best_cost = "store", total_size / AUTO_UPLOAD_SPEED
+    for candidate in AUTO_CANDIDATES:
+        if candidate not in available_codecs():
+            continue
+        started = time.perf_counter()
+        size = len(compress_data(sample, candidate))
+        cost = (time.perf_counter() - started + size / AUTO_UPLOAD_SPEED) * scale
+        if cost < best_cost:
+            best, best_cost = candidate, cost
+    return best
+
+
+def encode_entry(data, codec=DEFAULT_CODEC):
+    """压缩单个文件的内容，返回 (实际使用的压缩方式, 压缩后的数据)"""
+    used = choose_codec(data, codec)
+    payload = compress_data(data, used)
+    if used != "store" and len(payload) >= len(data):
+        return "store", data
+    return used, payload
+
+
+def _zip_date_time(mtime):
+    """zip格式只能记录1980年以后的时间"""
+    return max(datetime.fromtimestamp(mtime).timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+
+
+def _data_offset(view, member):
+    """条目压缩数据在压缩包中的起始位置（跳过本地文件头）"""
+    offset = member.header_offset
+    if view[offset:offset + 4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"条目头损坏: {member.filename}")
+    name_length, extra_length = struct.unpack_from("<HH", view, offset + 26)
+    return offset + 30 + name_length + extra_length
+
+
+def _iter_decompressed(method, raw, block_size=STREAM_BLOCK_SIZE):
+    """逐块解压条目的原始数据，raw 为压缩包内存映射的切片
+
+    不在外部保留 raw 的子切片，raw 释放后内存映射就可以关闭。
+    """
+    if method == zipfile.ZIP_STORED:
+        # 未压缩的条目直接写出映射的数据，不复制
+        yield raw
+        return
+    
+    if method == zipfile.ZIP_DEFLATED:
+        decompressor = zlib.decompressobj(-15)
+    elif method == zipfile.ZIP_LZMA:
+        decompressor = zipfile.LZMADecompressor()
+    elif method == ZIP_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("该备份使用zstd压缩，请先安装 zstandard")
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    else:
+        raise zipfile.BadZipFile(f"不支持的压缩方式: {method}")
+    
+    for start in range(0, len(raw), block_size):
+        block = decompressor.decompress(raw[start:start + block_size])
+        if block:
+            yield block
+    if method == zipfile.ZIP_DEFLATED:
+        block = decompressor.flush()
+        if block:
+            yield block
+
+
+def _preallocate(f, size):
+    """预先分配输出文件的空间，减少边写边扩展造成的碎片"""
+    if size <= 0:
+        return
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except OSError:
+            pass
+    else:
+        # Windows上设置文件末尾即可一次分配空间
+        f.truncate(size)
+
+
+class _ZipWriter:
+    """把压缩好的条目依次拼接成zip文件，写好的字节通过 pop() 逐段取出
+
+    zipfile 只能用自己支持的方法压缩，这里直接写入各种方式压缩好的数据，
+    压缩包仍是标准格式，zstd条目由 restore_backup 自行解压。
+    """
+    
+    def __init__(self):
+        self._parts = []
+        self.size = 0
+        self._offset = 0
+        self._entries = []
+        self._current = None
+    
+    def _write(self, data):
+        if data:
+            self._parts.append(data)
+            self.size += len(data)
+            self._offset += len(data)
+    
+    def pop(self):
+        """取出已写入的数据并清空缓冲区"""
+        data = b"".join(self._parts)
+        self._parts = []
+        self.size = 0
+        return data
+    
+    @staticmethod
+    def _version(method):
+        return 63 if method in (zipfile.ZIP_LZMA, ZIP_ZSTD) else 20
+    
+    def _local_header(self, name, date_time, method, flag_bits, crc, compress_size, file_size):
+        try:
+            name_bytes = name.encode('ascii')
+        except UnicodeEncodeError:
+            # 非ASCII文件名使用UTF-8编码并设置标志位
+            name_bytes = name.encode('utf-8')
+            flag_bits |= 0x800
+        dos_time = (date_time[3] << 11) | (date_time[4] << 5) | (date_time[5] // 2)
+        dos_date = ((date_time[0] - 1980) << 9) | (date_time[1] << 5) | date_time[2]
+        entry = {
+            "name": name_bytes,
+            "flag_bits": flag_bits,
+            "method": method,
+            "dos_time": dos_time,
+            "dos_date": dos_date,
+            "offset": self._offset
+        }
+        self._write(struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034b50, self._version(method), flag_bits, method, dos_time, dos_date,
+            crc, compress_size, file_size, len(name_bytes), 0
+        ) + name_bytes)
+        return entry
+    
+    @staticmethod
+    def _check_size(*sizes):
+        if any(size >= 0xFFFFFFFF for size in sizes):
+            raise ValueError("不支持超过4GB的文件")
+    
+    def add_entry(self, name, date_time, method, flag_bits, crc, file_size, payload):
+        """写入一个已经压缩好的条目"""
+        self._check_size(file_size, len(payload), self._offset)
+        entry = self._local_header(name, date_time, method, flag_bits, crc, len(payload), file_size)
+        self._write(payload)
+        entry.update(crc=crc, compress_size=len(payload), file_size=file_size)
+        self._entries.append(entry)
+    
+    def begin_entry(self, name, date_time, method, flag_bits):
+        """开始写入大小未知的条目，数据用 write() 写入，最后调用 end_entry()"""
+        self._check_size(self._offset)
+        # 使用数据描述符，CRC和大小写在数据之后
+        self._current = self._local_header(name, date_time, method, flag_bits | 0x08, 0, 0, 0)
+        self._current["compress_size"] = 0
+    
+    def write(self, data):
+        self._current["compress_size"] += len(data)
+        self._write(data)
+    
+    def end_entry(self, crc, file_size):
+        """写入数据描述符，返回条目压缩后的大小"""
+        entry = self._current
+        self._current = None
+        self._check_size(file_size, entry["compress_size"])
+        entry.update(crc=crc, file_size=file_size)
+        self._write(struct.pack("<IIII", 0x08074b50, crc, entry["compress_size"], file_size))
+        self._entries.append(entry)
+        return entry["compress_size"]
+    
+    def finish(self):
+        """写入中央目录和目录结束记录"""
+        if len(self._entries) >= 0xFFFF:
+            raise ValueError("压缩包中的文件过多")
+        central_offset = self._offset
+        for entry in self._entries:
+            version = self._version(entry["method"])
+            self._write(struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                0x02014b50, version, version, entry["flag_bits"], entry["method"],
+                entry["dos_time"], entry["dos_date"], entry["crc"], entry["compress_size"],
+                entry["file_size"], len(entry["name"]), 0, 0, 0, 0, 0, entry["offset"]
+            ) + entry["name"])
+        central_size = self._offset - central_offset
+        self._check_size(central_offset + central_size)
+        self._write(struct.pack(
+            "<IHHHHIIH",
+            0x06054b50, 0, 0, len(self._entries), len(self._entries), central_size, central_offset, 0
+        ))
+
 
 class CompressManager:
     @staticmethod
-    def create_backup(save_dir, output_dir, debug=False):
+    def create_backup(save_dir, output_dir, codec=DEFAULT_CODEC, workers=None, base=None, debug=False):
         """创建存档的压缩包备份"""
         if debug:
             print(f"[调试] 创建备份 - 存档目录: {save_dir}, 输出目录: {output_dir}")
@@ -25,97 +330,355 @@ class CompressManager:
         if debug:
             print(f"[调试] 创建压缩包: {zip_path}")
         
-        # 解决文件被占用问题：先复制到临时目录，再压缩
-        import tempfile
-        with tempfile.TemporaryDirectory() as temp_copy_dir:
+        with open(zip_path, 'wb') as f:
+            for block in CompressManager.iter_backup(save_dir, codec=codec, workers=workers, base=base, debug=debug):
+                f.write(block)
+        
+        if debug:
+            print(f"[调试] 备份创建成功: {zip_path}")
+        
+        return zip_path
+    
+    @staticmethod
+    def _backup_files(save_dir, paths=None):
+        """返回要打包的 (文件路径, 压缩包内路径) 列表，按路径排序"""
+        if paths is not None:
+            return [(os.path.join(save_dir, rel_path), rel_path) for rel_path in sorted(paths)]
+        
+        result = []
+        for root, dirs, files in os.walk(save_dir):
+            for file in files:
+                file_path = os.path.join(root, file)
+                # 计算相对路径，保持目录结构
+                rel_path = Path(os.path.relpath(file_path, save_dir)).as_posix()
+                result.append((file_path, rel_path))
+        result.sort(key=lambda item: item[1])
+        return result
+    
+    @staticmethod
+    def _prepare_entry(file_path, rel_path, codec, base=None, debug=False):
+        """读取并压缩单个文件，在线程池中执行
+
+        返回 (stat, SHA256, 压缩方式, CRC, 压缩前大小, 压缩后的数据, 增量信息)；使用增量时
+        压缩的是相对基准的增量数据，增量信息为记录到增量索引中的字典，否则为None。
+        超过 STABLE_READ_LIMIT 的文件返回全为None的元组，由调用方按顺序流式写入；
+        扫描后已被删除的文件返回None。文件一直被占用（PermissionError）或一直在被写入
+        （TornReadError）时抛出异常，放弃本次备份，不能上传缺少文件的压缩包。
+        """
+        try:
+            if os.path.getsize(file_path) > STABLE_READ_LIMIT:
+                return None, None, None, None, None, None, None
+            # 一次读入内存并确认读取前后没有被写入，读到写了一半的文件时重新读取
+            data, stat = read_stable(file_path)
+        except FileNotFoundError:
             if debug:
-                print(f"[调试] 创建临时复制目录: {temp_copy_dir}")
-            
-            # 复制存档目录到临时目录
-            temp_save_dir = Path(temp_copy_dir) / "Saves_v1"
-            temp_save_dir.mkdir(parents=True, exist_ok=True)
-            
+                print(f"[调试] 文件已被删除，跳过: {file_path}")
+            return None
+        
+        # 内容哈希在同一次读取中计算，不再单独读取文件
+        sha256 = hashlib.sha256(data).hexdigest()
+        content, delta_info = data, None
+        # 很大的文件不计算增量，也不作为下一次的基准
+        if base is not None and len(data) <= DELTA_MAX_FILE_SIZE:
+            depth = 0
+            blocks = None
+            found = base.lookup(rel_path)
+            # 连续增量次数达到上限时写入完整文件（关键帧）
+            if found is not None and found[2] + 1 < KEYFRAME_INTERVAL:
+                base_data, base_sha256, base_depth, base_blocks = found
+                blocks = delta_blocks(data)
+                delta = encode_delta(base_data, data, base_blocks, blocks)
+                if len(delta) < len(data) * DELTA_MAX_RATIO:
+                    depth = base_depth + 1
+                    content = delta
+                    delta_info = {"base_sha256": base_sha256, "sha256": sha256, "depth": depth}
+            base.note(rel_path, data, sha256, depth, blocks)
+        
+        used, payload = encode_entry(content, codec)
+        return stat, sha256, used, zlib.crc32(content), len(content), payload, delta_info
+    
+    @staticmethod
+    def _stream_entry(writer, file_path, rel_path, codec, block_size, debug=False):
+        """流式压缩大文件写入压缩包，逐块产出写好的数据，最后返回 (stat, SHA256, 压缩方式, 压缩后大小)"""
+        try:
+            # 大文件流式读取，共享冲突时等待重试
+            src, stat = open_stable(file_path)
+        except FileNotFoundError:
             if debug:
-                print(f"[调试] 临时存档目录: {temp_save_dir}")
+                print(f"[调试] 文件已被删除，跳过: {file_path}")
+            return None
+        
+        with src:
+            block = src.read(block_size)
+            # 大文件根据第一个数据块选择压缩方式
+            used = choose_codec(block, codec, total_size=stat.st_size)
+            method, flag_bits = _codec_method(used)
+            compressor = _compressor(used)
+            writer.begin_entry(rel_path, _zip_date_time(stat.st_mtime), method, flag_bits)
+            crc = 0
+            file_size = 0
+            digest = hashlib.sha256()
+            while block:
+                crc = zlib.crc32(block, crc)
+                digest.update(block)
+                file_size += len(block)
+                writer.write(compressor.compress(block) if compressor else block)
+                if writer.size >= block_size:
+                    yield writer.pop()
+                block = src.read(block_size)
+            if compressor:
+                writer.write(compressor.flush())
+            compress_size = writer.end_entry(crc, file_size)
+        # 压缩包已经开始上传，无法撤回写入一半的条目，只能放弃本次备份
+        check_unchanged(file_path, stat)
+        return stat, digest.hexdigest(), used, compress_size
+    
+    @staticmethod
+    def iter_backup(save_dir, paths=None, codec=DEFAULT_CODEC, workers=None, base=None, debug=False, block_size=STREAM_BLOCK_SIZE, written=None):
+        """以生成器的形式逐块产出存档的压缩包数据
+
+        直接读取存档文件写入压缩流，不复制到临时目录，也不在磁盘上生成压缩包，
+        可以直接作为HTTP请求体上传。
+        paths 为要打包的相对路径列表（如文件索引中的文件），省略时打包整个目录。
+        codec 为压缩方式（见 CODECS），auto 时按文件自动选择。
+        各文件在 workers 个线程中并行读取和压缩（zlib、lzma、zstd压缩时释放GIL），
+        再按路径顺序写入压缩包，结果与单线程完全相同；同时处理的文件数有上限，
+        内存占用不随文件数量增长。
+        base 为 delta.DeltaBase 时，变化不大的文件只写入相对上一次备份的增量
+        （.delta 目录下），恢复时需要沿增量链读取之前的备份。
+        written 为列表时，依次追加实际写入压缩包的文件状态（与 FileIndex 的记录格式相同，
+        哈希在读取文件时顺便计算），扫描后被删除的文件不在其中。
+        """
+        workers = default_workers() if not workers else workers
+        writer = _ZipWriter()
+        delta_files = {}
+        if base is not None:
+            base.begin()
+        files = iter(CompressManager._backup_files(save_dir, paths))
+        pending = deque()
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compress") as executor:
+            def fill():
+                # 最多提前处理 workers * 2 个文件
+                while len(pending) < workers * 2:
+                    item = next(files, None)
+                    if item is None:
+                        return
+                    pending.append((item, executor.submit(CompressManager._prepare_entry, item[0], item[1], codec, base, debug)))
             
-            # 遍历存档目录并复制文件到临时目录
-            for root, dirs, files in os.walk(save_dir):
-                for file in files:
-                    src_path = os.path.join(root, file)
-                    # 计算相对路径，保持目录结构
-                    rel_path = os.path.relpath(src_path, save_dir)
-                    dst_path = os.path.join(temp_save_dir, rel_path)
+            try:
+                fill()
+                while pending:
+                    (file_path, rel_path), future = pending.popleft()
+                    prepared = future.result()
+                    fill()
                     
-                    # 确保目标目录存在
-                    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-                    
-                    try:
-                        # 复制文件
-                        import shutil
-                        shutil.copy2(src_path, dst_path)
-                        if debug:
-                            print(f"[调试] 复制文件: {src_path} -> {dst_path}")
-                    except PermissionError as e:
-                        if debug:
-                            print(f"[调试] 复制文件失败，权限被拒绝: {src_path}")
-                            print(f"[调试] 错误信息: {e}")
-                        # 尝试跳过被占用的文件，继续复制其他文件
-                        continue
-                    except Exception as e:
-                        if debug:
-                            print(f"[调试] 复制文件失败: {src_path}")
-                            print(f"[调试] 错误信息: {e}")
-                        # 尝试跳过失败的文件，继续复制其他文件
+                    if prepared is None:
                         continue
-            
-            # 创建压缩包（使用临时复制的文件）
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # 遍历临时存档目录并添加到压缩包
-                for root, dirs, files in os.walk(temp_save_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        # 计算相对路径，保持目录结构
-                        rel_path = os.path.relpath(file_path, temp_save_dir)
-                        zipf.write(file_path, rel_path)
-                        
-                        if debug:
-                            print(f"[调试] 添加文件到压缩包: {rel_path}")
+                    
+                    stat, sha256, used, crc, size, payload, delta_info = prepared
+                    if stat is None:
+                        streamed = yield from CompressManager._stream_entry(writer, file_path, rel_path, codec, block_size, debug)
+                        if streamed is None:
+                            continue
+                        stat, sha256, used, compress_size = streamed
+                    else:
+                        name = rel_path
+                        if delta_info is not None:
+                            name = f"{DELTA_DIR}/{rel_path}"
+                            delta_files[rel_path] = delta_info
+                        method, flag_bits = _codec_method(used)
+                        writer.add_entry(name, _zip_date_time(stat.st_mtime), method, flag_bits, crc, size, payload)
+                        compress_size = len(payload)
+                        del prepared, payload
+                    
+                    if written is not None:
+                        written.append({
+                            "path": rel_path,
+                            "size": stat.st_size,
+                            "mtime_ns": stat.st_mtime_ns,
+                            "sha256": sha256,
+                            "chunks": None
+                        })
+                    if debug:
+                        print(f"[调试] 添加文件到压缩包: {rel_path}, 压缩方式: {used}, {stat.st_size} -> {compress_size}字节")
+                    
+                    if writer.size >= block_size:
+                        yield writer.pop()
+            finally:
+                # 生成器提前关闭（如上传失败）时不再处理排队中的文件
+                for _, future in pending:
+                    future.cancel()
         
-        if debug:
-            print(f"[调试] 备份创建成功: {zip_path}")
+        if delta_files:
+            # 增量索引记录基准备份和每个增量文件的基准内容哈希
+            index = json.dumps({
+                "version": DELTA_INDEX_VERSION,
+                "base": base.name,
+                "files": delta_files
+            }, ensure_ascii=False).encode('utf-8')
+            payload = compress_data(index, "deflate-6")
+            writer.add_entry(DELTA_INDEX, datetime.now().timetuple()[:6], zipfile.ZIP_DEFLATED, 0, zlib.crc32(index), len(index), payload)
         
-        return zip_path
+        # 最后写入中央目录
+        writer.finish()
+        yield writer.pop()
     
     @staticmethod
-    def restore_backup(zip_path, save_dir, debug=False):
-        """从压缩包恢复存档"""
+    def restore_backup(zip_path, save_dir, resolve_base=None, deltas=None, workers=None, debug=False):
+        """从压缩包恢复存档，支持 CODECS 中的所有压缩方式
+
+        增量备份中的文件需要沿增量链还原：resolve_base(备份名, 相对路径, 内容哈希)
+        返回基准备份中该文件的内容。也可以先调用 load_deltas 得到 deltas 再恢复，
+        这样所有下载在改动存档目录之前完成。
+
+        文件先解压到暂存目录并校验，与当前存档相同的文件不重新写入，全部成功后
+        才替换存档目录；返回是否实际替换了存档。压缩包以内存映射方式读取，
+        各条目由 workers 个线程（默认一半CPU核心）同时解压和写入。
+        """
         if debug:
             print(f"[调试] 恢复备份 - 压缩包路径: {zip_path}, 目标目录: {save_dir}")
         
-        # 确保存档目录存在
-        Path(save_dir).mkdir(parents=True, exist_ok=True)
+        if deltas is None:
+            deltas = CompressManager.load_deltas(zip_path, resolve_base, debug=debug)
         
-        # 解压压缩包内容到存档目录
-        with zipfile.ZipFile(zip_path, 'r') as zipf:
-            zipf.extractall(save_dir)
+        started = time.time()
+        with RestoreStage(save_dir, debug=debug) as stage, tracing.span("extract") as sp:
+            with zipfile.ZipFile(zip_path, 'r') as zipf:
+                members = []
+                for member in zipf.infolist():
+                    if member.filename.startswith(f"{DELTA_DIR}/"):
+                        continue
+                    if member.is_dir():
+                        stage.makedirs(member.filename)
+                        continue
+                    members.append(member)
             
-            if debug:
-                print(f"[调试] 解压文件列表: {zipf.namelist()}")
+            written = 0
+            if members:
+                with open(zip_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    view = memoryview(mm)
+                    try:
+                        with ThreadPoolExecutor(max_workers=workers or default_workers()) as executor:
+                            futures = [
+                                executor.submit(CompressManager._extract_member, view, member, stage, debug)
+                                for member in members
+                            ]
+                            for future in futures:
+                                written += future.result()
+                    finally:
+                        view.release()
+            
+            for rel_path, data in deltas.items():
+                if stage.keep(rel_path, size=len(data), sha256=hashlib.sha256(data).hexdigest()):
+                    continue
+                stage.write(rel_path, data)
+                written += len(data)
+                if debug:
+                    print(f"[调试] 按增量还原文件: {rel_path}")
+            
+            sp.set(files=len(members), written_files=len(stage.written), bytes=written)
+            replaced = stage.commit()
         
         if debug:
-            print(f"[调试] 备份恢复成功")
+            elapsed = max(time.time() - started, 1e-6)
+            print(f"[调试] 备份恢复成功：写入 {len(stage.written)} 个文件 {written / 1024 / 1024:.1f} MB，"
+                  f"未变化 {len(stage.kept)} 个文件，用时 {elapsed:.2f} 秒，{written / 1024 / 1024 / elapsed:.1f} MB/s")
         
-        return True
+        return replaced
     
     @staticmethod
-    def delete_old_save(save_dir, debug=False):
-        """删除旧的存档目录"""
-        if debug:
-            print(f"[调试] 删除旧存档 - 目录: {save_dir}")
+    def _extract_member(view, member, stage, debug=False):
+        """在工作线程中解压单个条目到暂存目录，返回写入的字节数"""
+        # 内容与当前存档相同（大小和CRC32一致）的文件不解压
+        if stage.keep(member.filename, size=member.file_size, crc=member.CRC):
+            return 0
         
-        if os.path.exists(save_dir):
-            shutil.rmtree(save_dir)
-            if debug:
-                print(f"[调试] 旧存档删除成功")
+        offset = _data_offset(view, member)
+        crc = 0
+        size = 0
+        with open(stage.path(member.filename), 'wb') as f, view[offset:offset + member.compress_size] as raw:
+            _preallocate(f, member.file_size)
+            for block in _iter_decompressed(member.compress_type, raw):
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+                f.write(block)
+            f.truncate(size)
         
-        return True
\ No newline at end of file
+        if size != member.file_size or crc != member.CRC:
+            raise zipfile.BadZipFile(f"文件校验失败: {member.filename}")
+        if debug:
+            print(f"[调试] 解压文件: {member.filename}")
+        return size
+    
+    @staticmethod
+    def _delta_index(zipf):
+        """读取增量索引，不是增量备份时返回None"""
+        try:
+            member = zipf.getinfo(DELTA_INDEX)
+        except KeyError:
+            return None
+        return json.loads(CompressManager._read_member(zipf, member).decode('utf-8'))
+    
+    @staticmethod
+    def _read_member(zipf, member):
+        """读取条目解压后的内容"""
+        if member.compress_type != ZIP_ZSTD:
+            return zipf.read(member)
+        if zstandard is None:
+            raise RuntimeError("该备份使用zstd压缩，请先安装 zstandard")
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(CompressManager._read_raw(zipf, member))
+        if len(data) != member.file_size or zlib.crc32(data) != member.CRC:
+            raise zipfile.BadZipFile(f"文件校验失败: {member.filename}")
+        return data
+    
+    @staticmethod
+    def load_deltas(zip_path, resolve_base, debug=False):
+        """还原增量备份中以增量保存的文件，返回 {相对路径: 内容}"""
+        with zipfile.ZipFile(zip_path, 'r') as zipf:
+            index = CompressManager._delta_index(zipf)
+            if index is None:
+                return {}
+            if resolve_base is None:
+                raise ValueError("增量备份需要读取基准备份才能恢复")
+            
+            result = {}
+            for rel_path, info in index["files"].items():
+                delta = CompressManager._read_member(zipf, zipf.getinfo(f"{DELTA_DIR}/{rel_path}"))
+                result[rel_path] = CompressManager._undelta(index, rel_path, delta, resolve_base)
+                if debug:
+                    print(f"[调试] 还原增量: {rel_path}, 基准备份: {index['base']}, 增量链深度: {info['depth']}")
+            return result
+    
+    @staticmethod
+    def _undelta(index, rel_path, delta, resolve_base):
+        """从基准备份读取文件内容并应用增量，校验还原结果"""
+        info = index["files"][rel_path]
+        base_data = resolve_base(index["base"], rel_path, info["base_sha256"])
+        if base_data is None:
+            raise ValueError(f"无法读取基准备份 {index['base']} 中的 {rel_path}")
+        data = apply_delta(base_data, delta)
+        if hashlib.sha256(data).hexdigest() != info["sha256"]:
+            raise ValueError(f"文件校验失败: {rel_path}")
+        return data
+    
+    @staticmethod
+    def read_backup_file(zip_path, rel_path, resolve_base):
+        """读取压缩包中单个文件的内容，以增量保存的文件沿增量链还原"""
+        with zipfile.ZipFile(zip_path, 'r') as zipf:
+            index = CompressManager._delta_index(zipf)
+            if index is None or rel_path not in index["files"]:
+                return CompressManager._read_member(zipf, zipf.getinfo(rel_path))
+            delta = CompressManager._read_member(zipf, zipf.getinfo(f"{DELTA_DIR}/{rel_path}"))
+        return CompressManager._undelta(index, rel_path, delta, resolve_base)
+    
+    @staticmethod
+    def _read_raw(zipf, member):
+        """读取条目压缩后的原始数据"""
+        zipf.fp.seek(member.header_offset)
+        header = zipf.fp.read(30)
+        if header[:4] != b"PK\x03\x04":
+            raise zipfile.BadZipFile(f"条目头损坏: {member.filename}")
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        zipf.fp.seek(name_length + extra_length, os.SEEK_CUR)
+        return zipf.fp.read(member.compress_size)
\ No newline at end of file
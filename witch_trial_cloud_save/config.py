@@ -2,14 +2,16 @@ import os
 import json
 import sqlite3
 from pathlib import Path
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.backends import default_backend
+from contextlib import contextmanager
 import base64
 
 # 生成加密密钥的函数
 def generate_key():
+    # cryptography 导入较慢，只在需要派生密钥时导入
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.backends import default_backend
+    
     # 使用固定盐值，确保每次生成的密钥相同
     salt = b"fixed_salt_for_witch_trial_config_2024"  
     kdf = PBKDF2HMAC(
@@ -23,6 +25,32 @@ def generate_key():
     key = base64.urlsafe_b64encode(kdf.derive(b"witch_trial_cloud_save_secure_key"))
     return key
 
+# 缓存派生密钥的文件名
+KEY_CACHE_NAME = "config.key"
+
+def load_key(key_path, refresh=False):
+    """读取缓存的加密密钥，没有缓存时派生一次并写入缓存
+
+    密钥由固定的盐值和口令派生，缓存到应用数据目录不会降低安全性，
+    但可以省去每次启动时 100000 次迭代的 PBKDF2 计算。
+    """
+    if not refresh:
+        try:
+            key = Path(key_path).read_bytes().strip()
+            if len(key) == 44:
+                return key
+        except OSError:
+            pass
+    
+    key = generate_key()
+    try:
+        tmp_path = Path(key_path).with_suffix(".tmp")
+        tmp_path.write_bytes(key)
+        os.replace(tmp_path, key_path)
+    except OSError:
+        pass
+    return key
+
 # 获取用户应用数据目录
 def get_app_data_dir():
     app_data_dir = Path.home() / "AppData" / "Local" / "WitchTrialCloudSave"
@@ -36,10 +64,19 @@ DEFAULT_CONFIG = {
     "github_repo": "",
     "github_token": "",
     "auto_action": "none",  # none, pull, push
+    "backup_mode": "chunked",  # chunked（分块去重快照）, zip（整包压缩）
+    "compression": "auto",  # 压缩包的压缩方式：auto, store, deflate-1~9, lzma, zstd（需安装zstandard）
+    "compress_workers": 0,  # 压缩和解压线程数，0 表示使用一半CPU核心
+    "zip_delta": False,  # 压缩包中只保存相对上一次备份的增量
+    "snapshot_cache_mb": 256,  # 本机备份缓存的容量上限（MB），超过后淘汰最久未使用的备份
     "save_dir": str(Path.home() / "AppData" / "LocalLow" / "Re,AER" / "manosaba" / "Saves_v1"),
     "backup_interval": 5,  # 监控间隔（秒）
+    "quiet_seconds": 2,  # 存档目录静默多久后触发自动备份（秒）
+    "ignore_patterns": ["*.tmp", "*.temp", "*.lock", "~*", "*~"],  # 不备份、不触发备份的临时文件和锁文件
     "notifications_enabled": True,
-    "debug_mode": False  # 调试模式开关
+    "debug_mode": False,  # 调试模式开关
+    "trace_enabled": False,  # 把各阶段耗时写入应用数据目录下的 trace.jsonl
+    "profile_next_operation": False  # 用 cProfile 和 tracemalloc 记录下一次上传或恢复，记录后自动关闭
 }
 
 class Config:
@@ -47,10 +84,16 @@ class Config:
         # 将配置文件存储在用户应用数据目录中
         self.app_data_dir = get_app_data_dir()
         self.config_path = self.app_data_dir / "config.db"
-        self.key = generate_key()
-        self.cipher_suite = Fernet(self.key)
+        self.key_path = self.app_data_dir / KEY_CACHE_NAME
+        # 密钥在第一次加密或解密时才读取或派生
+        self._cipher_suite = None
+        # 是否已因密钥不匹配重新派生过密钥
+        self._key_refreshed = False
         self.conn = None
         self.cursor = None
+        # 修改后尚未写入数据库的配置项
+        self.dirty = set()
+        self._batch_depth = 0
         self.initialize_db()
         self.load()
     
@@ -58,6 +101,9 @@ class Config:
         # 连接到SQLite数据库（如果不存在则创建）
         self.conn = sqlite3.connect(str(self.config_path))
         self.cursor = self.conn.cursor()
+        # WAL模式下写入只追加日志，不阻塞读取，提交更快
+        self.cursor.execute("PRAGMA journal_mode=WAL")
+        self.cursor.execute("PRAGMA synchronous=NORMAL")
         
         # 创建配置表
         self.cursor.execute('''
@@ -68,6 +114,13 @@ class Config:
         ''')
         self.conn.commit()
     
+    @property
+    def cipher_suite(self):
+        if self._cipher_suite is None:
+            from cryptography.fernet import Fernet
+            self._cipher_suite = Fernet(load_key(self.key_path))
+        return self._cipher_suite
+    
     def encrypt(self, data):
         """加密数据"""
         if isinstance(data, dict) or isinstance(data, list):
@@ -78,12 +131,24 @@ class Config:
     
     def decrypt(self, encrypted_data):
         """解密数据"""
-        decrypted_bytes = self.cipher_suite.decrypt(encrypted_data.encode())
+        from cryptography.fernet import Fernet, InvalidToken
+        try:
+            decrypted_bytes = self.cipher_suite.decrypt(encrypted_data.encode())
+        except InvalidToken:
+            if self._key_refreshed:
+                # 已经用重新派生的密钥试过，是这一项本身损坏
+                raise
+            # 缓存的密钥与数据不匹配（例如缓存文件损坏），重新派生后再试一次；
+            # 每个实例只派生一次，几个损坏的配置项不会让每一项都重新计算 PBKDF2
+            self._key_refreshed = True
+            self._cipher_suite = Fernet(load_key(self.key_path, refresh=True))
+            decrypted_bytes = self.cipher_suite.decrypt(encrypted_data.encode())
         return decrypted_bytes.decode()
     
     def load(self):
         """从数据库加载配置"""
         self.data = DEFAULT_CONFIG.copy()
+        self.dirty.clear()
         
         # 从数据库中读取所有配置
         self.cursor.execute("SELECT key, value FROM config")
@@ -112,14 +177,17 @@ class Config:
                     self.data[key] = DEFAULT_CONFIG[key]
     
     def save(self):
-        """保存配置到数据库"""
+        """把修改过的配置项写入数据库，没有修改时不访问数据库"""
+        if not self.dirty:
+            return
+        
         # 开启事务
         self.conn.execute("BEGIN TRANSACTION")
         
         try:
-            # 保存所有配置项
-            for key, value in self.data.items():
-                encrypted_value = self.encrypt(value)
+            # 只加密和写入修改过的配置项
+            for key in sorted(self.dirty):
+                encrypted_value = self.encrypt(self.data[key])
                 # 使用UPSERT语法，不存在则插入，存在则更新
                 self.cursor.execute(
                     "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
@@ -127,6 +195,7 @@ class Config:
                 )
             # 提交事务
             self.conn.commit()
+            self.dirty.clear()
         except Exception as e:
             print(f"保存配置失败: {e}")
             # 回滚事务
@@ -137,11 +206,40 @@ class Config:
         return self.data.get(key, default)
     
     def set(self, key, value):
-        """设置配置项"""
+        """设置配置项，在 batch() 中时等批量修改结束后一起保存"""
+        if key in self.data and self.data[key] == value:
+            return
         self.data[key] = value
-        self.save()
+        self.dirty.add(key)
+        if not self._batch_depth:
+            self.save()
     
-    def __del__(self):
-        """关闭数据库连接"""
+    @contextmanager
+    def batch(self):
+        """批量修改配置，期间的 set 在结束时用一个事务保存
+
+            with config.batch():
+                config.set("github_owner", owner)
+                config.set("github_repo", repo)
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.save()
+    
+    def close(self):
+        """关闭数据库连接，必须在创建它的线程（Tk主线程）中调用"""
         if self.conn:
-            self.conn.close()
\ No newline at end of file
+            self.conn.close()
+            self.conn = None
+            self.cursor = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
\ No newline at end of file
@@ -0,0 +1,283 @@
+import os
+import json
+import zlib
+import hashlib
+import threading
+from array import array
+from pathlib import Path
+from chunk_store import iter_chunks
+
+# 增量数据的格式标识
+DELTA_MAGIC = b"MSDELTA1"
+# 压缩包中存放增量数据的目录和增量索引
+DELTA_DIR = ".delta"
+DELTA_INDEX = f"{DELTA_DIR}/index.json"
+DELTA_INDEX_VERSION = 1
+
+# 增量匹配使用更小的内容定义块，存档中零散的小改动也能匹配到周围未变化的数据
+DELTA_MIN_BLOCK = 256
+DELTA_AVG_BLOCK = 1024
+DELTA_MAX_BLOCK = 8192
+
+# 连续增量达到此次数后写入完整文件，限制恢复时需要追溯的备份数量
+KEYFRAME_INTERVAL = 10
+# 增量小于原文件的此比例时才使用增量
+DELTA_MAX_RATIO = 0.5
+# 超过此大小的文件总是写入完整文件：分块匹配在压缩线程中持有GIL，大文件会拖慢整个备份
+DELTA_MAX_FILE_SIZE = 16 * 1024 * 1024
+
+_OP_COPY = 1
+_OP_INSERT = 2
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def delta_blocks(data):
+    """按增量匹配使用的内容定义块切分数据，返回 (起始偏移, 长度) 列表"""
+    return list(iter_chunks(data, DELTA_MIN_BLOCK, DELTA_AVG_BLOCK, DELTA_MAX_BLOCK))
+
+
+def encode_delta(base, target, base_blocks=None, target_blocks=None):
+    """计算 target 相对 base 的二进制增量
+
+    两边都按滚动哈希（Gear）切分为内容定义块，target 中与 base 相同的块记为
+    复制指令（相邻的复制合并为一条），其余数据原样记为插入指令。插入或删除
+    字节只影响附近的块，改动几个字节的存档，增量大小与改动量相当。
+    base_blocks、target_blocks 为已经算好的 delta_blocks() 结果，省略时重新切分。
+    """
+    if base_blocks is None:
+        base_blocks = delta_blocks(base)
+    if target_blocks is None:
+        target_blocks = delta_blocks(target)
+    
+    index = {}
+    for offset, size in base_blocks:
+        index.setdefault(base[offset:offset + size], offset)
+
+    out = bytearray(DELTA_MAGIC)
+    _write_varint(out, len(base))
+    _write_varint(out, len(target))
+
+    copy_offset = copy_length = 0
+    insert_start = insert_end = 0
+
+    def flush_copy():
+        if copy_length:
+            out.append(_OP_COPY)
+            _write_varint(out, copy_offset)
+            _write_varint(out, copy_length)
+
+    def flush_insert():
+        if insert_end > insert_start:
+            out.append(_OP_INSERT)
+            _write_varint(out, insert_end - insert_start)
+            out.extend(target[insert_start:insert_end])
+
+    for offset, size in target_blocks:
+        base_offset = index.get(target[offset:offset + size])
+        if base_offset is None:
+            if insert_end != offset:
+                flush_copy()
+                copy_length = 0
+                insert_start = offset
+            insert_end = offset + size
+            continue
+
+        flush_insert()
+        insert_start = insert_end = 0
+        if copy_length and copy_offset + copy_length == base_offset:
+            copy_length += size
+        else:
+            flush_copy()
+            copy_offset, copy_length = base_offset, size
+
+    flush_copy()
+    flush_insert()
+    return bytes(out)
+
+
+def apply_delta(base, delta):
+    """把增量应用到 base 上，还原出目标数据"""
+    if not delta.startswith(DELTA_MAGIC):
+        raise ValueError("增量数据格式错误")
+    pos = len(DELTA_MAGIC)
+    base_size, pos = _read_varint(delta, pos)
+    target_size, pos = _read_varint(delta, pos)
+    if base_size != len(base):
+        raise ValueError("增量的基准数据不匹配")
+
+    out = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op == _OP_COPY:
+            offset, pos = _read_varint(delta, pos)
+            length, pos = _read_varint(delta, pos)
+            out.extend(base[offset:offset + length])
+        elif op == _OP_INSERT:
+            length, pos = _read_varint(delta, pos)
+            out.extend(delta[pos:pos + length])
+            pos += length
+        else:
+            raise ValueError("增量数据格式错误")
+
+    if len(out) != target_size:
+        raise ValueError("增量还原后的大小不一致")
+    return bytes(out)
+
+
+class DeltaBase:
+    def __init__(self, save_dir, store_dir=None):
+        """本机上次上传的各存档文件内容，作为下一次备份计算增量的基准
+
+        内容按SHA256存放（zlib压缩），state.json 记录基准所在的备份名称和
+        每个文件已连续使用增量的次数。iter_backup 在生成压缩包时调用 note()
+        暂存本次的文件状态，上传成功后调用 commit() 才成为新的基准。
+        """
+        if store_dir is None:
+            from config import get_app_data_dir
+            root_key = os.path.normcase(os.path.abspath(save_dir))
+            store_dir = get_app_data_dir() / "delta_base" / hashlib.sha1(root_key.encode('utf-8')).hexdigest()[:16]
+        self.store_dir = Path(store_dir)
+        self.objects_dir = self.store_dir / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.state_path = self.store_dir / "state.json"
+        self._lock = threading.Lock()
+        self._staged = {}
+
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        # 基准所在的备份名称，没有基准时为None
+        self.name = state.get("backup")
+        self.files = state.get("files", {})
+
+    def _object_path(self, sha256):
+        return self.objects_dir / sha256
+
+    def _blocks_path(self, sha256):
+        return self.objects_dir / f"{sha256}.blocks"
+
+    def _write_atomic(self, path, payload):
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    def load_blocks(self, sha256, data):
+        """读取基准内容的分块结果，没有缓存时切分并缓存
+
+        上一次备份计算增量时已经切分过这份内容，缓存下来后每次备份只需切分新内容。
+        """
+        path = self._blocks_path(sha256)
+        try:
+            ends = array("Q")
+            ends.frombytes(path.read_bytes())
+        except (OSError, ValueError):
+            ends = None
+        if ends is not None and (ends[-1:] == array("Q", [len(data)]) or not data):
+            starts = [0] + ends.tolist()[:-1]
+            return [(start, end - start) for start, end in zip(starts, ends)]
+
+        blocks = delta_blocks(data)
+        self._save_blocks(sha256, blocks)
+        return blocks
+
+    def _save_blocks(self, sha256, blocks):
+        path = self._blocks_path(sha256)
+        if path.exists():
+            return
+        try:
+            self._write_atomic(path, array("Q", [offset + size for offset, size in blocks]).tobytes())
+        except OSError:
+            pass
+
+    def load_object(self, sha256):
+        """读取指定内容，本地没有时返回None"""
+        try:
+            with open(self._object_path(sha256), 'rb') as f:
+                data = zlib.decompress(f.read())
+        except (OSError, zlib.error):
+            return None
+        if hashlib.sha256(data).hexdigest() != sha256:
+            return None
+        return data
+
+    def lookup(self, rel_path):
+        """返回文件的基准 (内容, SHA256, 已连续增量次数, 分块结果)，没有基准时返回None"""
+        if self.name is None:
+            return None
+        info = self.files.get(rel_path)
+        if info is None:
+            return None
+        data = self.load_object(info["sha256"])
+        if data is None:
+            return None
+        return data, info["sha256"], info["depth"], self.load_blocks(info["sha256"], data)
+
+    def begin(self):
+        """开始生成新的压缩包，清空上一次尝试暂存的状态"""
+        with self._lock:
+            self._staged = {}
+
+    def note(self, rel_path, data, sha256, depth, blocks=None):
+        """暂存本次备份中文件的内容和连续增量次数（可在多个线程中调用）
+
+        blocks 为计算增量时得到的分块结果，缓存后下一次备份不必重新切分。
+        """
+        path = self._object_path(sha256)
+        if not path.exists():
+            self._write_atomic(path, zlib.compress(data, 1))
+        if blocks is not None:
+            self._save_blocks(sha256, blocks)
+        with self._lock:
+            self._staged[rel_path] = {"sha256": sha256, "depth": depth}
+
+    def commit(self, backup_name):
+        """上传成功后以本次备份作为新的基准，删除不再需要的内容"""
+        with self._lock:
+            files = dict(self._staged)
+        state = {"backup": backup_name, "files": files}
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+        self.name = backup_name
+        self.files = files
+
+        keep = {info["sha256"] for info in files.values()}
+        for path in self.objects_dir.iterdir():
+            # 内容和分块缓存（<SHA256>.blocks）一起保留或删除
+            if path.name.split(".", 1)[0] not in keep:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def reset(self):
+        """基准备份已被删除，下一次备份写入完整文件"""
+        self.name = None
+        self.files = {}
+        try:
+            self.state_path.unlink()
+        except OSError:
+            pass
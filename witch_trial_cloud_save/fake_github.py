@@ -0,0 +1,459 @@
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 限速时每次写入的数据块大小
+THROTTLE_BLOCK = 64 * 1024
+
+
+def _blob_sha(data):
+    """与git一致的blob SHA，客户端用它校验下载和跳过已上传的blob"""
+    return hashlib.sha1(f"blob {len(data)}\0".encode() + data).hexdigest()
+
+
+def _object_sha(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class FakeGitHub:
+    def __init__(self, latency=0.0, bandwidth=None, error_rate=0.0, rate_limit_every=0,
+                 rate_limit_status=429, retry_after=0, seed=0):
+        """本地的GitHub API模拟服务器，用于离线测量和回归测试 GitAPI 的性能
+
+        实现 github_api.py 用到的接口：内容API、Git数据API（引用、提交、树、blob）、
+        发布和附件上传，以及 download_url 指向的原始文件下载。仓库内容只保存在内存中，
+        不区分所有者和仓库名。
+
+        可注入的网络条件（运行中也可以修改属性）：
+        - latency：每个请求的额外延迟（秒），模拟往返时间
+        - bandwidth：请求体和响应体的传输速度（字节/秒），None 表示不限速
+        - error_rate：随机返回 502/503 的概率
+        - rate_limit_every：每 N 个请求返回一次限流响应，rate_limit_status 为 429 时
+          带 Retry-After，为 403 时带 X-RateLimit-Remaining: 0 和 X-RateLimit-Reset
+        - fail_next()：让接下来的请求依次返回指定的状态码
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.rate_limit_every = rate_limit_every
+        self.rate_limit_status = rate_limit_status
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._faults = []
+
+        self._lock = threading.Lock()
+        self.blobs = {}
+        self.trees = {}
+        self.commits = {}
+        self.refs = {}
+        self.releases = []
+        self._next_id = 1
+        self.reset_stats()
+
+        self.server = None
+        self._thread = None
+
+    # ---- 服务器 ----
+
+    def start(self):
+        """在本机随机端口启动服务器，返回服务器地址"""
+        fake = self
+
+        class Handler(_Handler):
+            github = fake
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="FakeGitHub", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def client(self, owner="bench", repo="saves", token="fake-token", debug=False, blob_cache_file=None):
+        """创建指向本服务器的 GitAPI"""
+        from github_api import GitAPI
+        git_api = GitAPI(owner, repo, token, debug=debug, api_url=self.url, uploads_url=self.url)
+        git_api.blob_cache_file = blob_cache_file
+        return git_api
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    # ---- 统计和故障注入 ----
+
+    def reset_stats(self):
+        self.stats = {"round_trips": 0, "bytes_sent": 0, "bytes_received": 0, "routes": {}}
+
+    def snapshot_stats(self):
+        """返回统计的副本；bytes_sent 为客户端发出的字节数（含请求行和请求头）"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["routes"] = dict(self.stats["routes"])
+        return stats
+
+    def fail_next(self, status, count=1, headers=None):
+        """接下来的 count 个请求返回 status（读取请求体后再返回）"""
+        with self._lock:
+            self._faults.extend([(status, headers or {})] * count)
+
+    def _record(self, route, received, sent):
+        with self._lock:
+            self.stats["round_trips"] += 1
+            self.stats["bytes_sent"] += received
+            self.stats["bytes_received"] += sent
+            self.stats["routes"][route] = self.stats["routes"].get(route, 0) + 1
+
+    def _injected_fault(self):
+        """本次请求需要返回的故障 (状态码, 响应头)，没有时返回None"""
+        with self._lock:
+            if self._faults:
+                return self._faults.pop(0)
+            count = self.stats["round_trips"] + 1
+            if self.rate_limit_every and count % self.rate_limit_every == 0:
+                if self.rate_limit_status == 403:
+                    return 403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time() + self.retry_after))}
+                return 429, {"Retry-After": str(self.retry_after)}
+            if self.error_rate and self._rng.random() < self.error_rate:
+                return self._rng.choice((502, 503)), {}
+        return None
+
+    def throttle(self, size):
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+
+    # ---- 仓库状态 ----
+
+    def export_state(self):
+        """保存仓库状态，性能测试在每次运行前用 import_state 还原"""
+        with self._lock:
+            return {
+                "blobs": dict(self.blobs),
+                "trees": dict(self.trees),
+                "commits": dict(self.commits),
+                "refs": dict(self.refs),
+            }
+
+    def import_state(self, state):
+        with self._lock:
+            self.blobs = dict(state["blobs"])
+            self.trees = dict(state["trees"])
+            self.commits = dict(state["commits"])
+            self.refs = dict(state["refs"])
+
+    def _files(self, ref):
+        """分支名或提交SHA对应的 {路径: blob SHA}，不存在时返回None"""
+        commit_sha = self.refs.get(ref, ref)
+        commit = self.commits.get(commit_sha)
+        if commit is None:
+            return None
+        return self.trees[commit["tree"]]
+
+    def _store_tree(self, files):
+        sha = _object_sha(files)
+        self.trees[sha] = files
+        return sha
+
+    def _store_commit(self, tree_sha, parents, message):
+        commit = {"tree": tree_sha, "parents": parents, "message": message, "time": time.time()}
+        sha = _object_sha(commit)
+        self.commits[sha] = commit
+        return sha
+
+    def _commit_files(self, files, message, branch="main"):
+        """在分支上直接提交新的文件列表（内容API）"""
+        parent = self.refs.get(branch)
+        sha = self._store_commit(self._store_tree(files), [parent] if parent else [], message)
+        self.refs[branch] = sha
+        return sha
+
+    def _content_entry(self, path, blob_sha):
+        size = len(self.blobs[blob_sha])
+        return {
+            "type": "file",
+            "name": path.rsplit("/", 1)[-1],
+            "path": path,
+            "sha": blob_sha,
+            "size": size,
+            "download_url": f"{self.url}/raw/main/{urllib.parse.quote(path)}",
+        }
+
+    def _list_dir(self, files, path):
+        prefix = f"{path}/" if path else ""
+        entries = {}
+        for file_path, blob_sha in files.items():
+            if not file_path.startswith(prefix):
+                continue
+            name, _, rest = file_path[len(prefix):].partition("/")
+            if rest:
+                entries.setdefault(name, {"type": "dir", "name": name, "path": prefix + name, "sha": None, "size": 0})
+            else:
+                entries[name] = self._content_entry(file_path, blob_sha)
+        return [entries[name] for name in sorted(entries)]
+
+    # ---- 接口 ----
+
+    def handle(self, method, path, query, headers, body):
+        """处理一个请求，返回 (状态码, 响应体, 响应头)"""
+        parts = path.strip("/").split("/")
+        raw = "raw" in headers.get("Accept", "")
+        with self._lock:
+            if parts[0] == "raw":
+                files = self._files(parts[1]) or {}
+                blob_sha = files.get("/".join(parts[2:]))
+                if blob_sha is None:
+                    return 404, {"message": "Not Found"}, {}
+                return 200, self.blobs[blob_sha], {"Content-Type": "application/octet-stream"}
+
+            if len(parts) < 3 or parts[0] != "repos":
+                return 404, {"message": "Not Found"}, {}
+            kind, rest = parts[3] if len(parts) > 3 else "", parts[4:]
+            repo_path = "/".join(rest)
+
+            if kind == "contents":
+                return self._contents(method, repo_path, query, body, raw)
+            if kind == "git":
+                return self._git(method, rest, query, body)
+            if kind == "releases":
+                return self._releases(method, rest, query, body)
+        return 404, {"message": "Not Found"}, {}
+
+    def _contents(self, method, path, query, body, raw):
+        ref = query.get("ref", "main")
+        if method == "GET":
+            files = self._files(ref)
+            if files is None:
+                return 404, {"message": "This repository is empty."}, {}
+            if path in files:
+                blob_sha = files[path]
+                if raw:
+                    return 200, self.blobs[blob_sha], {"Content-Type": "application/octet-stream"}
+                entry = self._content_entry(path, blob_sha)
+                entry.update(content=base64.b64encode(self.blobs[blob_sha]).decode('ascii'), encoding="base64")
+                return 200, entry, {}
+            listing = self._list_dir(files, path)
+            if not listing and path:
+                return 404, {"message": "Not Found"}, {}
+            return 200, listing, {}
+
+        payload = json.loads(body or b"{}")
+        branch = payload.get("branch", "main")
+        files = dict(self._files(branch) or {})
+        if method == "PUT":
+            if path in files and payload.get("sha") != files[path]:
+                return 422, {"message": "Invalid request.\n\n\"sha\" wasn't supplied."}, {}
+            data = base64.b64decode(payload["content"])
+            blob_sha = _blob_sha(data)
+            self.blobs[blob_sha] = data
+            created = path not in files
+            files[path] = blob_sha
+            commit_sha = self._commit_files(files, payload.get("message", ""), branch)
+            return (201 if created else 200), {"content": self._content_entry(path, blob_sha), "commit": {"sha": commit_sha}}, {}
+        if method == "DELETE":
+            if path not in files:
+                return 404, {"message": "Not Found"}, {}
+            if payload.get("sha") != files[path]:
+                return 409, {"message": f"{path} does not match {payload.get('sha')}"}, {}
+            del files[path]
+            commit_sha = self._commit_files(files, payload.get("message", ""), branch)
+            return 200, {"content": None, "commit": {"sha": commit_sha}}, {}
+        return 405, {"message": "Method Not Allowed"}, {}
+
+    def _git(self, method, rest, query, body):
+        endpoint = rest[0] if rest else ""
+        payload = json.loads(body) if body else {}
+
+        if endpoint in ("ref", "refs") and len(rest) >= 3:
+            branch = "/".join(rest[2:])
+            if method == "GET":
+                if branch not in self.refs:
+                    return 409 if not self.refs else 404, {"message": "Git Repository is empty." if not self.refs else "Not Found"}, {}
+                return 200, {"ref": f"refs/heads/{branch}", "object": {"type": "commit", "sha": self.refs[branch]}}, {}
+            if method == "PATCH":
+                commit = self.commits.get(payload.get("sha"))
+                if commit is None:
+                    return 422, {"message": "Object does not exist"}, {}
+                if not payload.get("force") and self.refs.get(branch) not in commit["parents"]:
+                    return 422, {"message": "Update is not a fast forward"}, {}
+                self.refs[branch] = payload["sha"]
+                return 200, {"ref": f"refs/heads/{branch}", "object": {"type": "commit", "sha": payload["sha"]}}, {}
+
+        if endpoint == "blobs" and method == "POST":
+            data = base64.b64decode(payload["content"]) if payload.get("encoding") == "base64" else payload["content"].encode('utf-8')
+            blob_sha = _blob_sha(data)
+            self.blobs[blob_sha] = data
+            return 201, {"sha": blob_sha, "url": f"{self.url}/git/blobs/{blob_sha}"}, {}
+
+        if endpoint == "trees":
+            if method == "POST":
+                files = dict(self.trees.get(payload.get("base_tree"), {}))
+                for entry in payload.get("tree", []):
+                    path = entry["path"]
+                    if entry.get("sha") is None:
+                        prefix = path.rstrip("/") + "/"
+                        for file_path in [p for p in files if p == path or p.startswith(prefix)]:
+                            del files[file_path]
+                    elif entry["sha"] not in self.blobs:
+                        return 422, {"message": f"tree.sha {entry['sha']} is not a valid blob"}, {}
+                    else:
+                        files[path] = entry["sha"]
+                return 201, {"sha": self._store_tree(files)}, {}
+            if method == "GET" and len(rest) == 2:
+                files = self._files(rest[1])
+                if files is None:
+                    return 409 if not self.refs else 404, {"message": "Not Found"}, {}
+                tree = []
+                dirs = set()
+                for path, blob_sha in sorted(files.items()):
+                    parent = path.rpartition("/")[0]
+                    while parent and parent not in dirs:
+                        dirs.add(parent)
+                        tree.append({"path": parent, "type": "tree", "mode": "040000"})
+                        parent = parent.rpartition("/")[0]
+                    tree.append({"path": path, "type": "blob", "mode": "100644", "sha": blob_sha, "size": len(self.blobs[blob_sha])})
+                return 200, {"sha": self.commits[self.refs.get(rest[1], rest[1])]["tree"], "tree": tree, "truncated": False}, {}
+
+        if endpoint == "commits":
+            if method == "POST":
+                if payload.get("tree") not in self.trees:
+                    return 422, {"message": "Tree does not exist"}, {}
+                commit_sha = self._store_commit(payload["tree"], payload.get("parents", []), payload.get("message", ""))
+                return 201, {"sha": commit_sha, "tree": {"sha": payload["tree"]}}, {}
+            if method == "GET" and len(rest) == 2:
+                commit = self.commits.get(rest[1])
+                if commit is None:
+                    return 404, {"message": "Not Found"}, {}
+                return 200, {"sha": rest[1], "tree": {"sha": commit["tree"]}, "parents": [{"sha": p} for p in commit["parents"]]}, {}
+
+        return 404, {"message": "Not Found"}, {}
+
+    def _releases(self, method, rest, query, body):
+        if method == "POST" and not rest:
+            payload = json.loads(body)
+            if any(r["tag_name"] == payload["tag_name"] for r in self.releases):
+                return 422, {"message": "Validation Failed", "errors": [{"resource": "Release", "code": "already_exists", "field": "tag_name"}]}, {}
+            release = {
+                "id": self._next_id,
+                "tag_name": payload["tag_name"],
+                "name": payload.get("name"),
+                "body": payload.get("body"),
+                "prerelease": payload.get("prerelease", False),
+                "assets": [],
+            }
+            self._next_id += 1
+            self.releases.append(release)
+            return 201, release, {}
+        if method == "GET" and not rest:
+            return 200, list(reversed(self.releases)), {}
+        if method == "GET" and len(rest) == 2 and rest[0] == "tags":
+            for release in self.releases:
+                if release["tag_name"] == rest[1]:
+                    return 200, release, {}
+            return 404, {"message": "Not Found"}, {}
+        if method == "POST" and len(rest) == 2 and rest[1] == "assets":
+            for release in self.releases:
+                if str(release["id"]) == rest[0]:
+                    asset = {"id": self._next_id, "name": query.get("name"), "size": len(body)}
+                    self._next_id += 1
+                    release["assets"].append(asset)
+                    return 201, asset, {}
+            return 404, {"message": "Not Found"}, {}
+        return 404, {"message": "Not Found"}, {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # 保持连接，与真实服务器一样复用 keep-alive 连接
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分开写入，不关闭Nagle算法时会与延迟确认叠加出约40毫秒的额外延迟
+    disable_nagle_algorithm = True
+    github = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        """读取请求体，支持 Content-Length 和分块传输（流式上传使用分块传输）"""
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = bytearray()
+            wire = 0
+            while True:
+                line = self.rfile.readline()
+                wire += len(line)
+                size = int(line.split(b";")[0], 16)
+                if size == 0:
+                    break
+                body += self.rfile.read(size)
+                wire += size + len(self.rfile.readline())
+            while True:
+                line = self.rfile.readline()
+                wire += len(line)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            return bytes(body), wire
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        return body, length
+
+    def _dispatch(self):
+        github = self.github
+        body, wire = self._read_body()
+        received = len(self.requestline) + 2 + len(str(self.headers)) + wire
+        github.throttle(wire)
+        if github.latency:
+            time.sleep(github.latency)
+
+        url = urllib.parse.urlsplit(self.path)
+        path = urllib.parse.unquote(url.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        parts = path.strip("/").split("/")
+        if parts[0] == "raw":
+            route = f"{self.command} raw"
+        elif len(parts) > 4 and parts[3] == "git":
+            route = f"{self.command} git/{parts[4]}"
+        else:
+            route = f"{self.command} {parts[3] if len(parts) > 3 else path}"
+
+        fault = github._injected_fault()
+        if fault is not None:
+            status, headers = fault
+            payload, extra = {"message": "injected fault"}, headers
+        else:
+            try:
+                status, payload, extra = github.handle(self.command, path, query, self.headers, body)
+            except (KeyError, ValueError) as e:
+                status, payload, extra = 400, {"message": f"Problems parsing request: {e}"}, {}
+
+        data = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", extra.pop("Content-Type", "application/json; charset=utf-8"))
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in extra.items():
+            self.send_header(key, value)
+        # 在发出响应前计数，客户端收到响应时统计已经包含本次请求
+        github._record(route, received, sum(len(line) for line in self._headers_buffer) + 2 + len(data))
+        self.end_headers()
+        for offset in range(0, len(data), THROTTLE_BLOCK):
+            block = data[offset:offset + THROTTLE_BLOCK]
+            self.wfile.write(block)
+            github.throttle(len(block))
+
+    do_GET = do_PUT = do_POST = do_PATCH = do_DELETE = _dispatch
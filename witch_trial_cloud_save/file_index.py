@@ -0,0 +1,253 @@
+import os
+import time
+import json
+import sqlite3
+import fnmatch
+import hashlib
+from pathlib import Path
+
+
+def is_ignored(rel_path, ignore=()):
+    """文件名或相对路径匹配任一忽略模式（如 *.tmp）时返回True"""
+    name = rel_path.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern) for pattern in ignore)
+
+
+def scan_save_dir(save_dir, ignore=()):
+    """遍历存档目录，返回 {相对路径: (大小, 修改时间纳秒)}，不读取文件内容"""
+    files_info = {}
+    for root, dirs, files in os.walk(save_dir):
+        for file in files:
+            file_path = os.path.join(root, file)
+            rel_path = Path(os.path.relpath(file_path, save_dir)).as_posix()
+            if is_ignored(rel_path, ignore):
+                continue
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                # 扫描过程中被删除的文件
+                continue
+            files_info[rel_path] = (stat.st_size, stat.st_mtime_ns)
+    return files_info
+
+
+def scan_changed(save_dir, previous, changed, ignore=()):
+    """以上次上传时的索引为基础，只对变化的路径调用stat，结果与 scan_save_dir 相同
+
+    changed 为文件监控记录的相对路径集合；为None或索引为空时退回到完整扫描。
+    """
+    if changed is None or not previous:
+        return scan_save_dir(save_dir, ignore=ignore)
+
+    files_info = {
+        rel_path: (entry["size"], entry["mtime_ns"])
+        for rel_path, entry in previous.items()
+        if not is_ignored(rel_path, ignore)
+    }
+    for rel_path in changed:
+        if is_ignored(rel_path, ignore):
+            continue
+        try:
+            stat = os.stat(os.path.join(save_dir, rel_path))
+        except OSError:
+            # 已被删除
+            files_info.pop(rel_path, None)
+            continue
+        files_info[rel_path] = (stat.st_size, stat.st_mtime_ns)
+    return files_info
+
+
+class TornReadError(OSError):
+    """文件在读取过程中一直被写入，无法得到完整一致的内容"""
+
+
+def _stat_key(stat):
+    return stat.st_size, stat.st_mtime_ns
+
+
+def read_stable(file_path, retries=5, retry_delay=0.2):
+    """读取文件的完整内容，返回 (数据, 读取后的stat结果)
+
+    游戏正在写入时文件可能被独占（Windows共享冲突），等待后重试；读取前后
+    大小或修改时间不同说明读到的是写了一半的文件，同样重新读取。
+    """
+    for attempt in range(retries):
+        try:
+            before = os.stat(file_path)
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            after = os.stat(file_path)
+        except PermissionError:
+            if attempt == retries - 1:
+                raise
+            time.sleep(retry_delay * (attempt + 1))
+            continue
+        
+        if _stat_key(before) == _stat_key(after) and len(data) == after.st_size:
+            return data, after
+        time.sleep(retry_delay * (attempt + 1))
+    
+    raise TornReadError(f"文件在读取过程中被修改: {file_path}")
+
+
+def open_stable(file_path, retries=5, retry_delay=0.2):
+    """打开文件用于流式读取，共享冲突时等待后重试，返回 (文件对象, 打开时的stat结果)
+
+    读取完成后用 check_unchanged 确认期间没有被写入。
+    """
+    for attempt in range(retries):
+        try:
+            f = open(file_path, 'rb')
+        except PermissionError:
+            if attempt == retries - 1:
+                raise
+            time.sleep(retry_delay * (attempt + 1))
+            continue
+        return f, os.fstat(f.fileno())
+
+
+def check_unchanged(file_path, stat):
+    """流式读取完成后检查文件大小和修改时间，被写入过时抛出 TornReadError"""
+    if _stat_key(os.stat(file_path)) != _stat_key(stat):
+        raise TornReadError(f"文件在读取过程中被修改: {file_path}")
+
+
+def hash_file(file_path):
+    """计算文件内容的SHA256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileIndex:
+    def __init__(self, db_path=None):
+        """记录上次成功上传时每个存档文件的状态（路径、大小、修改时间、内容哈希）"""
+        if db_path is None:
+            # 与config.db放在同一个用户应用数据目录
+            from config import get_app_data_dir
+            db_path = get_app_data_dir() / "file_index.db"
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                chunks TEXT,
+                PRIMARY KEY (root, path)
+            )
+        ''')
+        self.conn.commit()
+
+    @staticmethod
+    def _root_key(save_dir):
+        return os.path.normcase(os.path.abspath(save_dir))
+
+    def load(self, save_dir):
+        """读取指定存档目录上次上传时的文件状态"""
+        rows = self.conn.execute(
+            "SELECT path, size, mtime_ns, sha256, chunks FROM files WHERE root = ?",
+            (self._root_key(save_dir),)
+        ).fetchall()
+        entries = {}
+        for path, size, mtime_ns, sha256, chunks in rows:
+            entries[path] = {
+                "path": path,
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "sha256": sha256,
+                "chunks": json.loads(chunks) if chunks else None
+            }
+        return entries
+
+    def record(self, save_dir, entries):
+        """上传成功后用本次的文件状态替换索引"""
+        root = self._root_key(save_dir)
+        with self.conn:
+            self.conn.execute("DELETE FROM files WHERE root = ?", (root,))
+            self.conn.executemany(
+                "INSERT INTO files (root, path, size, mtime_ns, sha256, chunks) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        root,
+                        entry["path"],
+                        entry["size"],
+                        entry["mtime_ns"],
+                        entry["sha256"],
+                        json.dumps(entry["chunks"]) if entry.get("chunks") is not None else None
+                    )
+                    for entry in entries
+                ]
+            )
+
+    def clear(self, save_dir=None):
+        """清空索引，下次备份会重新读取所有文件"""
+        with self.conn:
+            if save_dir is None:
+                self.conn.execute("DELETE FROM files")
+            else:
+                self.conn.execute("DELETE FROM files WHERE root = ?", (self._root_key(save_dir),))
+
+    @staticmethod
+    def stat_matches(entry, size, mtime_ns):
+        """大小和修改时间都未变化时认为内容未变化"""
+        return entry is not None and entry["size"] == size and entry["mtime_ns"] == mtime_ns
+
+    @staticmethod
+    def hash_changed(save_dir, current, previous, debug=False):
+        """只对大小或修改时间变化的文件重新计算哈希，返回当前全部文件状态"""
+        entries = []
+        for rel_path, (size, mtime_ns) in sorted(current.items()):
+            old = previous.get(rel_path)
+            if FileIndex.stat_matches(old, size, mtime_ns):
+                entries.append(old)
+                continue
+            try:
+                sha256 = hash_file(os.path.join(save_dir, rel_path))
+            except OSError as e:
+                if debug:
+                    print(f"[调试] 计算哈希失败: {rel_path}, 错误信息: {e}")
+                continue
+            entries.append({
+                "path": rel_path,
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "sha256": sha256,
+                "chunks": None
+            })
+        return entries
+
+    @staticmethod
+    def stats_unchanged(previous, current):
+        """current 为 {相对路径: (大小, 修改时间纳秒)}，文件集合相同且每个文件的大小和修改时间都未变化"""
+        if len(previous) != len(current):
+            return False
+        return all(FileIndex.stat_matches(previous.get(rel_path), size, mtime_ns) for rel_path, (size, mtime_ns) in current.items())
+
+    @staticmethod
+    def same_content(previous, entries):
+        """比较两次状态的文件集合和内容哈希"""
+        if len(previous) != len(entries):
+            return False
+        for entry in entries:
+            old = previous.get(entry["path"])
+            if old is None or old["sha256"] != entry["sha256"]:
+                return False
+        return True
+
+    def close(self):
+        """关闭数据库连接，必须在创建它的线程中调用"""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -1,10 +1,21 @@
 import os
+import hashlib
 import requests
 import urllib.parse
 from pathlib import Path
+from catalog import CATALOG_PATH, empty_catalog, parse_catalog, dump_catalog, update_catalog
+from transport import get_transport
+import tracing
+
+# GitHub API地址，性能测试时可以指向本地的模拟服务器（见 fake_github.py）
+API_URL = "https://api.github.com"
+UPLOADS_URL = "https://uploads.github.com"
 
 class GitAPI:
-    def __init__(self, owner, repo, token, debug=False):
+    # 仓库根目录下不属于备份的目录
+    RESERVED_DIRS = {"chunks"}
+    
+    def __init__(self, owner, repo, token, debug=False, api_url=API_URL, uploads_url=UPLOADS_URL):
         """初始化GitHub API客户端"""
         self.owner = owner
         self.repo = repo
@@ -15,607 +26,434 @@ class GitAPI:
         encoded_repo = urllib.parse.quote(repo)
         
         # GitHub API端点和请求头
-        self.base_url = f"https://api.github.com/repos/{owner}/{encoded_repo}"
+        self.base_url = f"{api_url}/repos/{owner}/{encoded_repo}"
+        self.uploads_url = f"{uploads_url}/repos/{owner}/{encoded_repo}"
         self.headers = {
             "Authorization": f"token {self.token}",
             "Accept": "application/vnd.github.v3+json"
         }
+        
+        # 同一个令牌的所有GitAPI实例共用一个连接池和重试策略
+        self.transport = get_transport(self.token)
+        
+        # 路径→blob SHA缓存文件，None时使用应用数据目录下的 blob_cache.json
+        self.blob_cache_file = None
+    
+    def _request(self, method, url, max_retries=3, retry_delay=2, timeout=10, headers=None, **kwargs):
+        """通过共享传输层发送请求，连接错误、超时、5xx和限流由传输层统一重试"""
+        return self.transport.request(
+            method,
+            url,
+            max_retries=max_retries,
+            retry_delay=retry_delay,
+            timeout=timeout,
+            debug=self.debug,
+            headers=self.headers if headers is None else headers,
+            **kwargs
+        )
+    
+    def _raw_headers(self):
+        """直接请求文件原始内容，省去base64解码"""
+        headers = dict(self.headers)
+        headers["Accept"] = "application/vnd.github.raw"
+        return headers
+    
+    def _log_error(self, action, e):
+        if self.debug:
+            print(f"[调试] {action}错误: {e}")
+            if not isinstance(e, requests.exceptions.RequestException):
+                import traceback
+                traceback.print_exc()
     
-    def create_commit(self, file_path, content, message, max_retries=3, retry_delay=2):
-        """创建或更新文件并提交，支持重试机制"""
+    def create_commit(self, file_path, content, message, max_retries=3, retry_delay=2, repo_path=None):
+        """通过内容API创建或更新单个文件并提交（仅用于空仓库的第一个提交）"""
         if self.debug:
-            print(f"[调试] 创建提交 - 文件路径: {file_path}")
+            print(f"[调试] 创建提交 - 文件路径: {file_path or repo_path}")
         
-        # 从文件路径中提取备份信息
-        file_name = Path(file_path).name
-        backup_folder = Path(file_path).parent.name
+        if repo_path is None:
+            # 从文件路径中提取备份信息
+            file_name = Path(file_path).name
+            backup_folder = Path(file_path).parent.name
+            repo_path = f"{backup_folder}/{file_name}"
         
-        # 构造仓库中的路径，并对路径进行URL编码
-        repo_path = f"{backup_folder}/{file_name}"
-        repo_path = urllib.parse.quote(repo_path)
+        # 对仓库中的路径进行URL编码
+        url = f"{self.base_url}/contents/{urllib.parse.quote(repo_path)}"
         
         if self.debug:
             print(f"[调试] 仓库路径: {repo_path}")
         
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                # 首先尝试直接创建文件（不包含sha）
-                method = 'put'
-                data = {
-                    'message': message,
-                    'content': content
-                }
-                
-                # GitHub API需要添加branch参数
-                data['branch'] = 'main'
-                
-                if self.debug:
-                    print(f"[调试] 执行{method}请求（创建新文件） - URL: {self.base_url}/contents/{repo_path}")
-                    print(f"[调试] 请求数据: {data}")
-                
-                response = requests.request(
-                    method,
-                    f"{self.base_url}/contents/{repo_path}",
-                    headers=self.headers,
-                    json=data,
-                    timeout=10
-                )
-                
-                if self.debug:
-                    print(f"[调试] 请求响应状态: {response.status_code}")
-                    print(f"[调试] 请求响应内容: {response.text}")
-                
-                # 如果请求成功，直接返回
-                if response.status_code == 201 or response.status_code == 200:
-                    if self.debug:
-                        print(f"[调试] 提交成功")
-                    return True
-                
-                # 如果失败，可能需要获取sha进行更新
-                if response.status_code == 400:
-                    error_msg = response.text.lower()
-                    if "sha is missing" in error_msg or "sha is empty" in error_msg:
-                        if self.debug:
-                            print(f"[调试] 需要更新现有文件，获取SHA...")
-                        
-                        # 获取文件信息以获取sha
-                        get_url = f"{self.base_url}/contents/{repo_path}?ref=main"
-                        
-                        get_response = requests.get(
-                            get_url,
-                            headers=self.headers,
-                            timeout=10
-                        )
-                        
-                        if get_response.status_code == 200:
-                            file_info = get_response.json()
-                            sha = None
-                            
-                            # 处理Gitee API返回列表的情况
-                            if isinstance(file_info, list):
-                                # 查找匹配的文件
-                                for item in file_info:
-                                    if isinstance(item, dict) and item.get('name') == file_name:
-                                        sha = item.get('sha')
-                                        break
-                            elif isinstance(file_info, dict):
-                                sha = file_info.get('sha')
-                            
-                            if sha:
-                                if self.debug:
-                                    print(f"[调试] 获取到SHA: {sha}，更新文件...")
-                                
-                                # 使用sha更新文件
-                                data['sha'] = sha
-                                
-                                if self.debug:
-                                    print(f"[调试] 执行{method}请求（更新文件） - URL: {self.base_url}/contents/{repo_path}")
-                                    print(f"[调试] 请求数据: {data}")
-                                
-                                update_response = requests.request(
-                                    method,
-                                    f"{self.base_url}/contents/{repo_path}",
-                                    headers=self.headers,
-                                    json=data,
-                                    timeout=10
-                                )
-                                
-                                if self.debug:
-                                    print(f"[调试] 请求响应状态: {update_response.status_code}")
-                                    print(f"[调试] 请求响应内容: {update_response.text}")
-                                
-                                if update_response.status_code == 200:
-                                    if self.debug:
-                                        print(f"[调试] 提交成功")
-                                    return True
-                                elif update_response.status_code == 404:
-                                    # 文件可能已被删除，重新尝试创建
-                                    if self.debug:
-                                        print(f"[调试] 文件不存在，重新尝试创建...")
-                                    del data['sha']
-                                    continue
-                            else:
-                                if self.debug:
-                                    print(f"[调试] 未找到文件 {file_name} 的SHA值，尝试创建新文件...")
-                                # 未找到sha，可能是文件不存在，尝试创建新文件
-                                if 'sha' in data:
-                                    del data['sha']
-                                continue
-            except requests.exceptions.ConnectionError as e:
+        data = {
+            'message': message,
+            'content': content,
+            # GitHub API需要添加branch参数
+            'branch': 'main'
+        }
+        
+        try:
+            response = self._request("put", url, max_retries, retry_delay, json=data)
+            
+            if self.debug:
+                print(f"[调试] 请求响应状态: {response.status_code}")
+            
+            # 文件已存在时需要带上sha进行更新
+            if response.status_code in (400, 409, 422) and "sha" in response.text.lower():
                 if self.debug:
-                    print(f"[调试] GitHub API错误: {e}")
-                    print(f"[调试] 这可能是由于网络不稳定、API限流或GitHub服务器暂时不可用")
+                    print(f"[调试] 需要更新现有文件，获取SHA...")
                 
-                retry_count += 1
-                if retry_count < max_retries:
+                get_response = self._request("get", f"{url}?ref=main", max_retries, retry_delay)
+                if get_response.status_code == 200 and isinstance(get_response.json(), dict):
+                    data['sha'] = get_response.json().get('sha')
+                    response = self._request("put", url, max_retries, retry_delay, json=data)
+                    
                     if self.debug:
-                        print(f"[调试] 等待 {retry_delay} 秒后重试...")
-                    import time
-                    time.sleep(retry_delay)
-                else:
-                    return False
+                        print(f"[调试] 请求响应状态: {response.status_code}")
             
-            except Exception as e:
+            success = response.status_code in (200, 201)
+            if self.debug:
+                print(f"[调试] 提交{'成功' if success else '失败'}")
+            return success
+        
+        except Exception as e:
+            self._log_error("创建提交", e)
+            return False
+    
+    def list_backups(self):
+        """获取所有备份名称，最新的在前面，读取失败时返回None"""
+        entries = self.list_backup_entries()
+        if entries is None:
+            return None
+        return [entry["name"] for entry in entries]
+    
+    def list_backup_entries(self):
+        """通过一次请求读取备份目录文件，返回备份记录列表，最新的在前面
+
+        读取失败时返回None，调用方需要与没有备份（空列表）区分，不能当作云端已清空。
+        """
+        catalog = self.load_catalog()
+        if catalog is None:
+            return None
+        return sorted(catalog["backups"], key=lambda entry: entry["name"], reverse=True)
+    
+    def get_latest_backup(self):
+        """获取最新的备份记录，没有备份或读取失败时返回None（需要区分时使用 list_backup_entries）"""
+        entries = self.list_backup_entries()
+        return entries[0] if entries else None
+    
+    def load_catalog(self, ref="main", max_retries=3, retry_delay=2):
+        """读取指定提交中的备份目录文件
+
+        仓库中还没有目录文件（旧版仓库）时，根据根目录下的备份文件夹生成；
+        请求失败时返回None。
+        """
+        url = f"{self.base_url}/contents/{CATALOG_PATH}?ref={ref}"
+        
+        try:
+            response = self._request("get", url, max_retries, retry_delay, headers=self._raw_headers())
+            
+            if self.debug:
+                print(f"[调试] 读取备份目录响应状态: {response.status_code}")
+            
+            if response.status_code == 200:
+                catalog = parse_catalog(response.content)
+                if catalog is not None:
+                    return catalog
                 if self.debug:
-                    print(f"[调试] GitHub API错误: {e}")
-                    import traceback
-                    traceback.print_exc()
-                return False
+                    print(f"[调试] 备份目录格式错误，根据备份文件夹重新生成")
+            elif response.status_code != 404:
+                return None
         
-        if self.debug:
-            print(f"[调试] 所有 {max_retries} 次尝试都失败了")
-        return False
+        except Exception as e:
+            self._log_error("读取备份目录", e)
+            return None
+        
+        # 没有目录文件：根据备份文件夹生成只有名称的记录
+        names = self.list_backup_dirs(ref=ref, max_retries=max_retries, retry_delay=retry_delay)
+        if names is None:
+            return None
+        catalog = empty_catalog()
+        catalog["backups"] = [{"name": name} for name in names]
+        return catalog
     
-    def list_backups(self, max_retries=3, retry_delay=2):
-        """获取仓库中的所有备份目录，支持重试机制"""
+    def stage_catalog_update(self, builder, add=None, remove=()):
+        """在提交中同步更新备份目录文件，与备份内容原子地一起提交
+
+        add 可以是返回备份记录的函数，在流式文件上传完成后、写入提交时才调用。
+        增量备份与它的基准备份之间的依赖在提交时基于最新的分支头再检查一次：
+        新增记录的基准备份已不存在、或要删除的备份是其他备份的基准时放弃提交。
+        """
+        def generate(head_sha):
+            catalog = self.load_catalog(ref=head_sha)
+            if catalog is None:
+                return None
+            entry = add() if callable(add) else add
+            names = {backup.get("name") for backup in catalog["backups"]} - set(remove)
+            if entry is not None and entry.get("delta_base") and entry["delta_base"] not in names:
+                if self.debug:
+                    print(f"[调试] 增量基准 {entry['delta_base']} 已被删除，放弃提交")
+                return None
+            if any(backup.get("delta_base") in remove for backup in catalog["backups"] if backup.get("name") in names):
+                if self.debug:
+                    print(f"[调试] 要删除的备份是其他增量备份的基准，放弃提交")
+                return None
+            return dump_catalog(update_catalog(catalog, add=entry, remove=remove))
+        
+        builder.add_generated_file(CATALOG_PATH, generate)
+    
+    def list_backup_dirs(self, ref="main", max_retries=3, retry_delay=2):
+        """列出仓库根目录下的备份文件夹，失败时返回None"""
         if self.debug:
-            print(f"[调试] 获取备份列表")
+            print(f"[调试] 获取备份文件夹列表")
         
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                # 获取仓库根目录内容
-                url = f"{self.base_url}/contents/"
-                # GitHub API需要添加ref参数
-                url += "?ref=main"
-                
-                if self.debug:
-                    print(f"[调试] 获取仓库根目录内容 (尝试 {retry_count + 1}/{max_retries}): {url}")
-                
-                response = requests.get(
-                    url,
-                    headers=self.headers,
-                    timeout=10  # 添加超时设置
-                )
+        # 获取仓库根目录内容，GitHub API需要添加ref参数
+        url = f"{self.base_url}/contents/?ref={ref}"
+        
+        try:
+            response = self._request("get", url, max_retries, retry_delay)
+            
+            if self.debug:
+                print(f"[调试] 响应状态: {response.status_code}")
+            
+            if response.status_code == 200:
+                # 过滤出日期时间格式的文件夹，数据块目录不是备份
+                backups = [
+                    item['name'] for item in response.json()
+                    if item['type'] == 'dir' and item['name'] not in self.RESERVED_DIRS
+                ]
                 
-                if self.debug:
-                    print(f"[调试] 响应状态: {response.status_code}")
-                    print(f"[调试] 响应内容: {response.text}")
+                # 按日期时间排序，最新的在前面
+                backups.sort(reverse=True)
                 
-                if response.status_code == 200:
-                    # 过滤出日期时间格式的文件夹
-                    backups = []
-                    items = response.json()
-                    
-
-                    
-                    for item in items:
-                        if item['type'] == 'dir':
-                            backups.append(item['name'])
-                    
-                    # 按日期时间排序，最新的在前面
-                    backups.sort(reverse=True)
-                    
-                    if self.debug:
-                        print(f"[调试] 备份列表: {backups}")
-                    
-                    return backups
-                elif response.status_code == 404:
-                    if self.debug:
-                        print(f"[调试] 获取备份列表失败：仓库或路径不存在")
-                        print(f"[调试] 请检查：1. 仓库所有者 '{self.owner}' 是否正确")
-                        print(f"[调试] 2. 仓库名称 '{self.repo}' 是否正确")
-                        print(f"[调试] 3. 令牌是否有访问权限")
-                        print(f"[调试] 4. 仓库是否为私有")
-                    return []
-                elif response.status_code == 401:
-                    if self.debug:
-                        print(f"[调试] 获取备份列表失败：未授权，请检查令牌是否有效")
-                    return []
-                elif response.status_code == 403:
-                    if self.debug:
-                        print(f"[调试] 获取备份列表失败：权限不足或API限流")
-                    return []
-                else:
-                    if self.debug:
-                        print(f"[调试] 获取备份列表失败，响应状态: {response.status_code}")
-                    
-                    # 增加重试计数
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        if self.debug:
-                            print(f"[调试] 等待 {retry_delay} 秒后重试...")
-                        import time
-                        time.sleep(retry_delay)
-                    else:
-                        return []
-            
-            except requests.exceptions.ConnectionError as e:
                 if self.debug:
-                    print(f"[调试] GitHub API连接错误: {e}")
-                    print(f"[调试] 这可能是由于网络不稳定、API限流或GitHub服务器暂时不可用")
+                    print(f"[调试] 备份列表: {backups}")
                 
-                # 增加重试计数
-                retry_count += 1
-                if retry_count < max_retries:
-                    if self.debug:
-                        print(f"[调试] 等待 {retry_delay} 秒后重试...")
-                    import time
-                    time.sleep(retry_delay)
-                else:
-                    return []
-            
-            except Exception as e:
+                return backups
+            elif response.status_code == 404:
                 if self.debug:
-                    print(f"[调试] GitHub API错误: {e}")
-                    import traceback
-                    traceback.print_exc()
+                    print(f"[调试] 获取备份列表失败：仓库或路径不存在")
+                    print(f"[调试] 请检查：1. 仓库所有者 '{self.owner}' 是否正确")
+                    print(f"[调试] 2. 仓库名称 '{self.repo}' 是否正确")
+                    print(f"[调试] 3. 令牌是否有访问权限")
+                    print(f"[调试] 4. 仓库是否为私有")
                 return []
+            elif response.status_code == 401:
+                if self.debug:
+                    print(f"[调试] 获取备份列表失败：未授权，请检查令牌是否有效")
+            elif response.status_code == 403:
+                if self.debug:
+                    print(f"[调试] 获取备份列表失败：权限不足或API限流")
+            elif self.debug:
+                print(f"[调试] 获取备份列表失败，响应状态: {response.status_code}")
+            return None
         
-        # 所有重试都失败
-        if self.debug:
-            print(f"[调试] 所有 {max_retries} 次尝试都失败了")
-        return []
+        except Exception as e:
+            self._log_error("获取备份列表", e)
+            return None
     
-    def download_backup(self, backup_folder, output_path, max_retries=3, retry_delay=2):
-        """下载指定备份文件夹中的压缩包，支持重试机制"""
+    def download_backup(self, backup_folder, output_path, max_retries=3, retry_delay=2, progress_callback=None):
+        """下载指定备份文件夹中的压缩包，progress_callback(已下载字节, 总字节) 报告进度"""
         if self.debug:
             print(f"[调试] 下载备份 - 备份文件夹: {backup_folder}, 输出路径: {output_path}")
         
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                # 获取备份文件夹内容
+        try:
+            # 获取备份文件夹内容，GitHub API需要添加ref参数
+            folder_url = f"{self.base_url}/contents/{backup_folder}?ref=main"
+            response = self._request("get", folder_url, max_retries, retry_delay)
+            
+            if self.debug:
+                print(f"[调试] 响应状态: {response.status_code}")
+            
+            if response.status_code == 404:
                 if self.debug:
-                    print(f"[调试] 获取备份文件夹内容: {backup_folder} (尝试 {retry_count + 1}/{max_retries})")
-                
-                # 构建请求URL
-                folder_url = f"{self.base_url}/contents/{backup_folder}"
-                # GitHub API需要添加ref参数
-                folder_url += "?ref=main"
-                
-                response = requests.get(
-                    folder_url,
-                    headers=self.headers,
-                    timeout=10
-                )
-                
+                    print(f"[调试] 备份文件夹不存在: {backup_folder}")
+                return False
+            elif response.status_code == 401:
                 if self.debug:
-                    print(f"[调试] 响应状态: {response.status_code}")
-                    print(f"[调试] 响应内容: {response.text}")
-                
-                if response.status_code == 200:
-                    # 找到压缩包文件
-                    zip_file = None
-                    items = response.json()
-                    
-
-                    
-                    for item in items:
-                        if item['type'] == 'file' and item['name'].endswith('.zip'):
-                            zip_file = item
-                            break
-                    
-                    if not zip_file:
-                        if self.debug:
-                            print(f"[调试] 未找到压缩包文件")
-                        return False
-                    
-                    if self.debug:
-                        print(f"[调试] 找到压缩包文件: {zip_file['name']}")
-                    
-                    # 获取下载URL
-                    download_url = zip_file.get('download_url')
-                    
-                    if self.debug:
-                        print(f"[调试] 下载压缩包: {download_url}")
-                    
-                    # 下载文件不需要认证，因为download_url是临时的
-                    download_response = requests.get(
-                        download_url,
-                        timeout=30  # 下载大文件需要更长超时
-                    )
-                    
-                    if self.debug:
-                        print(f"[调试] 下载响应状态: {download_response.status_code}")
-                    
-                    if download_response.status_code == 200:
-                        # 保存到输出路径
-                        if self.debug:
-                            print(f"[调试] 保存到输出路径: {output_path}")
-                        
-                        with open(output_path, 'wb') as f:
-                            f.write(download_response.content)
-                        
-                        if self.debug:
-                            print(f"[调试] 下载成功")
-                        
-                        return True
-                    else:
-                        if self.debug:
-                            print(f"[调试] 下载失败，响应状态: {download_response.status_code}")
-                        return False
-                elif response.status_code == 404:
-                    if self.debug:
-                        print(f"[调试] 备份文件夹不存在: {backup_folder}")
-                    return False
-                elif response.status_code == 401:
-                    if self.debug:
-                        print(f"[调试] 未授权，请检查令牌是否有效")
-                    return False
-                elif response.status_code == 403:
-                    if self.debug:
-                        print(f"[调试] 权限不足或API限流")
-                    return False
-                else:
-                    if self.debug:
-                        print(f"[调试] 获取备份文件夹失败，响应状态: {response.status_code}")
-                    
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        if self.debug:
-                            print(f"[调试] 等待 {retry_delay} 秒后重试...")
-                        import time
-                        time.sleep(retry_delay)
-                    else:
-                        return False
-            
-            except requests.exceptions.ConnectionError as e:
+                    print(f"[调试] 未授权，请检查令牌是否有效")
+                return False
+            elif response.status_code == 403:
                 if self.debug:
-                    print(f"[调试] GitHub API连接错误: {e}")
-                    print(f"[调试] 这可能是由于网络不稳定、API限流或GitHub服务器暂时不可用")
-                
-                retry_count += 1
-                if retry_count < max_retries:
-                    if self.debug:
-                        print(f"[调试] 等待 {retry_delay} 秒后重试...")
-                    import time
-                    time.sleep(retry_delay)
-                else:
-                    return False
+                    print(f"[调试] 权限不足或API限流")
+                return False
+            elif response.status_code != 200:
+                if self.debug:
+                    print(f"[调试] 获取备份文件夹失败，响应状态: {response.status_code}")
+                return False
             
-            except Exception as e:
+            # 找到压缩包文件
+            zip_file = None
+            for item in response.json():
+                if item['type'] == 'file' and item['name'].endswith('.zip'):
+                    zip_file = item
+                    break
+            
+            if not zip_file:
                 if self.debug:
-                    print(f"[调试] GitHub API错误: {e}")
-                    import traceback
-                    traceback.print_exc()
+                    print(f"[调试] 未找到压缩包文件")
                 return False
+            
+            # 获取下载URL
+            download_url = zip_file.get('download_url')
+            
+            if self.debug:
+                print(f"[调试] 找到压缩包文件: {zip_file['name']}")
+                print(f"[调试] 下载压缩包: {download_url}")
+            
+            # 下载文件不需要认证，因为download_url是临时的
+            return self.download_to_file(
+                download_url,
+                output_path,
+                expected_size=zip_file.get('size'),
+                expected_sha=zip_file.get('sha'),
+                progress_callback=progress_callback,
+                headers={},
+                max_retries=max_retries,
+                retry_delay=retry_delay
+            )
         
-        if self.debug:
-            print(f"[调试] 所有 {max_retries} 次尝试都失败了")
-        return False
+        except Exception as e:
+            self._log_error("下载备份", e)
+            return False
     
-    def delete_file(self, file_path, max_retries=3, retry_delay=2):
-        """删除仓库中的文件，支持重试机制"""
-        if self.debug:
-            print(f"[调试] 删除文件 - 文件路径: {file_path}")
+    def download_to_file(self, url, output_path, expected_size=None, expected_sha=None,
+                         progress_callback=None, headers=None, max_retries=3, retry_delay=2,
+                         chunk_size=64 * 1024):
+        """流式下载到临时文件，校验通过后原子地重命名为output_path
+
+        内存占用固定为一个数据块；下载过程中同步计算git blob SHA，
+        与仓库中记录的sha和大小不一致时丢弃临时文件并返回False。
+        """
+        output_path = Path(output_path)
+        temp_path = output_path.with_name(output_path.name + ".part")
         
-        retry_count = 0
-        while retry_count < max_retries:
+        # 传输层只负责建立连接，响应体传输中断时整个下载重新开始
+        for attempt in range(max_retries):
             try:
-                # 获取文件信息的URL
-                get_url = f"{self.base_url}/contents/{file_path}"
-                # GitHub API需要添加ref参数
-                get_url += "?ref=main"
-                
-                if self.debug:
-                    print(f"[调试] 请求文件信息: {get_url} (尝试 {retry_count + 1}/{max_retries})")
-                
-                response = requests.get(
-                    get_url,
-                    headers=self.headers,
-                    timeout=10
+                response = self._request(
+                    "get",
+                    url,
+                    max_retries,
+                    retry_delay,
+                    # 连接超时10秒，两次读取之间最长等待60秒，不限制总下载时间
+                    timeout=(10, 60),
+                    headers=headers,
+                    stream=True
                 )
                 
-                if self.debug:
-                    print(f"[调试] 获取文件信息响应状态: {response.status_code}")
-                    print(f"[调试] 获取文件信息响应: {response.text}")
-                
-                if response.status_code == 200:
-                    # 解析文件信息
-                    file_info = response.json()
-                    sha = file_info.get('sha')
-                    
+                with response, tracing.span("download") as sp:
                     if self.debug:
-                        print(f"[调试] 文件信息: {file_info}")
-                        print(f"[调试] 获取文件SHA: {sha}")
+                        print(f"[调试] 下载响应状态: {response.status_code}")
                     
-                    if not sha:
+                    if response.status_code != 200:
                         if self.debug:
-                            print(f"[调试] 无法获取文件SHA: {file_path}")
+                            print(f"[调试] 下载失败，响应状态: {response.status_code}")
                         return False
                     
-                    # 执行删除操作
-                    delete_data = {
-                        'message': f"删除备份文件: {file_path}",
-                        'sha': sha
-                    }
-                    
-                    # GitHub API需要添加branch参数
-                    delete_data['branch'] = 'main'
-                    
-                    if self.debug:
-                        print(f"[调试] 准备删除请求数据: {delete_data}")
-                    
-                    response = requests.delete(
-                        f"{self.base_url}/contents/{file_path}",
-                        headers=self.headers,
-                        json=delete_data,
-                        timeout=10
-                    )
-                    
-                    if self.debug:
-                        print(f"[调试] 删除文件响应状态: {response.status_code}")
-                        print(f"[调试] 删除文件响应: {response.text}")
+                    total = expected_size or int(response.headers.get("Content-Length") or 0)
+                    digest = hashlib.sha1(f"blob {expected_size}\0".encode()) if expected_sha and expected_size is not None else None
+                    downloaded = 0
                     
-                    # 检查响应状态
-                    success = response.status_code == 200
-                    if success:
-                        if self.debug:
-                            print(f"[调试] 文件删除成功: {file_path}")
-                    else:
-                        if self.debug:
-                            print(f"[调试] 文件删除失败: {file_path}")
-                    
-                    return success
-                elif response.status_code == 404:
-                    if self.debug:
-                        print(f"[调试] 文件不存在: {file_path}")
-                    return False
-                elif response.status_code == 401:
+                    with open(temp_path, 'wb') as f:
+                        for block in response.iter_content(chunk_size=chunk_size):
+                            if not block:
+                                continue
+                            f.write(block)
+                            downloaded += len(block)
+                            if digest is not None:
+                                digest.update(block)
+                            if progress_callback:
+                                progress_callback(downloaded, total)
+                    sp.set(bytes=downloaded)
+                
+                if expected_size is not None and downloaded != expected_size:
                     if self.debug:
-                        print(f"[调试] 未授权，请检查令牌是否有效")
+                        print(f"[调试] 下载大小不一致: {downloaded} != {expected_size}")
+                    temp_path.unlink()
                     return False
-                elif response.status_code == 403:
+                
+                if digest is not None and digest.hexdigest() != expected_sha:
                     if self.debug:
-                        print(f"[调试] 权限不足或API限流")
+                        print(f"[调试] 下载校验失败: {digest.hexdigest()} != {expected_sha}")
+                    temp_path.unlink()
                     return False
-                else:
-                    if self.debug:
-                        print(f"[调试] 获取文件信息失败，响应状态: {response.status_code}")
-                    
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        if self.debug:
-                            print(f"[调试] 等待 {retry_delay} 秒后重试...")
-                        import time
-                        time.sleep(retry_delay)
-                    else:
-                        return False
+                
+                os.replace(temp_path, output_path)
+                
+                if self.debug:
+                    print(f"[调试] 下载成功: {output_path}, {downloaded}字节")
+                return True
             
-            except requests.exceptions.ConnectionError as e:
+            except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
                 if self.debug:
-                    print(f"[调试] GitHub API连接错误: {e}")
-                    print(f"[调试] 这可能是由于网络不稳定、API限流或GitHub服务器暂时不可用")
-                
-                retry_count += 1
-                if retry_count < max_retries:
-                    if self.debug:
-                        print(f"[调试] 等待 {retry_delay} 秒后重试...")
-                    import time
-                    time.sleep(retry_delay)
-                else:
-                    return False
+                    print(f"[调试] 下载中断 (尝试 {attempt + 1}/{max_retries}): {e}")
+                if temp_path.exists():
+                    temp_path.unlink()
             
             except Exception as e:
-                if self.debug:
-                    print(f"[调试] 删除文件错误: {e}")
-                    import traceback
-                    traceback.print_exc()
+                self._log_error("下载文件", e)
+                if temp_path.exists():
+                    temp_path.unlink()
                 return False
         
-        if self.debug:
-            print(f"[调试] 所有 {max_retries} 次尝试都失败了")
         return False
     
-    def delete_backup(self, backup_folder, max_retries=3, retry_delay=2):
-        """删除仓库中的备份文件夹，支持重试机制"""
+    def delete_file(self, file_path, max_retries=3, retry_delay=2):
+        """通过内容API删除仓库中的单个文件"""
         if self.debug:
-            print(f"[调试] 删除备份 - 文件夹: {backup_folder}")
+            print(f"[调试] 删除文件 - 文件路径: {file_path}")
         
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                # 构建请求URL
-                folder_url = f"{self.base_url}/contents/{backup_folder}"
-                # GitHub API需要添加ref参数
-                folder_url += "?ref=main"
-                
-                if self.debug:
-                    print(f"[调试] 请求文件夹内容: {folder_url} (尝试 {retry_count + 1}/{max_retries})")
-                
-                response = requests.get(
-                    folder_url,
-                    headers=self.headers,
-                    timeout=10
-                )
-                
-                if self.debug:
-                    print(f"[调试] 获取文件夹内容响应状态: {response.status_code}")
-                    print(f"[调试] 获取文件夹内容响应: {response.text}")
-                
-                if response.status_code == 200:
-                    # 解析文件夹内容
-                    files = response.json()
-                    
-
-                    
-                    if self.debug:
-                        print(f"[调试] 文件夹内容: {files}")
-                    
-                    # 删除文件夹中的所有文件
-                    success = True
-                    for file in files:
-                        if file['type'] == 'file':
-                            file_path = f"{backup_folder}/{file['name']}"
-                            if self.debug:
-                                print(f"[调试] 准备删除文件: {file_path}")
-                            
-                            if not self.delete_file(file_path, max_retries=2, retry_delay=1):
-                                if self.debug:
-                                    print(f"[调试] 删除文件失败: {file_path}")
-                                success = False
-                    
-                    if self.debug:
-                        print(f"[调试] 备份删除{'成功' if success else '失败'}")
-                    
-                    return success
-                elif response.status_code == 404:
-                    if self.debug:
-                        print(f"[调试] 备份文件夹不存在: {backup_folder}")
-                    return False
-                elif response.status_code == 401:
-                    if self.debug:
-                        print(f"[调试] 未授权，请检查令牌是否有效")
-                    return False
-                elif response.status_code == 403:
-                    if self.debug:
-                        print(f"[调试] 权限不足或API限流")
-                    return False
-                else:
-                    if self.debug:
-                        print(f"[调试] 获取文件夹内容失败，响应状态: {response.status_code}")
-                    
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        if self.debug:
-                            print(f"[调试] 等待 {retry_delay} 秒后重试...")
-                        import time
-                        time.sleep(retry_delay)
-                    else:
-                        return False
+        try:
+            # 获取文件信息，GitHub API需要添加ref参数
+            url = f"{self.base_url}/contents/{file_path}"
+            response = self._request("get", f"{url}?ref=main", max_retries, retry_delay)
             
-            except requests.exceptions.ConnectionError as e:
+            if self.debug:
+                print(f"[调试] 获取文件信息响应状态: {response.status_code}")
+            
+            if response.status_code != 200:
                 if self.debug:
-                    print(f"[调试] GitHub API连接错误: {e}")
-                    print(f"[调试] 这可能是由于网络不稳定、API限流或GitHub服务器暂时不可用")
-                
-                retry_count += 1
-                if retry_count < max_retries:
-                    if self.debug:
-                        print(f"[调试] 等待 {retry_delay} 秒后重试...")
-                    import time
-                    time.sleep(retry_delay)
-                else:
-                    return False
+                    print(f"[调试] 获取文件信息失败: {file_path}")
+                return False
             
-            except Exception as e:
+            sha = response.json().get('sha')
+            if not sha:
                 if self.debug:
-                    print(f"[调试] 删除备份错误: {e}")
-                    import traceback
-                    traceback.print_exc()
+                    print(f"[调试] 无法获取文件SHA: {file_path}")
                 return False
+            
+            # 执行删除操作
+            delete_data = {
+                'message': f"删除备份文件: {file_path}",
+                'sha': sha,
+                'branch': 'main'
+            }
+            response = self._request("delete", url, max_retries, retry_delay, json=delete_data)
+            
+            if self.debug:
+                print(f"[调试] 删除文件响应状态: {response.status_code}")
+            
+            success = response.status_code == 200
+            if self.debug:
+                print(f"[调试] 文件删除{'成功' if success else '失败'}: {file_path}")
+            return success
+        
+        except Exception as e:
+            self._log_error("删除文件", e)
+            return False
+    
+    def delete_backup(self, backup_folder, max_retries=3, retry_delay=2):
+        """删除仓库中的备份文件夹，整个文件夹在一次提交中删除"""
+        if self.debug:
+            print(f"[调试] 删除备份 - 文件夹: {backup_folder}")
+        
+        builder = self.new_commit(f"删除备份: {backup_folder}")
+        builder.delete_tree(backup_folder)
+        self.stage_catalog_update(builder, remove=[backup_folder])
+        success = builder.commit(max_retries=max_retries) is not None
+        
+        if self.debug:
+            print(f"[调试] 备份删除{'成功' if success else '失败'}")
+        
+        return success
     
     def delete_all_backups(self):
         """删除仓库中的所有备份"""
@@ -625,6 +463,10 @@ class GitAPI:
         try:
             # 获取所有备份文件夹
             backups = self.list_backups()
+            if backups is None:
+                if self.debug:
+                    print(f"[调试] 读取备份目录失败，无法删除所有备份")
+                return False
             
             if self.debug:
                 print(f"[调试] 找到 {len(backups)} 个备份文件夹")
@@ -634,15 +476,18 @@ class GitAPI:
                     print(f"[调试] 没有找到备份文件夹")
                 return True
             
-            # 逐个删除备份
+            # 所有备份和数据块在同一次提交中删除
+            builder = self.new_commit("删除所有备份")
             for backup in backups:
+                builder.delete_tree(backup)
+            if self.list_chunk_hashes():
+                builder.delete_tree("chunks")
+            builder.add_file(CATALOG_PATH, dump_catalog(empty_catalog()))
+            
+            if builder.commit() is None:
                 if self.debug:
-                    print(f"[调试] 开始删除备份: {backup}")
-                
-                if not self.delete_backup(backup):
-                    if self.debug:
-                        print(f"[调试] 删除备份失败: {backup}")
-                    return False
+                    print(f"[调试] 删除所有备份失败")
+                return False
             
             if self.debug:
                 print(f"[调试] 所有备份删除成功")
@@ -656,260 +501,668 @@ class GitAPI:
                 traceback.print_exc()
             return False
     
-    def upload_file(self, file_path, message, max_retries=3, retry_delay=2):
-        """上传文件到仓库，支持重试机制"""
+    def upload_file(self, file_path, message, max_retries=3, retry_delay=2, catalog_entry=None):
+        """上传文件到仓库，文件内容边读取边上传，不整体读入内存"""
         if self.debug:
             print(f"[调试] 上传文件 - 文件路径: {file_path}")
         
+        if not Path(file_path).is_file():
+            if self.debug:
+                print(f"[调试] 上传文件失败：文件不存在 {file_path}")
+            return False
+        
+        if self.debug:
+            print(f"[调试] 文件大小: {Path(file_path).stat().st_size}字节")
+        
+        repo_path = f"{Path(file_path).parent.name}/{Path(file_path).name}"
+        return self.upload_stream(repo_path, lambda: iter_file(file_path), message, max_retries=max_retries, retry_delay=retry_delay, catalog_entry=catalog_entry)
+
+    def upload_stream(self, repo_path, open_stream, message, max_retries=3, retry_delay=2, catalog_entry=None):
+        """把流式产生的数据上传到仓库的指定路径
+
+        open_stream() 每次调用返回一个新的字节块迭代器（如压缩包生成器），
+        数据边产生边base64编码写入请求体，内存中只保留一个数据块；
+        上传失败重试时重新调用 open_stream() 从头产生数据。
+        """
+        if self.debug:
+            print(f"[调试] 流式上传 - 仓库路径: {repo_path}")
+
         try:
-            # 读取文件内容并编码为base64
-            with open(file_path, 'rb') as f:
-                content = f.read()
+            builder = self.new_commit(message)
+            builder.add_stream(repo_path, open_stream)
+            if catalog_entry is not None:
+                self.stage_catalog_update(builder, add=catalog_entry)
+            if builder.commit(max_retries=max_retries):
+                return True
+            if not builder.branch_missing:
+                return False
             
-            import base64
-            encoded_content = base64.b64encode(content).decode('utf-8')
+            # 空仓库没有分支，Git数据API不可用，退回到内容API创建第一个提交
+            if not self.create_commit_stream(repo_path, open_stream, message, max_retries=max_retries, retry_delay=retry_delay):
+                return False
+            if catalog_entry is not None:
+                # 分支已创建，补写备份目录文件；没有写入时备份不在目录中，按上传失败处理
+                builder = self.new_commit(message)
+                self.stage_catalog_update(builder, add=catalog_entry)
+                if not builder.commit(max_retries=max_retries):
+                    if self.debug:
+                        print(f"[调试] 补写备份目录失败: {repo_path}")
+                    return False
+            return True
+        
+        except Exception as e:
+            self._log_error("流式上传", e)
+            return False
+
+    def post_stream(self, method, url, fields, key, open_stream, max_retries=3, retry_delay=2):
+        """以JSON请求体流式上传数据，数据经base64编码后作为 fields[key] 的值
+
+        请求体是生成器，已经发出的部分无法重放，因此传输层只尝试一次，
+        重试时重新调用 open_stream() 生成完整的请求体。无法连接时返回None。
+        """
+        headers = dict(self.headers)
+        headers["Content-Type"] = "application/json"
+        response = None
+        
+        for attempt in range(max_retries):
+            try:
+                response = self._request(
+                    method,
+                    url,
+                    max_retries=1,
+                    # 连接超时10秒，上传大文件时等待响应最长120秒
+                    timeout=(10, 120),
+                    headers=headers,
+                    data=iter_base64_json(fields, key, open_stream())
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if self.debug:
+                    print(f"[调试] 流式上传中断 (尝试 {attempt + 1}/{max_retries}): {e}")
+                response = None
+                continue
             
             if self.debug:
-                print(f"[调试] 文件大小: {len(content)}字节")
+                print(f"[调试] 流式上传响应状态: {response.status_code}")
             
-            # 调用create_commit方法上传，传入重试参数
-            return self.create_commit(file_path, encoded_content, message, max_retries=max_retries, retry_delay=retry_delay)
+            if response.status_code < 500:
+                return response
+            
+            if attempt < max_retries - 1:
+                import time
+                time.sleep(retry_delay)
         
-        except FileNotFoundError:
-            if self.debug:
-                print(f"[调试] 上传文件失败：文件不存在 {file_path}")
+        return response
+
+    def create_commit_stream(self, repo_path, open_stream, message, max_retries=3, retry_delay=2):
+        """通过内容API流式创建单个文件并提交（仅用于空仓库的第一个提交）"""
+        if self.debug:
+            print(f"[调试] 流式创建提交 - 仓库路径: {repo_path}")
+        
+        url = f"{self.base_url}/contents/{urllib.parse.quote(repo_path)}"
+        try:
+            response = self.post_stream("put", url, {"message": message, "branch": "main"}, "content", open_stream, max_retries, retry_delay)
+        except Exception as e:
+            self._log_error("流式创建提交", e)
             return False
+        
+        success = response is not None and response.status_code in (200, 201)
+        if self.debug:
+            print(f"[调试] 提交{'成功' if success else '失败'}")
+        return success
+
+    def upload_bytes(self, repo_path, data, message, max_retries=3, retry_delay=2, catalog_entry=None):
+        """把内存中的数据上传到仓库的指定路径，支持重试机制
+
+        传入 catalog_entry 时在同一次提交中把该备份记录写入备份目录文件。
+        """
+        if self.debug:
+            print(f"[调试] 上传数据 - 仓库路径: {repo_path}, 大小: {len(data)}字节")
+
+        builder = self.new_commit(message)
+        builder.add_file(repo_path, data)
+        if catalog_entry is not None:
+            self.stage_catalog_update(builder, add=catalog_entry)
+        if builder.commit(max_retries=max_retries):
+            return True
+        if not builder.branch_missing:
+            return False
+        
+        # 空仓库没有分支，Git数据API不可用，退回到内容API创建第一个提交
+        import base64
+        encoded_content = base64.b64encode(data).decode('utf-8')
+        if not self.create_commit(None, encoded_content, message, max_retries=max_retries, retry_delay=retry_delay, repo_path=repo_path):
+            return False
+        if catalog_entry is not None:
+            # 分支已创建，补写备份目录文件；没有写入时备份不在目录中，按上传失败处理
+            builder = self.new_commit(message)
+            self.stage_catalog_update(builder, add=catalog_entry)
+            if not builder.commit(max_retries=max_retries):
+                if self.debug:
+                    print(f"[调试] 补写备份目录失败: {repo_path}")
+                return False
+        return True
+
+    def get_file_bytes(self, repo_path, ref="main", max_retries=3, retry_delay=2):
+        """读取仓库中文件的原始内容，文件不存在或失败时返回None"""
+        if self.debug:
+            print(f"[调试] 读取文件 - 仓库路径: {repo_path}")
+        
+        url = f"{self.base_url}/contents/{urllib.parse.quote(repo_path)}?ref={ref}"
+        
+        try:
+            response = self._request("get", url, max_retries, retry_delay, timeout=30, headers=self._raw_headers())
+            
+            if self.debug:
+                print(f"[调试] 读取文件响应状态: {response.status_code}")
+            
+            if response.status_code == 200:
+                return response.content
+            return None
+        
         except Exception as e:
+            self._log_error("读取文件", e)
+            return None
+    
+    def get_head(self, branch="main"):
+        """获取分支当前指向的提交SHA，分支不存在或失败时返回None"""
+        response = self._git_data_request("get", f"ref/heads/{branch}")
+        if response is None or response.status_code != 200:
+            return None
+        return response.json()['object']['sha']
+    
+    def list_tree(self, ref="main", max_retries=3, retry_delay=2):
+        """通过一次递归树请求列出仓库中的所有文件，返回 {路径: blob SHA}
+
+        空仓库返回空字典；请求失败或列表被截断（不完整）时返回None。
+        """
+        url = f"{self.base_url}/git/trees/{ref}?recursive=1"
+        
+        try:
+            response = self._request("get", url, max_retries, retry_delay, timeout=30)
+            
             if self.debug:
-                print(f"[调试] 上传文件错误: {e}")
-                import traceback
-                traceback.print_exc()
-            return False
+                print(f"[调试] 获取仓库树响应状态: {response.status_code}")
+            
+            if response.status_code in (404, 409):
+                # 空仓库或分支不存在
+                return {}
+            if response.status_code != 200:
+                return None
+            
+            tree = response.json()
+            if tree.get('truncated'):
+                if self.debug:
+                    print(f"[调试] 仓库树被截断")
+                return None
+            
+            return {
+                item['path']: item.get('sha')
+                for item in tree.get('tree', [])
+                if item.get('type') == 'blob'
+            }
+        
+        except Exception as e:
+            self._log_error("获取仓库树", e)
+            return None
+    
+    def list_chunk_hashes(self, max_retries=3, retry_delay=2):
+        """通过一次递归树请求获取远端已有的数据块哈希集合，失败时返回None"""
+        if self.debug:
+            print(f"[调试] 获取远端数据块列表")
+        
+        # 列表不完整时无法判断哪些块缺失
+        files = self.list_tree(max_retries=max_retries, retry_delay=retry_delay)
+        if files is None:
+            return None
+        
+        hashes = {path.rsplit("/", 1)[-1] for path in files if path.startswith("chunks/")}
+        if self.debug:
+            print(f"[调试] 远端已有 {len(hashes)} 个数据块")
+        return hashes
     
     def create_release(self, tag_name, name, body, prerelease=False, target_commitish="main", max_retries=3, retry_delay=2):
-        """创建发布版本，支持重试机制"""
+        """创建发布版本"""
         if self.debug:
             print(f"[调试] 创建发布 - 标签名: {tag_name}, 名称: {name}")
         
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                # 构建发布数据
-                release_data = {
-                    "tag_name": tag_name,
-                    "name": name,
-                    "body": body,
-                    "prerelease": prerelease,
-                    "target_commitish": target_commitish
-                }
-                
-
-                
-                if self.debug:
-                    print(f"[调试] 发布数据: {release_data}")
-                
-                # 发送请求
-                url = f"{self.base_url}/releases"
-                response = requests.post(
-                    url,
-                    headers=self.headers,
-                    json=release_data,
-                    timeout=10
-                )
-                
-                if self.debug:
-                    print(f"[调试] 创建发布响应状态: {response.status_code}")
-                    print(f"[调试] 创建发布响应内容: {response.text}")
-                
-                if response.status_code == 201:
-                    # 发布创建成功
-                    return response.json()
-                elif response.status_code == 409 and "already exists" in response.text:
-                    # 标签已存在，获取现有发布
-                    if self.debug:
-                        print(f"[调试] 标签已存在，获取现有发布")
-                    return self.get_release_by_tag(tag_name)
-                else:
-                    # 其他错误，重试
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        if self.debug:
-                            print(f"[调试] 创建发布失败，等待 {retry_delay} 秒后重试...")
-                        import time
-                        time.sleep(retry_delay)
-                    else:
-                        return None
-                
-            except Exception as e:
+        # 构建发布数据
+        release_data = {
+            "tag_name": tag_name,
+            "name": name,
+            "body": body,
+            "prerelease": prerelease,
+            "target_commitish": target_commitish
+        }
+        
+        try:
+            response = self._request("post", f"{self.base_url}/releases", max_retries, retry_delay, json=release_data)
+            
+            if self.debug:
+                print(f"[调试] 创建发布响应状态: {response.status_code}")
+            
+            if response.status_code == 201:
+                # 发布创建成功
+                return response.json()
+            elif response.status_code in (409, 422) and "already_exists" in response.text.replace(" ", "_"):
+                # 标签已存在，获取现有发布
                 if self.debug:
-                    print(f"[调试] 创建发布错误: {e}")
-                    import traceback
-                    traceback.print_exc()
-                retry_count += 1
-                if retry_count < max_retries:
-                    if self.debug:
-                        print(f"[调试] 创建发布失败，等待 {retry_delay} 秒后重试...")
-                    import time
-                    time.sleep(retry_delay)
-                else:
-                    return None
+                    print(f"[调试] 标签已存在，获取现有发布")
+                return self.get_release_by_tag(tag_name)
+            return None
         
-        return None
+        except Exception as e:
+            self._log_error("创建发布", e)
+            return None
     
     def get_release_by_tag(self, tag_name, max_retries=3, retry_delay=2):
-        """根据标签名获取发布信息，支持重试机制"""
+        """根据标签名获取发布信息"""
         if self.debug:
             print(f"[调试] 获取发布 - 标签名: {tag_name}")
         
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                url = f"{self.base_url}/releases/tags/{tag_name}"
-                response = requests.get(
-                    url,
-                    headers=self.headers,
-                    timeout=10
-                )
-                
-                if self.debug:
-                    print(f"[调试] 获取发布响应状态: {response.status_code}")
-                
-                if response.status_code == 200:
-                    return response.json()
-                elif response.status_code == 404:
-                    return None
-                else:
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        if self.debug:
-                            print(f"[调试] 获取发布失败，等待 {retry_delay} 秒后重试...")
-                        import time
-                        time.sleep(retry_delay)
-                    else:
-                        return None
+        try:
+            response = self._request("get", f"{self.base_url}/releases/tags/{tag_name}", max_retries, retry_delay)
             
-            except Exception as e:
-                if self.debug:
-                    print(f"[调试] 获取发布错误: {e}")
-                    import traceback
-                    traceback.print_exc()
-                retry_count += 1
-                if retry_count < max_retries:
-                    if self.debug:
-                        print(f"[调试] 获取发布失败，等待 {retry_delay} 秒后重试...")
-                    import time
-                    time.sleep(retry_delay)
-                else:
-                    return None
+            if self.debug:
+                print(f"[调试] 获取发布响应状态: {response.status_code}")
+            
+            if response.status_code == 200:
+                return response.json()
+            return None
         
-        return None
+        except Exception as e:
+            self._log_error("获取发布", e)
+            return None
     
     def list_releases(self, max_retries=3, retry_delay=2):
-        """获取发布列表，支持重试机制"""
+        """获取发布列表"""
         if self.debug:
             print(f"[调试] 获取发布列表")
         
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                url = f"{self.base_url}/releases"
-                response = requests.get(
-                    url,
-                    headers=self.headers,
-                    timeout=10
-                )
-                
-                if self.debug:
-                    print(f"[调试] 获取发布列表响应状态: {response.status_code}")
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        if self.debug:
-                            print(f"[调试] 获取发布列表失败，等待 {retry_delay} 秒后重试...")
-                        import time
-                        time.sleep(retry_delay)
-                    else:
-                        return []
+        try:
+            response = self._request("get", f"{self.base_url}/releases", max_retries, retry_delay)
             
-            except Exception as e:
-                if self.debug:
-                    print(f"[调试] 获取发布列表错误: {e}")
-                    import traceback
-                    traceback.print_exc()
-                retry_count += 1
-                if retry_count < max_retries:
-                    if self.debug:
-                        print(f"[调试] 获取发布列表失败，等待 {retry_delay} 秒后重试...")
-                    import time
-                    time.sleep(retry_delay)
-                else:
-                    return []
+            if self.debug:
+                print(f"[调试] 获取发布列表响应状态: {response.status_code}")
+            
+            if response.status_code == 200:
+                return response.json()
+            return []
         
-        return []
+        except Exception as e:
+            self._log_error("获取发布列表", e)
+            return []
     
     def upload_release_asset(self, release_id, file_path, max_retries=3, retry_delay=2):
-        """上传发布附件，支持重试机制"""
+        """上传发布附件"""
         if self.debug:
             print(f"[调试] 上传发布附件 - 发布ID: {release_id}, 文件路径: {file_path}")
         
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                # 读取文件内容
-                with open(file_path, 'rb') as f:
-                    file_content = f.read()
-                
-                # 获取文件名
-                file_name = Path(file_path).name
-                content_type = "application/octet-stream"  # 默认MIME类型
-                
-                if self.debug:
-                    print(f"[调试] 文件名: {file_name}, 文件大小: {len(file_content)}字节")
-                
-                # GitHub API
-                url = f"https://uploads.github.com/repos/{self.owner}/{self.repo}/releases/{release_id}/assets?name={file_name}"
-                headers = {
-                    "Authorization": f"token {self.token}",
-                    "Content-Type": content_type
-                }
-                response = requests.post(
-                    url,
-                    headers=headers,
-                    data=file_content,
-                    timeout=30  # 上传大文件需要更长超时
-                )
-                
+        try:
+            # 读取文件内容
+            with open(file_path, 'rb') as f:
+                file_content = f.read()
+            
+            # 获取文件名
+            file_name = Path(file_path).name
+            
+            if self.debug:
+                print(f"[调试] 文件名: {file_name}, 文件大小: {len(file_content)}字节")
+            
+            # GitHub API
+            url = f"{self.uploads_url}/releases/{release_id}/assets?name={urllib.parse.quote(file_name)}"
+            headers = {
+                "Authorization": f"token {self.token}",
+                "Content-Type": "application/octet-stream"  # 默认MIME类型
+            }
+            response = self._request(
+                "post",
+                url,
+                max_retries,
+                retry_delay,
+                timeout=30,  # 上传大文件需要更长超时
+                headers=headers,
+                data=file_content
+            )
+            
+            if self.debug:
+                print(f"[调试] 上传发布附件响应状态: {response.status_code}")
+            
+            if response.status_code in (200, 201):
+                return response.json()
+            return None
+        
+        except Exception as e:
+            self._log_error("上传发布附件", e)
+            return None
+
+    def _git_data_request(self, method, endpoint, payload=None, max_retries=3, retry_delay=2):
+        """调用Git数据API，返回响应对象，无法连接时返回None"""
+        try:
+            response = self._request(method, f"{self.base_url}/git/{endpoint}", max_retries, retry_delay, timeout=30, json=payload)
+            
+            if self.debug:
+                print(f"[调试] {method.upper()} git/{endpoint} 响应状态: {response.status_code}")
+            
+            return response
+        
+        except Exception as e:
+            self._log_error("Git数据API", e)
+            return None
+
+    def _blob_cache_path(self):
+        """路径→blob SHA缓存文件，默认存放在用户应用数据目录"""
+        if self.blob_cache_file is not None:
+            return Path(self.blob_cache_file)
+        from config import get_app_data_dir
+        return get_app_data_dir() / "blob_cache.json"
+
+    def load_blob_cache(self):
+        """读取本仓库的路径→blob SHA缓存"""
+        import json
+        try:
+            with open(self._blob_cache_path(), 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return cache.get(f"{self.owner}/{self.repo}", {})
+
+    def save_blob_cache(self, repo_cache):
+        """写回本仓库的路径→blob SHA缓存"""
+        import json
+        cache_path = self._blob_cache_path()
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        cache[f"{self.owner}/{self.repo}"] = repo_cache
+        tmp_path = cache_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, cache_path)
+
+    def new_commit(self, message, branch="main", base=None):
+        """创建提交构建器，用于一次提交写入或删除多个文件"""
+        return CommitBuilder(self, message, branch=branch, base=base)
+
+
+def iter_file(file_path, block_size=256 * 1024):
+    """逐块读取文件内容"""
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            yield block
+
+
+def iter_base64_json(fields, key, blocks):
+    """生成 {**fields, key: base64(数据)} 的JSON请求体，数据块边读取边编码
+
+    base64每3字节编码为4个字符，不足3字节的尾部留到下一块一起编码，
+    保证分块编码的结果与整体编码完全一致。
+    """
+    import json
+    import time
+    import base64
+    head = json.dumps(fields, ensure_ascii=False)[:-1]
+    yield f'{head}{", " if fields else ""}"{key}": "'.encode('utf-8')
+    
+    with tracing.span("encode") as sp:
+        rest = b""
+        for block in blocks:
+            if not block:
+                continue
+            data = rest + block if rest else block
+            cut = len(data) - len(data) % 3
+            if cut:
+                started = time.perf_counter()
+                encoded = base64.b64encode(data[:cut])
+                sp.add(busy_ms=(time.perf_counter() - started) * 1000, bytes=cut)
+                yield encoded
+            rest = data[cut:]
+        if rest:
+            sp.add(bytes=len(rest))
+            yield base64.b64encode(rest)
+    yield b'"}'
+
+
+def git_blob_sha(data):
+    """按git的规则计算blob的SHA，与GitHub返回的值一致"""
+    header = f"blob {len(data)}\0".encode()
+    return hashlib.sha1(header + data).hexdigest()
+
+
+class CommitBuilder:
+    # 并发创建blob的线程数，blob之间互不依赖
+    BLOB_WORKERS = 8
+
+    def __init__(self, git_api, message, branch="main", base=None):
+        """通过Git数据API构建单个提交：blob → tree → commit → 移动分支引用
+
+        无论文件数量多少，往返次数固定：读取引用、(读取提交)、并发创建blob、
+        创建树、创建提交、更新引用。
+        base 为提交SHA时，只在分支仍指向该提交时提交；改动依据的是该提交的内容，
+        分支被其他设备更新后放弃提交，而不是基于新的分支头重试。
+        """
+        self.git_api = git_api
+        self.message = message
+        self.branch = branch
+        self.base = base
+        self.debug = git_api.debug
+        self.files = {}
+        self.generated = {}
+        self.streams = {}
+        self.deleted_trees = []
+        self.deleted_files = []
+        # 分支不存在时（空仓库）Git数据API不可用，调用方需退回到内容API
+        self.branch_missing = False
+
+    def add_file(self, repo_path, data):
+        """添加或覆盖文件"""
+        self.files[repo_path] = data
+
+    def add_stream(self, repo_path, open_stream):
+        """添加流式产生内容的文件，open_stream() 返回字节块迭代器
+
+        内容在上传过程中才产生，blob SHA由GitHub返回，无法预先跳过已存在的blob。
+        """
+        self.streams[repo_path] = open_stream
+
+    def add_generated_file(self, repo_path, generate):
+        """添加依赖分支当前内容的文件（如备份目录）
+
+        generate(head_sha) 在每次提交尝试时基于最新的分支头调用，返回字节数据，
+        返回None则放弃提交。分支被其他设备更新后重试时不会覆盖对方的改动。
+        """
+        self.generated[repo_path] = generate
+
+    def delete_tree(self, repo_path):
+        """删除目录（及其中所有文件）"""
+        self.deleted_trees.append(repo_path)
+
+    def delete_file(self, repo_path):
+        """删除单个文件"""
+        self.deleted_files.append(repo_path)
+
+    def _get_head(self):
+        response = self.git_api._git_data_request("get", f"ref/heads/{self.branch}")
+        if response is None:
+            return None
+        if response.status_code in (404, 409):
+            self.branch_missing = True
+            return None
+        if response.status_code != 200:
+            return None
+        return response.json()['object']['sha']
+
+    def _get_base_tree(self, head_sha, cache):
+        # 上一次由本机创建的提交，其树SHA已缓存，可省去一次往返
+        commit_trees = cache.get("__commit_trees__", {})
+        if head_sha in commit_trees:
+            return commit_trees[head_sha]
+        response = self.git_api._git_data_request("get", f"commits/{head_sha}")
+        if response is None or response.status_code != 200:
+            return None
+        return response.json()['tree']['sha']
+
+    def _create_blob(self, repo_path, data):
+        import base64
+        response = self.git_api._git_data_request("post", "blobs", {
+            "content": base64.b64encode(data).decode('utf-8'),
+            "encoding": "base64"
+        })
+        if response is None or response.status_code != 201:
+            if self.debug:
+                print(f"[调试] 创建blob失败: {repo_path}")
+            return None
+        return response.json()['sha']
+
+    def _create_blob_stream(self, repo_path, open_stream):
+        response = self.git_api.post_stream(
+            "post",
+            f"{self.git_api.base_url}/git/blobs",
+            {"encoding": "base64"},
+            "content",
+            open_stream
+        )
+        if response is None or response.status_code != 201:
+            if self.debug:
+                print(f"[调试] 流式创建blob失败: {repo_path}")
+            return None
+        return response.json()['sha']
+
+    def _upload_blobs(self, pending):
+        """并发上传blob，全部成功返回True"""
+        if not pending:
+            return True
+        from concurrent.futures import ThreadPoolExecutor
+        workers = min(self.BLOB_WORKERS, len(pending))
+        # 工作线程中的请求记录在当前追踪段下
+        parent = tracing.current()
+
+        def create(item):
+            with tracing.span("blob", parent=parent, bytes=len(item[1])):
+                return self._create_blob(*item)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(create, pending))
+        return all(results)
+
+    def commit(self, max_retries=3):
+        """提交所有改动，成功返回新提交的SHA，否则返回None"""
+        with tracing.span("commit", files=len(self.files) + len(self.generated) + len(self.streams)) as sp:
+            commit_sha = self._commit(max_retries)
+            sp.set(success=commit_sha is not None)
+            return commit_sha
+
+    def _commit(self, max_retries):
+        if self.debug:
+            print(f"[调试] 构建提交 - 写入 {len(self.files) + len(self.generated) + len(self.streams)} 个文件, 删除 {len(self.deleted_trees)} 个目录和 {len(self.deleted_files)} 个文件")
+
+        cache = self.git_api.load_blob_cache()
+        known_blobs = {sha for path, sha in cache.items() if not path.startswith("__")}
+        uploaded = set()
+        stream_shas = None
+
+        for attempt in range(max_retries):
+            head_sha = self._get_head()
+            if head_sha is None:
+                return None
+            if self.base is not None and head_sha != self.base:
                 if self.debug:
-                    print(f"[调试] 上传发布附件响应状态: {response.status_code}")
-                    print(f"[调试] 上传发布附件响应内容: {response.text}")
-                
-                if response.status_code == 201 or response.status_code == 200:
-                    return response.json()
-                else:
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        if self.debug:
-                            print(f"[调试] 上传发布附件失败，等待 {retry_delay} 秒后重试...")
-                        import time
-                        time.sleep(retry_delay)
-                    else:
+                    print(f"[调试] 分支已被更新，放弃提交")
+                return None
+
+            # 流式文件的内容与分支头无关，只在第一次尝试时上传
+            if stream_shas is None:
+                stream_shas = {}
+                for repo_path, open_stream in self.streams.items():
+                    sha = self._create_blob_stream(repo_path, open_stream)
+                    if sha is None:
                         return None
-                
-            except Exception as e:
-                if self.debug:
-                    print(f"[调试] 上传发布附件错误: {e}")
-                    import traceback
-                    traceback.print_exc()
-                retry_count += 1
-                if retry_count < max_retries:
-                    if self.debug:
-                        print(f"[调试] 上传发布附件失败，等待 {retry_delay} 秒后重试...")
-                    import time
-                    time.sleep(retry_delay)
-                else:
+                    stream_shas[repo_path] = sha
+
+            base_tree = self._get_base_tree(head_sha, cache)
+            if base_tree is None:
+                return None
+
+            # 依赖分支当前内容的文件在每次尝试时基于最新的分支头重新生成
+            files = dict(self.files)
+            for repo_path, generate in self.generated.items():
+                data = generate(head_sha)
+                if data is None:
                     return None
-        
-        return None
\ No newline at end of file
+                files[repo_path] = data
+
+            shas = {repo_path: git_blob_sha(data) for repo_path, data in files.items()}
+            shas.update(stream_shas)
+
+            # 已知存在于远端的blob不再上传
+            pending = [(p, d) for p, d in files.items() if shas[p] not in known_blobs and shas[p] not in uploaded]
+            if not self._upload_blobs(pending):
+                return None
+            uploaded.update(shas[p] for p, _ in pending)
+
+            entries = [{"path": p, "mode": "100644", "type": "blob", "sha": sha} for p, sha in shas.items()]
+            for repo_path in self.deleted_trees:
+                entries.append({"path": repo_path, "mode": "040000", "type": "tree", "sha": None})
+            for repo_path in self.deleted_files:
+                entries.append({"path": repo_path, "mode": "100644", "type": "blob", "sha": None})
+
+            response = self.git_api._git_data_request("post", "trees", {
+                "base_tree": base_tree,
+                "tree": entries
+            })
+            if response is not None and response.status_code == 422 and len(known_blobs) > 0:
+                # 缓存中的blob可能已被GitHub回收，清空缓存后完整重传
+                if self.debug:
+                    print(f"[调试] 创建树失败，blob缓存可能失效，重新上传全部blob")
+                known_blobs = set()
+                cache = {}
+                continue
+            if response is None or response.status_code != 201:
+                return None
+            tree_sha = response.json()['sha']
+
+            response = self.git_api._git_data_request("post", "commits", {
+                "message": self.message,
+                "tree": tree_sha,
+                "parents": [head_sha]
+            })
+            if response is None or response.status_code != 201:
+                return None
+            commit_sha = response.json()['sha']
+
+            response = self.git_api._git_data_request("patch", f"refs/heads/{self.branch}", {
+                "sha": commit_sha,
+                "force": False
+            })
+            if response is not None and response.status_code == 200:
+                self._update_cache(cache, shas, commit_sha, tree_sha)
+                if self.debug:
+                    print(f"[调试] 提交成功: {commit_sha}")
+                return commit_sha
+            if response is not None and response.status_code == 422:
+                # 分支在此期间被其他设备更新，基于新的分支头重试
+                if self.debug:
+                    print(f"[调试] 分支已被更新，重新提交 (尝试 {attempt + 1}/{max_retries})")
+                continue
+            return None
+
+        if self.debug:
+            print(f"[调试] 所有 {max_retries} 次尝试都失败了")
+        return None
+
+    def _update_cache(self, cache, shas, commit_sha, tree_sha):
+        for repo_path in self.deleted_trees:
+            prefix = repo_path.rstrip("/") + "/"
+            for path in [p for p in cache if p == repo_path or p.startswith(prefix)]:
+                del cache[path]
+        for repo_path in self.deleted_files:
+            cache.pop(repo_path, None)
+        cache.update(shas)
+        # 只记住最近一次提交的树，供下一次提交省略读取
+        cache["__commit_trees__"] = {commit_sha: tree_sha}
+        try:
+            self.git_api.save_blob_cache(cache)
+        except OSError as e:
+            if self.debug:
+                print(f"[调试] 写入blob缓存失败: {e}")
\ No newline at end of file
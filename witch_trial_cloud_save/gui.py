@@ -2,25 +2,94 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import os
 import tempfile
+import threading
 import webbrowser
+from datetime import datetime
 from config import Config
-from compress import CompressManager
-from github_api import GitAPI
-from monitor import SaveMonitor
+from compress import CompressManager, available_codecs
+from chunk_store import ChunkStore
+from delta import DeltaBase
+from snapshot_cache import SnapshotCache
+from restore_stage import recover_restore
+from file_index import FileIndex, scan_changed
+from catalog import make_entry, format_entry
 from notification import Notifier
+from jobs import Job, JobQueue
+import startup
+import tracing
+from stall_detector import StallDetector
+
+class BaseResolver:
+    def __init__(self, git_api, base_dir, local, cache):
+        """读取增量备份的基准内容：依次查找本机增量基准、快照缓存，最后下载基准备份
+
+        用类而不是闭包实现：沿增量链递归读取时传入的是自身，闭包引用自身会形成
+        引用环，持有的快照缓存要等到垃圾回收（可能在其他线程中）才释放。
+        """
+        self.git_api = git_api
+        self.base_dir = base_dir
+        self.local = local
+        self.cache = cache
+        self.downloaded = {}
+    
+    def __call__(self, base_name, rel_path, base_sha256):
+        data = self.local.load_object(base_sha256)
+        if data is None:
+            data = self.cache.load_object(base_sha256)
+        if data is not None:
+            return data
+        if base_name not in self.downloaded:
+            path = os.path.join(self.base_dir, f"base_{base_name}.zip")
+            if not self.git_api.download_backup(base_name, path):
+                return None
+            self.downloaded[base_name] = path
+        # 基准备份本身也可能是增量备份，继续沿增量链读取
+        return CompressManager.read_backup_file(self.downloaded[base_name], rel_path, self)
 
 class App:
     def __init__(self, root):
         self.root = root
         self.config = Config()
+        Notifier.enabled = self.config.get("notifications_enabled")
+        tracing.configure(self.config.get("trace_enabled"))
         self.monitor = None
+        self.backup_names = []
+        # 初始化最后上传时间
+        self.last_upload_time = 0
+        # 尚未上传的变化路径，None表示需要完整扫描
+        self.pending_changes = set()
+        self.pending_lock = threading.Lock()
+        # 上传间隔内被推迟的自动备份
+        self.upload_retry = None
+        # 设置中开启性能分析后，只有下一次上传或恢复被记录
+        self.profile_claimed = False
+        self.profile_lock = threading.Lock()
+        
+        # 网络和压缩任务在后台线程中执行，界面保持响应
+        self.jobs = JobQueue(root, debug=self.config.get("debug_mode"))
         
         # 初始化GUI
         self.setup_gui()
         
+        # 记录主线程被阻塞导致的界面卡顿，窗口显示后开始检测
+        self.stall_detector = StallDetector(root, debug=self.config.get("debug_mode"))
+        
+        # 窗口显示后再启动监控、拉取备份列表和执行自动操作
+        self.root.after(0, self.after_first_paint)
+    
+    def after_first_paint(self):
+        """窗口第一次绘制后执行的启动任务"""
+        self.root.update_idletasks()
+        startup.mark("first_paint")
+        startup.report(debug=self.config.get("debug_mode"))
+        self.stall_detector.start()
+        
         # 初始化监控
         self.init_monitor()
         
+        # 拉取备份列表
+        self.refresh_backup_list()
+        
         # 根据设置执行自动操作
         self.auto_action()
     
@@ -134,8 +203,8 @@ class App:
         )
         self.delete_all_btn.pack(side=tk.LEFT, padx=5, expand=True)
         
-        # 刷新备份列表
-        self.refresh_backup_list()
+        # 备份列表在窗口显示后拉取
+        self.backup_list.insert(tk.END, "正在拉取存档目录...")
     
     def open_save_dir(self):
         """打开存档目录"""
@@ -157,11 +226,19 @@ class App:
     
     def init_monitor(self):
         """初始化监控器"""
+        # watchdog 导入较慢，窗口显示后才导入
+        from monitor import SaveMonitor
+        
         save_dir = self.config.get("save_dir")
-        self.monitor = SaveMonitor(save_dir, self.auto_backup)
+        # 上次恢复中途退出时，先把存档目录还原为完整的状态再开始监控
+        recover_restore(save_dir, debug=self.config.get("debug_mode"))
+        self.monitor = SaveMonitor(
+            save_dir,
+            self.auto_backup,
+            quiet_seconds=self.config.get("quiet_seconds"),
+            ignore=self.config.get("ignore_patterns")
+        )
         self.monitor.start()
-        # 初始化最后上传时间
-        self.last_upload_time = 0
     
     def auto_action(self):
         """根据设置执行自动操作"""
@@ -171,199 +248,409 @@ class App:
         elif auto_action == "push":
             self.manual_upload()
     
-    def refresh_backup_list(self):
-        """刷新备份列表"""
-        # 清空列表
-        self.backup_list.delete(0, tk.END)
-        
-        # 获取GitHub配置
+    def get_git_api(self):
+        """根据设置创建GitHub API客户端，未配置时返回None"""
         owner = self.config.get("github_owner")
         repo = self.config.get("github_repo")
         token = self.config.get("github_token")
         
-        debug_mode = self.config.get("debug_mode")
-        
         if not all([owner, repo, token]):
-            self.backup_list.insert(tk.END, "请先在设置中配置GitHub信息")
+            return None
+        # requests 导入较慢，第一次访问网络时才导入
+        from github_api import GitAPI
+        return GitAPI(owner, repo, token, debug=self.config.get("debug_mode"))
+    
+    def snapshot_cache(self):
+        """本机快照缓存，在后台线程中创建和使用"""
+        return SnapshotCache(
+            max_bytes=self.config.get("snapshot_cache_mb") * 1024 * 1024,
+            debug=self.config.get("debug_mode")
+        )
+    
+    def refresh_backup_list(self):
+        """刷新备份列表"""
+        git_api = self.get_git_api()
+        if git_api is None:
+            self.show_backup_list(None)
             return
         
-        # 获取备份列表
-        git_api = GitAPI(owner, repo, token, debug=debug_mode)
-        backups = git_api.list_backups()
+        self.backup_names = []
+        self.backup_list.delete(0, tk.END)
+        self.backup_list.insert(tk.END, "正在拉取存档目录...")
         
-        if not backups:
+        # 获取备份列表（一次请求读取备份目录文件）
+        self.jobs.submit(Job(
+            Job.LIST,
+            lambda job: git_api.list_backup_entries(),
+            on_done=lambda entries: self.show_backup_list(entries, failed=entries is None),
+            on_error=lambda e: self.show_backup_list(None, failed=True)
+        ))
+    
+    def show_backup_list(self, entries, failed=False):
+        """在列表框中显示备份记录，entries 为None表示未配置GitHub，failed 表示读取失败"""
+        # 清空列表
+        self.backup_list.delete(0, tk.END)
+        self.backup_names = []
+        
+        if failed:
+            self.backup_list.insert(tk.END, "读取云端备份列表失败，请稍后刷新")
+        elif entries is None:
+            self.backup_list.insert(tk.END, "请先在设置中配置GitHub信息")
+        elif not entries:
             self.backup_list.insert(tk.END, "暂无备份")
         else:
-            for backup in backups:
-                self.backup_list.insert(tk.END, backup)
+            for entry in entries:
+                self.backup_names.append(entry["name"])
+                self.backup_list.insert(tk.END, format_entry(entry))
     
-    def manual_upload(self, is_auto=False):
-        """手动上传存档"""
+    def manual_upload(self, is_auto=False, changed=None):
+        """手动上传存档，自动备份时由文件监控线程调用，此时不能访问Tk控件
+
+        changed 为监控到的变化路径，为None时（如手动上传）完整扫描存档目录。
+        """
         import time
         
+        # 先记下变化的路径，本次被跳过时由下一次上传处理
+        self.add_pending_changes(changed)
+        
         # 检查10秒内是否已经上传过
         current_time = time.time()
         if current_time - self.last_upload_time < 10:
             # 10秒内已经上传过，不执行操作
-            remaining_time = int(10 - (current_time - self.last_upload_time))
+            remaining_time = 10 - (current_time - self.last_upload_time)
             if not is_auto:
-                messagebox.showinfo("提示", f"请稍后再试，{remaining_time}秒后可再次上传")
-            elif self.config.get("debug_mode"):
-                print(f"[调试] 10秒内已上传，跳过自动备份")
+                messagebox.showinfo("提示", f"请稍后再试，{int(remaining_time)}秒后可再次上传")
+            else:
+                # 自动备份不能丢弃，否则存档的最后一次写入要等下一次存档才会上传
+                self.schedule_upload_retry(remaining_time)
             return
         
+        git_api = self.get_git_api()
+        if git_api is None:
+            if not is_auto:
+                messagebox.showerror("错误", "请先在设置中配置GitHub信息")
+            return
+        
+        self.jobs.submit(self.profiled("upload", Job(
+            Job.UPLOAD,
+            lambda job: self.upload_job(job, git_api),
+            on_done=lambda result: self.upload_done(result, is_auto),
+            on_error=lambda e: self.upload_failed(e, is_auto)
+        )))
+    
+    def schedule_upload_retry(self, delay):
+        """上传间隔结束后再执行一次自动备份，变化的路径已经记录在待上传中"""
+        with self.pending_lock:
+            if self.upload_retry is not None:
+                return
+            # 可能在文件监控线程中调用，不能使用 root.after()
+            self.upload_retry = threading.Timer(delay, self.retry_upload)
+            self.upload_retry.daemon = True
+            self.upload_retry.start()
+        if self.config.get("debug_mode"):
+            print(f"[调试] 10秒内已上传，{delay:.1f}秒后再自动备份")
+    
+    def retry_upload(self):
+        with self.pending_lock:
+            self.upload_retry = None
+        self.manual_upload(is_auto=True, changed=set())
+    
+    def add_pending_changes(self, changed):
+        with self.pending_lock:
+            if changed is None or self.pending_changes is None:
+                self.pending_changes = None
+            else:
+                self.pending_changes.update(changed)
+    
+    def take_pending_changes(self):
+        with self.pending_lock:
+            changed = self.pending_changes
+            self.pending_changes = set()
+        return changed
+    
+    def upload_job(self, job, git_api):
+        """在后台线程中打包并上传存档，返回 "unchanged"、True 或 False"""
+        changed = self.take_pending_changes()
+        success = False
         try:
-            # 获取GitHub配置
-            owner = self.config.get("github_owner")
-            repo = self.config.get("github_repo")
-            token = self.config.get("github_token")
+            # 数据库连接只能在创建它的线程中关闭，用完立即关闭，不留给垃圾回收
+            with tracing.span("backup", mode=self.config.get("backup_mode")) as sp, FileIndex() as file_index:
+                success = self.upload_changes(job, git_api, changed, file_index)
+                sp.set(result=str(success))
+        finally:
+            if not success:
+                # 上传失败，这些变化留给下一次上传
+                self.add_pending_changes(changed)
+        return success
+    
+    def upload_changes(self, job, git_api, changed, file_index):
+        import time
+        
+        started = time.time()
+        save_dir = self.config.get("save_dir")
+        debug_mode = self.config.get("debug_mode")
+        
+        # 文件索引记录上次成功上传时的文件状态，只处理变化的文件
+        previous = file_index.load(save_dir)
+        
+        # 监控记录了变化的路径时，只对这些文件调用stat，其余沿用索引
+        with tracing.span("scan", changed=None if changed is None else len(changed)) as sp:
+            files_info = scan_changed(save_dir, previous, changed, ignore=self.config.get("ignore_patterns"))
+            sp.set(files=len(files_info))
+        if debug_mode:
+            print(f"[调试] 变化的路径: {'未知，完整扫描' if changed is None else len(changed)}")
+        
+        if self.config.get("backup_mode") == "zip":
+            # 压缩包总是包含全部文件，哈希在打包读取文件时计算，不预先读取一遍
+            if previous and FileIndex.stats_unchanged(previous, files_info):
+                return "unchanged"
+            if job.cancelled:
+                return False
             
-            save_dir = self.config.get("save_dir")
-            debug_mode = self.config.get("debug_mode")
+            # 压缩包边生成边上传，不写临时文件
+            backup_name = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            # 开启增量时，变化不大的文件只上传相对本机上一次备份的增量
+            base = DeltaBase(save_dir) if self.config.get("zip_delta") else None
+            if base is not None and base.name:
+                catalog = git_api.load_catalog()
+                if catalog is None:
+                    # 无法确认基准备份是否还在，本次写入完整文件，保留原来的基准
+                    base = None
+                elif base.name not in {entry.get("name") for entry in catalog["backups"]}:
+                    # 基准备份已被其他设备删除，写入完整文件作为新的基准
+                    if debug_mode:
+                        print(f"[调试] 增量基准 {base.name} 已不存在，写入完整文件")
+                    base.reset()
+            # 扫描后被删除的文件不在压缩包中，不能记录到索引和备份目录
+            written = []
             
-            if not all([owner, repo, token]):
-                if not is_auto:
-                    messagebox.showerror("错误", "请先在设置中配置GitHub信息")
-                return
+            def open_backup():
+                # 上传重试时重新生成压缩包
+                del written[:]
+                return tracing.traced_iter("compress", CompressManager.iter_backup(
+                    save_dir,
+                    paths=list(files_info),
+                    codec=self.config.get("compression"),
+                    workers=self.config.get("compress_workers"),
+                    base=base,
+                    debug=debug_mode,
+                    written=written
+                ), files=len(files_info))
             
-            # 创建备份
-            temp_dir = tempfile.gettempdir()
-            zip_path = CompressManager.create_backup(save_dir, temp_dir, debug=debug_mode)
+            def backup_entry():
+                # 压缩包上传完成后才知道实际写入的文件和它们的哈希
+                catalog_entry = make_entry(backup_name, written, started, "zip")
+                if base is not None and base.name:
+                    # 记录依赖的基准备份，删除基准备份前需要检查
+                    catalog_entry["delta_base"] = base.name
+                return catalog_entry
             
-            # 上传到GitHub
-            git_api = GitAPI(owner, repo, token, debug=debug_mode)
-            success = git_api.upload_file(
-                zip_path,
-                f"自动备份: {zip_path.parent.name}"
+            success = git_api.upload_stream(
+                f"{backup_name}/backup_{backup_name}.zip",
+                open_backup,
+                f"自动备份: {backup_name}",
+                catalog_entry=backup_entry
             )
-            
             if success:
-                # 更新最后上传时间
-                self.last_upload_time = time.time()
-                Notifier.backup_success()
-                self.refresh_backup_list()
-                if not is_auto:
-                    messagebox.showinfo("成功", "存档已成功上传到云端")
-            else:
-                Notifier.error("上传失败")
-                if not is_auto:
-                    messagebox.showerror("错误", "存档上传失败")
-                    
-        except Exception as e:
-            Notifier.error(f"上传失败: {str(e)}")
+                skipped = set(files_info) - {entry["path"] for entry in written}
+                if skipped:
+                    if debug_mode:
+                        print(f"[调试] {len(skipped)} 个文件在打包前被删除，留给下一次上传")
+                    self.add_pending_changes(skipped)
+                entries = list(written)
+                if base is not None:
+                    base.commit(backup_name)
+        else:
+            with tracing.span("chunk", files=len(files_info)) as sp:
+                manifest, chunks = ChunkStore.build_snapshot(save_dir, previous=previous, files_info=files_info, debug=debug_mode)
+                sp.set(chunks=len(chunks))
+            entries = manifest["files"]
+            if previous and FileIndex.same_content(previous, entries):
+                return "unchanged"
+            if job.cancelled:
+                return False
+            
+            # 分块快照：只上传变化文件中远端缺失的数据块和一个清单
+            snapshot_name = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            store = ChunkStore(git_api, debug=debug_mode)
+            stats = store.upload_snapshot(
+                save_dir,
+                manifest,
+                chunks,
+                snapshot_name,
+                f"自动备份: {snapshot_name}",
+                catalog_entry=make_entry(snapshot_name, entries, started, "chunked")
+            )
+            success = stats is not None
+            backup_name = snapshot_name
+        
+        if success:
+            file_index.record(save_dir, entries)
+            # 刚上传的内容放入本机缓存，回滚到这个备份时不需要下载
+            with tracing.span("copy", files=len(entries), bytes=sum(entry["size"] for entry in entries)):
+                with self.snapshot_cache() as cache:
+                    cache.put(backup_name, save_dir, entries)
+            # 更新最后上传时间
+            self.last_upload_time = time.time()
+            Notifier.backup_success()
+        else:
+            Notifier.error("上传失败")
+        return success
+    
+    def upload_done(self, result, is_auto):
+        if result == "unchanged":
+            self.skip_unchanged_upload(is_auto)
+        elif result:
+            self.refresh_backup_list()
             if not is_auto:
-                messagebox.showerror("错误", f"上传失败: {str(e)}")
+                messagebox.showinfo("成功", "存档已成功上传到云端")
+        elif not is_auto:
+            messagebox.showerror("错误", "存档上传失败")
+    
+    def upload_failed(self, e, is_auto):
+        Notifier.error(f"上传失败: {str(e)}")
+        if not is_auto:
+            messagebox.showerror("错误", f"上传失败: {str(e)}")
+    
+    def skip_unchanged_upload(self, is_auto):
+        """存档自上次上传后没有变化，跳过上传"""
+        if not is_auto:
+            messagebox.showinfo("提示", "存档自上次上传后没有变化，无需上传")
+        elif self.config.get("debug_mode"):
+            print(f"[调试] 存档没有变化，跳过自动备份")
     
     def sync_latest(self):
         """同步最新存档"""
-        try:
-            # 获取GitHub配置
-            owner = self.config.get("github_owner")
-            repo = self.config.get("github_repo")
-            token = self.config.get("github_token")
-            
-            save_dir = self.config.get("save_dir")
-            debug_mode = self.config.get("debug_mode")
-            
-            if not all([owner, repo, token]):
-                messagebox.showerror("错误", "请先在设置中配置GitHub信息")
-                return
+        git_api = self.get_git_api()
+        if git_api is None:
+            messagebox.showerror("错误", "请先在设置中配置GitHub信息")
+            return
         
+        def work(job):
             # 获取最新备份
-            git_api = GitAPI(owner, repo, token, debug=debug_mode)
-            backups = git_api.list_backups()
-            
-            if not backups:
+            entries = git_api.list_backup_entries()
+            if entries is None:
+                return "list_failed"
+            if not entries:
+                return None
+            # 下载并恢复最新备份
+            return self.restore_job(job, git_api, entries[0]["name"], "latest_backup.zip")
+        
+        def done(success):
+            if success == "list_failed":
+                messagebox.showerror("错误", "读取云端备份列表失败")
+            elif success is None:
                 messagebox.showinfo("提示", "云端暂无备份")
-                return
-            
-            # 下载最新备份
-            latest_backup = backups[0]
-            temp_dir = tempfile.gettempdir()
-            zip_path = os.path.join(temp_dir, f"latest_backup.zip")
-            
-            success = git_api.download_backup(latest_backup, zip_path)
-            if not success:
-                Notifier.error("下载失败")
+            elif success:
+                messagebox.showinfo("成功", "存档已成功同步")
+            else:
                 messagebox.showerror("错误", "备份下载失败")
-                return
-            
-            # 暂停监控，防止恢复后立即上传
-            if self.monitor:
-                self.monitor.pause()
-            
-            # 恢复备份
-            CompressManager.delete_old_save(save_dir, debug=debug_mode)
-            CompressManager.restore_backup(zip_path, save_dir, debug=debug_mode)
-            
-            Notifier.restore_success()
-            messagebox.showinfo("成功", "存档已成功同步")
-
-        except Exception as e:
-            Notifier.error(f"同步失败: {str(e)}")
-            messagebox.showerror("错误", f"同步失败: {str(e)}")
-        finally:
-            # 无论成功失败，都恢复监控
-            if self.monitor:
-                self.monitor.resume()
-                if self.config.get("debug_mode"):
-                    print(f"[调试] 监控已恢复")
+        
+        self.jobs.submit(self.profiled("sync", Job(
+            Job.PULL,
+            work,
+            on_done=done,
+            on_error=lambda e: self.restore_failed(e, "同步失败")
+        )))
     
     def restore_selected(self):
         """恢复选中的备份"""
-        try:
-            # 获取选中的备份
-            selection = self.backup_list.curselection()
-            if not selection:
-                messagebox.showwarning("提示", "请先选择一个备份")
-                return
-            
-            selected_backup = self.backup_list.get(selection[0])
-            
-            # 确认恢复
-            if not messagebox.askyesno(
-                "确认恢复",
-                f"确定要恢复备份 {selected_backup} 吗？这将覆盖当前存档。"
-            ):
-                return
-            
-            # 获取GitHub配置
-            owner = self.config.get("github_owner")
-            repo = self.config.get("github_repo")
-            token = self.config.get("github_token")
-            
-            save_dir = self.config.get("save_dir")
-            debug_mode = self.config.get("debug_mode")
-            
-            if not all([owner, repo, token]):
-                messagebox.showerror("错误", "请先在设置中配置GitHub信息")
-                return
-            
-            # 下载备份
-            git_api = GitAPI(owner, repo, token, debug=debug_mode)
-            temp_dir = tempfile.gettempdir()
-            zip_path = os.path.join(temp_dir, f"restore_backup.zip")
-            
-            success = git_api.download_backup(selected_backup, zip_path)
-            if not success:
-                Notifier.error("下载失败")
+        # 获取选中的备份
+        selection = self.backup_list.curselection()
+        if not selection:
+            messagebox.showwarning("提示", "请先选择一个备份")
+            return
+        
+        if selection[0] >= len(self.backup_names):
+            return
+        selected_backup = self.backup_names[selection[0]]
+        
+        # 确认恢复
+        if not messagebox.askyesno(
+            "确认恢复",
+            f"确定要恢复备份 {selected_backup} 吗？这将覆盖当前存档。"
+        ):
+            return
+        
+        git_api = self.get_git_api()
+        if git_api is None:
+            messagebox.showerror("错误", "请先在设置中配置GitHub信息")
+            return
+        
+        def done(success):
+            if success:
+                messagebox.showinfo("成功", f"备份 {selected_backup} 已成功恢复")
+            else:
                 messagebox.showerror("错误", "备份下载失败")
-                return
-            
-            # 暂停监控，防止恢复后立即上传
-            if self.monitor:
-                self.monitor.pause()
-            
-            # 恢复备份
-            CompressManager.delete_old_save(save_dir, debug=debug_mode)
-            CompressManager.restore_backup(zip_path, save_dir, debug=debug_mode)
-            
-            Notifier.restore_success()
-            messagebox.showinfo("成功", f"备份 {selected_backup} 已成功恢复")
+        
+        # 下载并恢复备份
+        self.jobs.submit(self.profiled("restore", Job(
+            Job.PULL,
+            lambda job: self.restore_job(job, git_api, selected_backup, "restore_backup.zip"),
+            on_done=done,
+            on_error=lambda e: self.restore_failed(e, "恢复失败"),
+            key=f"{Job.PULL}:{selected_backup}"
+        )))
+    
+    def profiled(self, name, job):
+        """设置中开启了性能分析时，用 cProfile 和 tracemalloc 记录这个任务，只记录一次
 
-        except Exception as e:
-            Notifier.error(f"恢复失败: {str(e)}")
-            messagebox.showerror("错误", f"恢复失败: {str(e)}")
+        可能在文件监控线程中调用。排队中的任务可能与之后提交的任务合并，工作函数和
+        回调被整体替换，所以在任务开始执行时（工作线程中）才决定由哪个任务记录；
+        完成后在Tk主线程中关闭设置并提示结果的保存位置。
+        """
+        if not self.config.get("profile_next_operation"):
+            return job
+        
+        work, on_done, on_error = job.work, job.on_done, job.on_error
+        capture = None
+        
+        def profiled_work(job):
+            nonlocal capture
+            with self.profile_lock:
+                claimed = not self.profile_claimed and self.config.get("profile_next_operation")
+                if claimed:
+                    self.profile_claimed = True
+            if not claimed:
+                return work(job)
+            
+            from profiler import ProfileCapture
+            capture = ProfileCapture(name, debug=self.config.get("debug_mode"))
+            try:
+                with capture:
+                    return work(job)
+            finally:
+                if job.cancelled:
+                    # 被取消的任务不会调用回调，设置保持开启，记录下一次操作
+                    with self.profile_lock:
+                        self.profile_claimed = False
+        
+        def finish(callback, value):
+            if capture is not None:
+                self.config.set("profile_next_operation", False)
+                with self.profile_lock:
+                    self.profile_claimed = False
+                if capture.report_path is not None:
+                    messagebox.showinfo("性能分析", f"性能分析结果已保存到:\n{capture.prof_path}\n{capture.report_path}")
+            if callback:
+                callback(value)
+        
+        job.work = profiled_work
+        job.on_done = lambda result: finish(on_done, result)
+        job.on_error = lambda e: finish(on_error, e)
+        return job
+    
+    def restore_job(self, job, git_api, backup_name, zip_name):
+        """在后台线程中下载并恢复备份"""
+        try:
+            with tracing.span("restore", backup=backup_name) as sp:
+                success = self.download_and_restore(git_api, backup_name, zip_name, job=job)
+                sp.set(result=success)
+            if success:
+                Notifier.restore_success()
+            else:
+                Notifier.error("下载失败")
+            return success
         finally:
             # 无论成功失败，都恢复监控
             if self.monitor:
@@ -371,111 +658,229 @@ class App:
                 if self.config.get("debug_mode"):
                     print(f"[调试] 监控已恢复")
     
+    def restore_failed(self, e, title):
+        Notifier.error(f"{title}: {str(e)}")
+        messagebox.showerror("错误", f"{title}: {str(e)}")
+    
+    def download_and_restore(self, git_api, backup_name, zip_name, job=None):
+        """下载并恢复指定备份，兼容分块快照和旧版zip备份
+
+        下载完成、开始覆盖存档之前检查任务是否已取消。
+        """
+        # 数据库连接只能在创建它的线程中关闭，用完立即关闭，不留给垃圾回收
+        with self.snapshot_cache() as cache, FileIndex() as file_index:
+            return self.restore_with(cache, file_index, git_api, backup_name, zip_name, job)
+    
+    def restore_with(self, cache, file_index, git_api, backup_name, zip_name, job):
+        save_dir = self.config.get("save_dir")
+        debug_mode = self.config.get("debug_mode")
+        
+        # 本机缓存中有这个备份时直接恢复，不访问网络
+        cached = cache.get(backup_name)
+        if cached is not None:
+            if debug_mode:
+                print(f"[调试] 从本机缓存恢复备份: {backup_name}")
+            if job is not None and job.cancelled:
+                return False
+            if self.monitor:
+                self.monitor.pause()
+            cache.restore(cached, save_dir)
+            # 缓存的内容与云端备份一致，记入索引，避免下次备份重复上传
+            file_index.record(save_dir, cached)
+            return True
+        
+        store = ChunkStore(git_api, debug=debug_mode)
+        manifest = store.fetch_manifest(backup_name)
+        
+        if manifest is not None:
+            # 先下载全部数据块，确保删除旧存档前数据完整
+            chunks = store.fetch_chunks(manifest)
+            if chunks is None:
+                return False
+        else:
+            zip_path = os.path.join(tempfile.gettempdir(), zip_name)
+            if not git_api.download_backup(backup_name, zip_path):
+                return False
+            # 增量备份需要沿增量链读取基准备份，全部还原后再删除旧存档
+            with tempfile.TemporaryDirectory() as base_dir:
+                resolve_base = self.make_base_resolver(git_api, base_dir, cache)
+                deltas = CompressManager.load_deltas(zip_path, resolve_base, debug=debug_mode)
+        
+        if job is not None and job.cancelled:
+            return False
+        
+        # 暂停监控，防止恢复后立即上传
+        if self.monitor:
+            self.monitor.pause()
+        
+        # 恢复备份：先在暂存目录中组装，全部成功后才替换存档目录
+        if manifest is not None:
+            ChunkStore.restore_snapshot(manifest, chunks, save_dir, debug=debug_mode)
+            # 恢复的内容已在云端，记入索引，避免下次备份重复上传
+            file_index.record(save_dir, manifest["files"])
+        else:
+            CompressManager.restore_backup(
+                zip_path,
+                save_dir,
+                deltas=deltas,
+                workers=self.config.get("compress_workers"),
+                debug=debug_mode
+            )
+            file_index.clear(save_dir)
+        
+        # 下载的备份放入本机缓存，再次恢复时不需要下载
+        with tracing.span("copy"):
+            cache.put(backup_name, save_dir, manifest["files"] if manifest is not None else None)
+        return True
+    
+    def make_base_resolver(self, git_api, base_dir, cache):
+        """返回读取基准备份中文件内容的函数，优先使用本机保存的增量基准和快照缓存"""
+        return BaseResolver(git_api, base_dir, DeltaBase(self.config.get("save_dir")), cache)
+    
     def delete_selected(self):
         """删除选中的备份"""
-        try:
-            # 获取选中的备份
-            selection = self.backup_list.curselection()
-            if not selection:
-                messagebox.showwarning("提示", "请先选择一个备份")
-                return
-            
-            selected_backup = self.backup_list.get(selection[0])
-            
-            # 确认删除
-            if not messagebox.askyesno(
-                "确认删除",
-                f"确定要删除备份 {selected_backup} 吗？此操作不可恢复。"
-            ):
-                return
-            
-            # 获取GitHub配置
-            owner = self.config.get("github_owner")
-            repo = self.config.get("github_repo")
-            token = self.config.get("github_token")
-            
-            debug_mode = self.config.get("debug_mode")
-            
-            if not all([owner, repo, token]):
-                messagebox.showerror("错误", "请先在设置中配置GitHub信息")
-                return
+        # 获取选中的备份
+        selection = self.backup_list.curselection()
+        if not selection:
+            messagebox.showwarning("提示", "请先选择一个备份")
+            return
+        
+        if selection[0] >= len(self.backup_names):
+            return
+        selected_backup = self.backup_names[selection[0]]
+        
+        # 确认删除
+        if not messagebox.askyesno(
+            "确认删除",
+            f"确定要删除备份 {selected_backup} 吗？此操作不可恢复。"
+        ):
+            return
+        
+        git_api = self.get_git_api()
+        if git_api is None:
+            messagebox.showerror("错误", "请先在设置中配置GitHub信息")
+            return
+        
+        def work(job):
+            # 其他增量备份以该备份为基准时不能删除
+            entries = git_api.list_backup_entries()
+            if entries is None:
+                return False
+            dependents = [entry["name"] for entry in entries if entry.get("delta_base") == selected_backup]
+            if dependents:
+                return dependents
             
             # 删除备份
-            git_api = GitAPI(owner, repo, token, debug=debug_mode)
             success = git_api.delete_backup(selected_backup)
-            
             if success:
+                # 清理只被这个快照引用的数据块，失败时留到下一次删除备份时清理
+                removed = ChunkStore(git_api, debug=self.config.get("debug_mode")).collect_garbage()
+                if self.config.get("debug_mode"):
+                    print(f"[调试] 清理数据块: {'失败' if removed is None else removed}")
+                base = DeltaBase(self.config.get("save_dir"))
+                if base.name == selected_backup:
+                    # 本机的增量基准已被删除，下一次备份写入完整文件
+                    base.reset()
+                with self.snapshot_cache() as cache:
+                    cache.discard(selected_backup)
                 Notifier.show_notification("成功", f"备份 {selected_backup} 已删除")
+            else:
+                Notifier.error("删除失败")
+            return success
+        
+        def done(success):
+            if isinstance(success, list):
+                messagebox.showerror("错误", f"备份 {', '.join(success)} 以备份 {selected_backup} 为增量基准，请先删除这些备份")
+            elif success:
                 self.refresh_backup_list()
                 messagebox.showinfo("成功", f"备份 {selected_backup} 已成功删除")
             else:
-                Notifier.error("删除失败")
                 messagebox.showerror("错误", f"删除备份 {selected_backup} 失败")
-                
-        except Exception as e:
-            Notifier.error(f"删除失败: {str(e)}")
-            messagebox.showerror("错误", f"删除备份失败: {e}")
+        
+        self.jobs.submit(Job(
+            Job.DELETE,
+            work,
+            on_done=done,
+            on_error=lambda e: self.delete_failed(e, "删除备份失败"),
+            key=f"{Job.DELETE}:{selected_backup}"
+        ))
     
     def delete_all_backups(self):
         """删除所有备份"""
-        try:
-            # 获取GitHub配置
-            owner = self.config.get("github_owner")
-            repo = self.config.get("github_repo")
-            token = self.config.get("github_token")
-            
-            if not all([owner, repo, token]):
-                messagebox.showerror("错误", "请先在设置中配置GitHub信息")
-                return
-            
-            # 获取当前备份列表
-            git_api = GitAPI(owner, repo, token)
-            backups = git_api.list_backups()
-            
-            if not backups:
-                messagebox.showinfo("提示", "当前没有备份")
-                return
-            
-            # 二次确认删除所有备份
-            if not messagebox.askyesno(
-                "确认删除所有备份",
-                f"确定要删除所有 {len(backups)} 个备份吗？此操作不可恢复！"
-            ):
-                return
-            
-            # 再次确认，防止误操作
-            if not messagebox.askyesno(
-                "再次确认",
-                "您确定要删除所有备份吗？此操作将永久删除所有备份数据，无法恢复！"
-            ):
-                return
-            
+        git_api = self.get_git_api()
+        if git_api is None:
+            messagebox.showerror("错误", "请先在设置中配置GitHub信息")
+            return
+        
+        # 先在后台获取当前备份列表，再确认删除
+        self.jobs.submit(Job(
+            Job.LIST,
+            lambda job: git_api.list_backups(),
+            on_done=lambda backups: self.confirm_delete_all(git_api, backups),
+            on_error=lambda e: self.delete_failed(e, "删除所有备份失败"),
+            key=f"{Job.LIST}:delete_all"
+        ))
+    
+    def confirm_delete_all(self, git_api, backups):
+        if backups is None:
+            messagebox.showerror("错误", "读取云端备份列表失败，无法删除")
+            return
+        if not backups:
+            messagebox.showinfo("提示", "当前没有备份")
+            return
+        
+        # 二次确认删除所有备份
+        if not messagebox.askyesno(
+            "确认删除所有备份",
+            f"确定要删除所有 {len(backups)} 个备份吗？此操作不可恢复！"
+        ):
+            return
+        
+        # 再次确认，防止误操作
+        if not messagebox.askyesno(
+            "再次确认",
+            "您确定要删除所有备份吗？此操作将永久删除所有备份数据，无法恢复！"
+        ):
+            return
+        
+        def work(job):
             # 删除所有备份
-            debug_mode = self.config.get("debug_mode")
-            git_api = GitAPI(owner, repo, token, debug=debug_mode)
             success = git_api.delete_all_backups()
-            
             if success:
+                # 云端已清空，下次备份需要完整上传
+                with FileIndex() as file_index:
+                    file_index.clear()
+                DeltaBase(self.config.get("save_dir")).reset()
+                with self.snapshot_cache() as cache:
+                    cache.clear()
                 Notifier.show_notification("成功", "所有备份已删除")
+            else:
+                Notifier.error("删除失败")
+            return success
+        
+        def done(success):
+            if success:
                 self.refresh_backup_list()
                 messagebox.showinfo("成功", "所有备份已成功删除")
             else:
-                Notifier.error("删除失败")
                 messagebox.showerror("错误", "删除所有备份失败")
-                
-        except Exception as e:
-            Notifier.error(f"删除失败: {str(e)}")
-            messagebox.showerror("错误", f"删除所有备份失败: {e}")
-    
-    def auto_backup(self):
-        """自动备份（监控到变化时调用）"""
-        import time
         
-        # 添加延迟，确保文件操作完成
-        time.sleep(1)
-        
-        # 执行上传，标记为自动上传
-        self.manual_upload(is_auto=True)
+        self.jobs.submit(Job(
+            Job.DELETE,
+            work,
+            on_done=done,
+            on_error=lambda e: self.delete_failed(e, "删除所有备份失败"),
+            key=f"{Job.DELETE}:*"
+        ))
+    
+    def delete_failed(self, e, title):
+        Notifier.error(f"删除失败: {str(e)}")
+        messagebox.showerror("错误", f"{title}: {e}")
+    
+    def auto_backup(self, changed=None):
+        """自动备份（存档写入完成后在监控线程中调用）"""
+        # 提交上传任务，标记为自动上传
+        self.manual_upload(is_auto=True, changed=changed)
     
     def open_settings(self):
         """打开设置页面"""
@@ -485,6 +890,13 @@ class App:
         """关闭窗口时的清理操作"""
         if self.monitor:
             self.monitor.stop()
+        with self.pending_lock:
+            if self.upload_retry is not None:
+                self.upload_retry.cancel()
+                self.upload_retry = None
+        self.jobs.stop()
+        self.stall_detector.stop()
+        self.config.close()
         self.root.destroy()
 
 class SettingsWindow:
@@ -496,7 +908,7 @@ class SettingsWindow:
         # 创建设置窗口
         self.window = tk.Toplevel(parent)
         self.window.title("设置")
-        self.window.geometry("700x400")
+        self.window.geometry("700x620")
         self.window.resizable(True, True)
         self.window.transient(parent)
         self.window.grab_set()
@@ -565,6 +977,45 @@ class SettingsWindow:
             value="push"
         ).pack(anchor=tk.W)
         
+        # 备份格式
+        ttk.Label(left_frame, text="备份格式:").pack(anchor=tk.W, pady=5)
+        self.backup_mode_var = tk.StringVar(value=self.config.get("backup_mode"))
+        backup_mode_frame = ttk.Frame(left_frame)
+        backup_mode_frame.pack(anchor=tk.W, pady=5)
+        
+        ttk.Radiobutton(
+            backup_mode_frame,
+            text="分块去重（只上传变化部分）",
+            variable=self.backup_mode_var,
+            value="chunked"
+        ).pack(anchor=tk.W)
+        ttk.Radiobutton(
+            backup_mode_frame,
+            text="完整压缩包",
+            variable=self.backup_mode_var,
+            value="zip"
+        ).pack(anchor=tk.W)
+        
+        # 压缩包的压缩方式
+        compression_frame = ttk.Frame(left_frame)
+        compression_frame.pack(anchor=tk.W, pady=5)
+        ttk.Label(compression_frame, text="压缩方式:").pack(side=tk.LEFT)
+        self.compression_var = tk.StringVar(value=self.config.get("compression"))
+        ttk.Combobox(
+            compression_frame,
+            textvariable=self.compression_var,
+            values=["auto"] + available_codecs(),
+            state="readonly",
+            width=12
+        ).pack(side=tk.LEFT, padx=5)
+        
+        self.zip_delta_var = tk.BooleanVar(value=self.config.get("zip_delta"))
+        ttk.Checkbutton(
+            left_frame,
+            text="增量压缩包（只上传相对上次备份变化的字节）",
+            variable=self.zip_delta_var
+        ).pack(anchor=tk.W, pady=5)
+        
         # 调试模式
         ttk.Label(left_frame, text="调试模式:").pack(anchor=tk.W, pady=5)
         self.debug_mode_var = tk.BooleanVar(value=self.config.get("debug_mode"))
@@ -575,6 +1026,22 @@ class SettingsWindow:
         )
         debug_mode_check.pack(anchor=tk.W, pady=5)
         
+        # 耗时追踪
+        self.trace_enabled_var = tk.BooleanVar(value=self.config.get("trace_enabled"))
+        ttk.Checkbutton(
+            left_frame,
+            text="记录各阶段耗时（写入 trace.jsonl）",
+            variable=self.trace_enabled_var
+        ).pack(anchor=tk.W)
+        
+        # 性能分析
+        self.profile_next_var = tk.BooleanVar(value=self.config.get("profile_next_operation"))
+        ttk.Checkbutton(
+            left_frame,
+            text="记录下一次上传或恢复的性能分析（cProfile）",
+            variable=self.profile_next_var
+        ).pack(anchor=tk.W)
+        
         # GitHub链接
         github_frame = ttk.Frame(left_frame)
         github_frame.pack(anchor=tk.W, pady=10)
@@ -665,13 +1132,20 @@ class SettingsWindow:
     
     def save_settings(self):
         """保存设置"""
-        # 保存配置
-        self.config.set("save_dir", self.save_dir_var.get())
-        self.config.set("github_owner", self.github_owner_var.get())
-        self.config.set("github_repo", self.github_repo_var.get())
-        self.config.set("github_token", self.github_token_var.get())
-        self.config.set("auto_action", self.auto_action_var.get())
-        self.config.set("debug_mode", self.debug_mode_var.get())
+        # 保存配置：所有修改在一个事务中写入，只写入有变化的配置项
+        with self.config.batch():
+            self.config.set("save_dir", self.save_dir_var.get())
+            self.config.set("github_owner", self.github_owner_var.get())
+            self.config.set("github_repo", self.github_repo_var.get())
+            self.config.set("github_token", self.github_token_var.get())
+            self.config.set("auto_action", self.auto_action_var.get())
+            self.config.set("backup_mode", self.backup_mode_var.get())
+            self.config.set("compression", self.compression_var.get())
+            self.config.set("zip_delta", self.zip_delta_var.get())
+            self.config.set("debug_mode", self.debug_mode_var.get())
+            self.config.set("trace_enabled", self.trace_enabled_var.get())
+            self.config.set("profile_next_operation", self.profile_next_var.get())
+        tracing.configure(self.config.get("trace_enabled"))
         
         # 刷新备份列表
         self.refresh_callback()
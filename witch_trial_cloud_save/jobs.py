@@ -0,0 +1,146 @@
+import queue
+import threading
+import traceback
+
+
+class Job:
+    # 任务类型
+    UPLOAD = "upload"
+    PULL = "pull"
+    LIST = "list"
+    DELETE = "delete"
+
+    def __init__(self, kind, work, on_done=None, on_error=None, key=None):
+        """后台任务
+
+        work(job) 在工作线程中执行，不能访问Tk控件；耗时较长的任务可以在
+        阶段之间检查 job.cancelled，尽早结束。on_done(结果) 和 on_error(异常)
+        在Tk主线程中调用。key 相同的排队任务会被合并，默认与任务类型相同。
+        """
+        self.kind = kind
+        self.work = work
+        self.on_done = on_done
+        self.on_error = on_error
+        self.key = key or kind
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """取消任务：排队中的任务不再执行，执行中的任务结果被丢弃"""
+        self._cancelled.set()
+
+
+class JobQueue:
+    # 主线程检查任务结果的间隔（毫秒）
+    POLL_INTERVAL = 50
+
+    def __init__(self, root, debug=False):
+        """在单个工作线程中按顺序执行网络和压缩任务，结果通过after()交回Tk主线程
+
+        任务串行执行，上传、恢复和删除不会同时修改仓库或存档目录。
+        submit 和 cancel 可以在任意线程调用（例如文件监控线程）。
+        """
+        self.root = root
+        self.debug = debug
+        self._pending = []
+        self._running = None
+        self._lock = threading.Condition()
+        self._results = queue.Queue()
+        self._stopped = False
+
+        self._worker = threading.Thread(target=self._run, name="JobQueue", daemon=True)
+        self._worker.start()
+        self.root.after(self.POLL_INTERVAL, self._poll)
+
+    def submit(self, job):
+        """提交任务，返回实际排队的任务
+
+        已有相同 key 的任务在排队时不再重复排队，而是让排队中的任务改用
+        新提交的工作函数和回调，结果交给最后一次提交的调用方。
+        """
+        with self._lock:
+            if self._stopped:
+                return job
+            for pending in self._pending:
+                if pending.key == job.key and not pending.cancelled:
+                    pending.work = job.work
+                    pending.on_done = job.on_done
+                    pending.on_error = job.on_error
+                    if self.debug:
+                        print(f"[调试] 合并重复任务: {job.key}")
+                    return pending
+            self._pending.append(job)
+            self._lock.notify()
+        if self.debug:
+            print(f"[调试] 提交任务: {job.key}")
+        return job
+
+    def cancel(self, kind=None):
+        """取消指定类型（默认全部）的排队和执行中的任务"""
+        with self._lock:
+            jobs = list(self._pending)
+            if self._running is not None:
+                jobs.append(self._running)
+        for job in jobs:
+            if kind is None or job.kind == kind:
+                job.cancel()
+
+    def is_busy(self, kind=None):
+        """是否有指定类型（默认任意）的任务在排队或执行"""
+        with self._lock:
+            jobs = list(self._pending)
+            if self._running is not None:
+                jobs.append(self._running)
+        return any(not job.cancelled and (kind is None or job.kind == kind) for job in jobs)
+
+    def stop(self):
+        """取消所有任务并停止工作线程，执行中的任务在后台线程中自行结束"""
+        self.cancel()
+        with self._lock:
+            self._stopped = True
+            self._lock.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._stopped:
+                    self._lock.wait()
+                if self._stopped:
+                    return
+                job = self._pending.pop(0)
+                self._running = job
+
+            if not job.cancelled:
+                try:
+                    result = job.work(job)
+                    self._results.put((job, job.on_done, result))
+                except Exception as e:
+                    if self.debug:
+                        print(f"[调试] 任务 {job.key} 出错: {e}")
+                        traceback.print_exc()
+                    self._results.put((job, job.on_error, e))
+
+            with self._lock:
+                self._running = None
+
+    def _poll(self):
+        """在Tk主线程中执行已完成任务的回调"""
+        while True:
+            try:
+                job, callback, value = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if job.cancelled or callback is None:
+                continue
+            try:
+                callback(value)
+            except Exception as e:
+                if self.debug:
+                    print(f"[调试] 任务 {job.key} 回调出错: {e}")
+                    traceback.print_exc()
+
+        if not self._stopped:
+            self.root.after(self.POLL_INTERVAL, self._poll)
@@ -1,4 +1,8 @@
+import startup
 from gui import main
 
+# 导入界面模块的耗时，计入启动预算
+startup.mark("import")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
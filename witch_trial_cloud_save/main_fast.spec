@@ -0,0 +1,51 @@
+# -*- mode: python ; coding: utf-8 -*-
+# 启动优化的打包配置：pyinstaller main_fast.spec
+#
+# 与 main.spec 的单文件打包不同，这里输出为目录（dist/main_fast/），
+# 启动时不需要先把所有依赖解压到临时目录；同时不使用UPX压缩，
+# 避免每次启动解压DLL。程序中未使用的标准库模块不打包。
+# 与 main.spec 一样保留控制台窗口，调试模式的输出（[调试] ...）仍然可见。
+
+
+a = Analysis(
+    ['main.py'],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    hiddenimports=[],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=['unittest', 'doctest', 'test', 'pytest', 'lib2to3', 'setuptools'],
+    noarchive=False,
+    optimize=1,
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='main_fast',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+    icon=['manosaba.ico'],
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='main_fast',
+)
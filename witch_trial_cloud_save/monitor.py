@@ -1,16 +1,27 @@
 import os
 import time
+import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from pathlib import Path
+from file_index import scan_save_dir, is_ignored
+
+# 两次备份之间最多记录的变化路径数，超出后退回到完整扫描
+MAX_CHANGED_PATHS = 1000
 
 class SaveMonitor:
-    def __init__(self, save_dir, callback):
-        """初始化监控器"""
+    def __init__(self, save_dir, callback, quiet_seconds=2.0, ignore=()):
+        """初始化监控器
+
+        存档目录静默 quiet_seconds 秒后调用一次 callback(changed)，changed 为
+        期间变化的相对路径集合，无法确定时为None（需要完整扫描）。
+        匹配 ignore 中模式的临时文件和锁文件不会触发备份。
+        """
         self.save_dir = save_dir
         self.callback = callback
         self.is_running = False
-        # 初始化解码器
-        self.event_handler = SaveEventHandler(callback)
+        # 初始化事件处理器
+        self.event_handler = SaveEventHandler(callback, save_dir=save_dir, quiet_seconds=quiet_seconds, ignore=ignore)
         self.observer = None
     
     def start(self):
@@ -37,18 +48,25 @@ class SaveMonitor:
         # 启动监控
         self.observer.start()
         self.is_running = True
+        # 暂停前记录的变化继续等待静默后触发
+        self.event_handler.resume()
         return True
     
-    def stop(self):
-        """停止监控"""
+    def _stop_observer(self):
         if self.is_running and self.observer:
             self.observer.stop()
             self.observer.join()
             self.is_running = False
     
+    def stop(self):
+        """停止监控（程序退出时调用），丢弃尚未触发的备份"""
+        self._stop_observer()
+        self.event_handler.cancel()
+    
     def pause(self):
-        """暂停监控"""
-        self.stop()
+        """暂停监控（例如恢复存档期间），已记录但尚未触发的变化保留到 resume() 后再备份"""
+        self._stop_observer()
+        self.event_handler.pause()
     
     def resume(self):
         """恢复监控"""
@@ -56,22 +74,31 @@ class SaveMonitor:
             self.start()
     
     def get_current_files(self):
-        """获取当前存档目录的文件列表和修改时间"""
-        files_info = {}
-        for root, dirs, files in os.walk(self.save_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                rel_path = os.path.relpath(file_path, self.save_dir)
-                mtime = os.path.getmtime(file_path)
-                files_info[rel_path] = mtime
-        return files_info
+        """获取当前存档目录的文件列表，返回 {相对路径: (大小, 修改时间纳秒)}"""
+        return scan_save_dir(self.save_dir, ignore=self.event_handler.ignore)
 
 class SaveEventHandler(FileSystemEventHandler):
-    def __init__(self, callback):
-        """初始化事件处理器"""
+    def __init__(self, callback, save_dir=None, quiet_seconds=2.0, max_wait=60.0, ignore=()):
+        """初始化事件处理器
+
+        一次存档通常会连续写入多个文件。事件到来时不立即触发，而是等存档目录
+        静默 quiet_seconds 秒、且文件大小和修改时间不再变化后才触发一次回调，
+        保证最后一次写入也被备份。持续写入时最多等待 max_wait 秒。
+        期间变化的路径去重后传给回调，数量超过 MAX_CHANGED_PATHS 时改为传None。
+        """
         self.callback = callback
-        self.last_event_time = 0
-        self.debounce_delay = 2  # 防抖延迟（秒）
+        self.save_dir = save_dir
+        self.quiet_seconds = quiet_seconds
+        self.max_wait = max_wait
+        self.ignore = tuple(ignore)
+        self._lock = threading.Lock()
+        self._changed = set()
+        self._overflow = False
+        self._timer = None
+        self._last_event_time = 0
+        self._first_event_time = None
+        self._last_state = None
+        self._paused = False
     
     def on_modified(self, event):
         """文件修改事件"""
@@ -85,16 +112,137 @@ class SaveEventHandler(FileSystemEventHandler):
         """文件删除事件"""
         self.handle_event(event)
     
+    def on_moved(self, event):
+        """文件移动事件：原路径被删除，新路径被创建"""
+        self.handle_event(event)
+    
+    def _relative(self, path):
+        """事件路径转换为存档目录下的相对路径，不在存档目录内时返回None"""
+        rel_path = Path(os.path.relpath(path, self.save_dir)).as_posix()
+        if rel_path == "." or rel_path.startswith("../"):
+            return None
+        return rel_path
+    
     def handle_event(self, event):
-        """处理文件系统事件"""
-        current_time = time.time()
+        """处理文件系统事件：记录变化的路径，静默计时器未启动时启动"""
+        if event.is_directory:
+            # 目录的修改事件只是其中文件变化的附带事件；目录被创建、删除或移动时
+            # 其中的文件不一定各自产生事件，只能完整扫描
+            if event.event_type == "modified":
+                return
+            paths = None
+        elif self.save_dir is None:
+            paths = None
+        else:
+            paths = [event.src_path]
+            if getattr(event, "dest_path", None):
+                paths.append(event.dest_path)
+            paths = [p for p in map(self._relative, paths) if p is not None]
+            paths = [p for p in paths if not is_ignored(p, self.ignore)]
+            if not paths:
+                return
         
-        # 防抖处理，避免短时间内多次触发
-        if current_time - self.last_event_time < self.debounce_delay:
-            return
+        with self._lock:
+            if paths is None:
+                self._overflow = True
+            elif not self._overflow:
+                self._changed.update(paths)
+                if len(self._changed) > MAX_CHANGED_PATHS:
+                    self._overflow = True
+            if self._overflow:
+                self._changed.clear()
+            self._last_event_time = time.monotonic()
+            if self._first_event_time is None:
+                self._first_event_time = self._last_event_time
+            if self._timer is None and not self._paused:
+                self._schedule(self.quiet_seconds)
+    
+    def _schedule(self, delay):
+        # 调用方需持有锁
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+    
+    def _on_timer(self):
+        """静默计时到期：仍有新事件则继续等待，文件状态稳定后触发回调"""
+        with self._lock:
+            if self._timer is None:
+                # 已被取消
+                return
+            now = time.monotonic()
+            overdue = now - self._first_event_time >= self.max_wait
+            idle = now - self._last_event_time
+            if idle < self.quiet_seconds and not overdue:
+                self._schedule(self.quiet_seconds - idle)
+                return
+            self._timer = None
+        
+        if self.save_dir is not None and not overdue:
+            # 事件可能滞后于写入，比较两次扫描的大小和修改时间确认写入已完成
+            state = self._scan()
+            if state != self._last_state:
+                self._last_state = state
+                with self._lock:
+                    if self._timer is None and not self._paused:
+                        self._schedule(min(self.quiet_seconds, 1.0))
+                return
         
-        self.last_event_time = current_time
+        with self._lock:
+            if self._timer is not None or self._paused:
+                # 扫描期间又有新的写入，等下一次计时到期再触发；
+                # 扫描期间被暂停时保留变化，恢复监控后再触发
+                return
+            changed = None if self._overflow else self._changed
+            self._reset()
         
         # 调用回调函数
-        if not event.is_directory:
-            self.callback()
\ No newline at end of file
+        self.callback(changed)
+    
+    def _scan(self):
+        """读取变化路径的大小和修改时间，路径未知时扫描整个目录"""
+        with self._lock:
+            changed = None if self._overflow else sorted(self._changed)
+        if changed is None:
+            return scan_save_dir(self.save_dir, ignore=self.ignore)
+        state = {}
+        for rel_path in changed:
+            try:
+                stat = os.stat(os.path.join(self.save_dir, rel_path))
+            except OSError:
+                state[rel_path] = None
+                continue
+            state[rel_path] = (stat.st_size, stat.st_mtime_ns)
+        return state
+    
+    def _reset(self):
+        # 调用方需持有锁
+        self._first_event_time = None
+        self._last_state = None
+        self._changed = set()
+        self._overflow = False
+    
+    def pause(self):
+        """停止计时但保留已记录的变化，resume() 后继续等待静默再触发"""
+        with self._lock:
+            self._paused = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._last_state = None
+    
+    def resume(self):
+        """恢复计时，暂停前记录的变化从现在起重新等待静默"""
+        with self._lock:
+            self._paused = False
+            if self._timer is None and (self._changed or self._overflow):
+                self._last_event_time = time.monotonic()
+                self._first_event_time = self._last_event_time
+                self._schedule(self.quiet_seconds)
+    
+    def cancel(self):
+        """丢弃尚未触发的事件"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._reset()
\ No newline at end of file
@@ -1,137 +1,360 @@
 import time
 import sys
-import os
+import json
+import base64
+import queue
+import threading
 import subprocess
-import tempfile
+import tracing
+
+
+def _run_powershell(script, timeout=10):
+    result = subprocess.run(
+        ["powershell", "-NoProfile", "-Command", script],
+        capture_output=True,
+        text=True,
+        timeout=timeout
+    )
+    if result.returncode != 0:
+        print(f"错误输出: {result.stderr}")
+    return result.returncode == 0
+
+
+def _escape(text):
+    # 对标题和消息进行转义，防止PowerShell脚本出错
+    return text.replace("'", "''")
+
+
+def notify_icon(title, message):
+    """PowerShell NotifyIcon 气泡通知"""
+    return _run_powershell(f"""
+    Add-Type -AssemblyName System.Windows.Forms
+    Add-Type -AssemblyName System.Drawing
+
+    # 创建通知图标对象
+    $notifyIcon = New-Object System.Windows.Forms.NotifyIcon
+    $notifyIcon.Icon = [System.Drawing.SystemIcons]::Information
+    $notifyIcon.Visible = $true
+
+    # 设置通知内容
+    $notifyIcon.BalloonTipIcon = [System.Windows.Forms.ToolTipIcon]::Info
+    $notifyIcon.BalloonTipTitle = '{_escape(title)}'
+    $notifyIcon.BalloonTipText = '{_escape(message)}'
+
+    # 显示通知，短暂延迟后清理资源
+    $notifyIcon.ShowBalloonTip(3000)
+    Start-Sleep -Milliseconds 3500
+    $notifyIcon.Dispose()
+    """)
+
+
+def toast(title, message):
+    """PowerShell Toast 通知"""
+    return _run_powershell(f"""
+    [Windows.UI.Notifications.ToastNotificationManager, Windows.UI.Notifications, ContentType = WindowsRuntime] > $null
+    $Template = [Windows.UI.Notifications.ToastNotificationManager]::GetTemplateContent([Windows.UI.Notifications.ToastTemplateType]::ToastText02)
+
+    # 设置标题和内容
+    $Title = $Template.GetElementsByTagName("text")[0]
+    $Title.InnerText = '{_escape(title)}'
+    $Message = $Template.GetElementsByTagName("text")[1]
+    $Message.InnerText = '{_escape(message)}'
+
+    # 创建并显示通知
+    $Toast = [Windows.UI.Notifications.ToastNotification]::new($Template)
+    $Toast.Tag = 'CloudSaveTool'
+    $Toast.Group = 'CloudSaveTool'
+    [Windows.UI.Notifications.ToastNotificationManager]::CreateToastNotifier('CloudSaveTool').Show($Toast)
+    """)
+
+
+def msg(title, message):
+    """msg 命令（仅管理员可用）"""
+    result = subprocess.run(
+        ["msg", "*", f"{title}: {message}"],
+        capture_output=True,
+        text=True,
+        timeout=5
+    )
+    return result.returncode == 0
+
+
+def rundll32(title, message):
+    """user32.dll 的 MessageBox（最底层的方法）"""
+    subprocess.run(
+        ["rundll32", "user32.dll,MessageBoxA", "0", message, title, "64"],
+        capture_output=True,
+        timeout=10
+    )
+    return True
+
+
+# 常驻的 PowerShell 进程：只创建一次通知图标，之后每行输入显示一条气泡通知，
+# 显示后输出一行 ok 确认，出错时输出 error 和错误信息
+_HELPER_SCRIPT = """
+Add-Type -AssemblyName System.Windows.Forms
+Add-Type -AssemblyName System.Drawing
+$notifyIcon = New-Object System.Windows.Forms.NotifyIcon
+$notifyIcon.Icon = [System.Drawing.SystemIcons]::Information
+$notifyIcon.Visible = $true
+while (($line = [Console]::In.ReadLine()) -ne $null) {
+    try {
+        $item = [Text.Encoding]::UTF8.GetString([Convert]::FromBase64String($line)) | ConvertFrom-Json
+        $notifyIcon.BalloonTipIcon = [System.Windows.Forms.ToolTipIcon]::Info
+        $notifyIcon.BalloonTipTitle = $item.title
+        $notifyIcon.BalloonTipText = $item.message
+        $notifyIcon.ShowBalloonTip(3000)
+        [System.Windows.Forms.Application]::DoEvents()
+        [Console]::Out.WriteLine("ok")
+    } catch {
+        [Console]::Out.WriteLine("error " + $_.Exception.Message)
+    }
+    [Console]::Out.Flush()
+}
+$notifyIcon.Dispose()
+"""
+
+
+class NotifyHelper:
+    # 等待通知进程确认的时间（秒），第一条通知还包括启动 PowerShell 和加载程序集的时间
+    ACK_TIMEOUT = 15
+
+    def __init__(self, command=None, ack_timeout=None):
+        """常驻的通知进程，避免每条通知都启动 PowerShell 并等待气泡消失
+
+        每条通知都等待进程回复确认，进程退出、没有响应或报告出错时返回False。
+        退出或没有响应的进程被结束，下一条通知重新启动。
+        """
+        self.command = command or ["powershell", "-NoProfile", "-Command", _HELPER_SCRIPT]
+        self.ack_timeout = self.ACK_TIMEOUT if ack_timeout is None else ack_timeout
+        self.process = None
+        self._acks = None
+
+    def _start(self):
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        # 在后台线程中读取确认，等待时可以设置超时
+        self._acks = queue.Queue()
+        threading.Thread(
+            target=self._read_acks,
+            args=(self.process.stdout, self._acks),
+            name="NotifyHelper",
+            daemon=True
+        ).start()
 
-class Notifier:
     @staticmethod
-    def show_notification(title, message):
-        """显示系统通知"""
+    def _read_acks(stdout, acks):
+        with stdout:
+            for line in stdout:
+                acks.put(line.decode('utf-8', 'replace').strip())
+        # 进程已退出
+        acks.put(None)
+
+    def __call__(self, title, message):
+        if self.process is not None and self.process.poll() is not None:
+            # 进程意外退出，重新启动
+            self.close()
+        if self.process is None:
+            self._start()
+        line = base64.b64encode(json.dumps({"title": title, "message": message}).encode('utf-8'))
         try:
-            # 控制台输出，确保通知信息能被看到
-            print(f"[{title}] {message}")
-            
-            if sys.platform == "win32":
-                # Windows系统，尝试多种简单可靠的通知方法
-                
-                # 对标题和消息进行转义，防止PowerShell脚本出错
-                title_escaped = title.replace("'", "''")
-                message_escaped = message.replace("'", "''")
-                
-                # 1. 优先使用更可靠的PowerShell NotifyIcon方法
-                try:
-                    # 使用更可靠的NotifyIcon实现
-                    ps_script = f""" 
-                    Add-Type -AssemblyName System.Windows.Forms
-                    Add-Type -AssemblyName System.Drawing
-                    
-                    # 创建通知图标对象
-                    $notifyIcon = New-Object System.Windows.Forms.NotifyIcon
-                    
-                    # 设置图标和基本属性
-                    $notifyIcon.Icon = [System.Drawing.SystemIcons]::Information
-                    $notifyIcon.Visible = $true
-                    
-                    # 设置通知内容
-                    $notifyIcon.BalloonTipIcon = [System.Windows.Forms.ToolTipIcon]::Info
-                    $notifyIcon.BalloonTipTitle = '{title_escaped}'
-                    $notifyIcon.BalloonTipText = '{message_escaped}'
-                    
-                    # 显示通知
-                    $notifyIcon.ShowBalloonTip(3000)
-                    
-                    # 短暂延迟后清理资源
-                    Start-Sleep -Milliseconds 3500
-                    $notifyIcon.Dispose()
-                    """
-                    
-                    result = subprocess.run(
-                        ["powershell", "-Command", ps_script],
-                        capture_output=True,
-                        text=True,
-                        timeout=10
-                    )
-                    if result.returncode == 0:
-                        return True
-                    else:
-                        print(f"PowerShell NotifyIcon通知失败，错误码: {result.returncode}")
-                        print(f"错误输出: {result.stderr}")
-                except Exception as e:
-                    print(f"PowerShell NotifyIcon通知失败: {e}")
-                
-                # 2. 尝试使用PowerShell Toast通知脚本作为备选
-                try:
-                    # 使用更简洁的PowerShell命令，避免复杂的对象创建
-                    ps_script = f""" 
-                    [Windows.UI.Notifications.ToastNotificationManager, Windows.UI.Notifications, ContentType = WindowsRuntime] > $null
-                    $Template = [Windows.UI.Notifications.ToastNotificationManager]::GetTemplateContent([Windows.UI.Notifications.ToastTemplateType]::ToastText02)
-                    
-                    # 设置标题和内容
-                    $Title = $Template.GetElementsByTagName("text")[0]
-                    $Title.InnerText = '{title_escaped}'
-                    $Message = $Template.GetElementsByTagName("text")[1]
-                    $Message.InnerText = '{message_escaped}'
-                    
-                    # 创建通知
-                    $Toast = [Windows.UI.Notifications.ToastNotification]::new($Template)
-                    $Toast.Tag = 'CloudSaveTool'
-                    $Toast.Group = 'CloudSaveTool'
-                    
-                    # 显示通知
-                    [Windows.UI.Notifications.ToastNotificationManager]::CreateToastNotifier('CloudSaveTool').Show($Toast)
-                    """
-                    
-                    # 执行PowerShell脚本
-                    result = subprocess.run(
-                        ["powershell", "-Command", ps_script],
-                        capture_output=True,
-                        text=True,
-                        timeout=10
-                    )
-                    if result.returncode == 0:
-                        return True
-                    else:
-                        print(f"PowerShell Toast通知失败，错误码: {result.returncode}")
-                        print(f"错误输出: {result.stderr}")
-                except Exception as e:
-                    print(f"PowerShell Toast通知失败: {e}")
-                
-                # 3. 尝试使用msg命令（仅管理员可用，但简单可靠）
-                try:
-                    # 对消息进行转义，防止命令行解析错误
-                    msg_content = f"{title}: {message}"
-                    result = subprocess.run(
-                        ["msg", "*", msg_content],
-                        capture_output=True,
-                        text=True,
-                        timeout=5
-                    )
-                    if result.returncode == 0:
-                        return True
-                except Exception as e:
-                    print(f"MSG命令通知失败: {e}")
-                
-                # 4. 尝试使用rundll32命令调用Windows API（最底层的方法）
-                try:
-                    # 使用user32.dll的MessageBox函数显示简单消息框
-                    subprocess.run(
-                        ["rundll32", "user32.dll,MessageBoxA", "0", f"{message}", f"{title}", "64"],
-                        capture_output=True,
-                        timeout=10
-                    )
-                    return True
-                except Exception as e:
-                    print(f"Rundll32通知失败: {e}")
-            
-            # 所有方法都失败，只返回控制台输出
-            return True
-        except Exception as e:
-            print(f"通知发送失败: {e}")
-            # 确保控制台输出
-            print(f"[{title}] {message}")
+            self.process.stdin.write(line + b"\n")
+            self.process.stdin.flush()
+        except OSError:
+            self.close()
             return False
-    
+
+        try:
+            ack = self._acks.get(timeout=self.ack_timeout)
+        except queue.Empty:
+            ack = None
+        if ack == "ok":
+            return True
+        if ack:
+            # 进程还在运行，只是这条通知没有显示
+            print(f"通知进程报告错误: {ack}")
+        else:
+            print("通知进程已退出或没有响应")
+            self.close()
+        return False
+
+    def close(self):
+        """关闭通知进程，没有及时退出的进程被强制结束"""
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+class NotificationDispatcher:
+    # 收到第一条通知后等待多久再显示，期间的通知合并为一条（秒）
+    COALESCE_WINDOW = 1.0
+    # 两次显示通知的最小间隔（秒），期间到达的通知合并后再显示
+    MIN_INTERVAL = 5.0
+    # 连续失败多少次后暂停使用该通知方式
+    MAX_FAILURES = 3
+    # 暂停使用多久后重新尝试（秒）
+    FAILURE_COOLDOWN = 300.0
+
+    def __init__(self, backends, coalesce_window=None, min_interval=None, max_failures=None, failure_cooldown=None):
+        """在后台线程中显示通知，调用方不需要等待
+
+        backends 为按优先级排列的 (名称, 函数) 列表，函数返回是否显示成功。
+        每条通知按优先级依次尝试，偶尔失败（例如常驻进程重启）的方式下次仍然优先使用；
+        连续失败 max_failures 次的方式暂停使用 failure_cooldown 秒，之后再重新尝试。
+        """
+        self.backends = list(backends)
+        self.coalesce_window = self.COALESCE_WINDOW if coalesce_window is None else coalesce_window
+        self.min_interval = self.MIN_INTERVAL if min_interval is None else min_interval
+        self.max_failures = self.MAX_FAILURES if max_failures is None else max_failures
+        self.failure_cooldown = self.FAILURE_COOLDOWN if failure_cooldown is None else failure_cooldown
+        self.working = None
+        # 各通知方式的连续失败次数，以及暂停使用到什么时候
+        self.failures = {}
+        self.disabled_until = {}
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_shown = 0.0
+        self._idle = threading.Event()
+        self._idle.set()
+
+    def submit(self, title, message):
+        """加入通知队列，立即返回"""
+        with self._lock:
+            self._idle.clear()
+            self._queue.put((title, message))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="Notifier", daemon=True)
+                self._thread.start()
+
+    def flush(self, timeout=None):
+        """等待队列中的通知全部显示，返回是否在超时前完成"""
+        return self._idle.wait(timeout)
+
+    @staticmethod
+    def coalesce(items):
+        """把同一批通知按标题合并，例如连续5次备份成功合并为一条"""
+        groups = {}
+        for title, message in items:
+            groups.setdefault(title, []).append(message)
+
+        merged = []
+        for title, messages in groups.items():
+            if len(messages) == 1:
+                merged.append((title, messages[0]))
+            elif len(set(messages)) == 1:
+                merged.append((title, f"{messages[0]}（共 {len(messages)} 次）"))
+            else:
+                merged.append((title, f"{messages[-1]}（共 {len(messages)} 条）"))
+        return merged
+
+    def _collect(self):
+        """取出一批通知：等待合并窗口和最小间隔，期间到达的通知一起取出"""
+        items = [self._queue.get()]
+        deadline = max(time.time() + self.coalesce_window, self._last_shown + self.min_interval)
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            with tracing.span("notify", items=len(items)) as sp:
+                for title, message in self.coalesce(items):
+                    self._show(title, message)
+                sp.set(backend=self.working)
+            self._last_shown = time.time()
+            with self._lock:
+                if self._queue.empty():
+                    self._idle.set()
+
+    def _show(self, title, message):
+        """按优先级依次尝试没有被暂停的通知方式"""
+        for name, show in self.backends:
+            if self.disabled_until.get(name, 0) > time.monotonic():
+                continue
+            try:
+                if show(title, message):
+                    self.failures.pop(name, None)
+                    self.disabled_until.pop(name, None)
+                    self.working = name
+                    return True
+            except Exception as e:
+                print(f"{name}通知失败: {e}")
+            else:
+                print(f"{name}通知失败")
+            self._record_failure(name)
+        return False
+
+    def _record_failure(self, name):
+        count = self.failures.get(name, 0) + 1
+        self.failures[name] = count
+        if count >= self.max_failures:
+            # 暂停期满后再失败一次就继续暂停
+            self.disabled_until[name] = time.monotonic() + self.failure_cooldown
+            print(f"{name}连续失败 {count} 次，{self.failure_cooldown:.0f} 秒内不再使用")
+        if self.working == name:
+            self.working = None
+
+
+def _default_backends():
+    if sys.platform != "win32":
+        # 其他系统只在控制台输出
+        return []
+    return [
+        ("常驻PowerShell", NotifyHelper()),
+        ("PowerShell NotifyIcon", notify_icon),
+        ("PowerShell Toast", toast),
+        ("MSG命令", msg),
+        ("Rundll32", rundll32)
+    ]
+
+
+class Notifier:
+    # 关闭后只在控制台输出
+    enabled = True
+    _dispatcher = None
+    _dispatcher_lock = threading.Lock()
+
+    @staticmethod
+    def dispatcher():
+        with Notifier._dispatcher_lock:
+            if Notifier._dispatcher is None:
+                Notifier._dispatcher = NotificationDispatcher(_default_backends())
+            return Notifier._dispatcher
+
+    @staticmethod
+    def show_notification(title, message):
+        """显示系统通知：立即在控制台输出，系统通知由后台线程合并后显示"""
+        # 控制台输出，确保通知信息能被看到
+        print(f"[{title}] {message}")
+        if Notifier.enabled:
+            Notifier.dispatcher().submit(title, message)
+        return True
+
     @staticmethod
     def backup_success():
         """备份成功通知"""
@@ -139,7 +362,7 @@ class Notifier:
             "备份成功",
             "存档已成功备份到云端"
         )
-    
+
     @staticmethod
     def restore_success():
         """恢复成功通知"""
@@ -147,7 +370,7 @@ class Notifier:
             "恢复成功",
             "存档已从云端成功恢复"
         )
-    
+
     @staticmethod
     def error(message):
         """错误通知"""
@@ -0,0 +1,118 @@
+import io
+import time
+import pstats
+import threading
+import cProfile
+import tracemalloc
+from pathlib import Path
+from datetime import datetime
+
+# 性能分析结果保存在应用数据目录下的子目录中
+PROFILE_DIR = "profiles"
+# 报告中列出的函数和内存分配位置数量
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 30
+# 内存分配记录的调用栈深度
+TRACEMALLOC_FRAMES = 5
+# 检查内存占用的间隔（秒），占用超过之前的最高值时保存一次快照
+SAMPLE_INTERVAL = 0.1
+
+
+class ProfileCapture:
+    def __init__(self, name, output_dir=None, debug=False):
+        """用 cProfile 和 tracemalloc 记录一次操作，结束时保存结果
+
+        生成两个文件：
+        - <操作>_<时间>.prof：cProfile 数据，可用 snakeviz 或 pstats 查看
+        - <操作>_<时间>.txt：耗时、峰值内存、累计耗时最多的函数，以及内存占用
+          最高时分配内存最多的代码行（后台线程定期采样）
+
+        cProfile 只记录进入 with 的线程（压缩和上传blob的线程池不在其中），
+        tracemalloc 记录所有线程的内存分配。
+        """
+        self.name = name
+        self.output_dir = output_dir
+        self.debug = debug
+        self.profile = None
+        self.prof_path = None
+        self.report_path = None
+        self._stop = threading.Event()
+        self._peak_snapshot = None
+        self._peak_current = -1
+
+    def __enter__(self):
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        self._sampler = threading.Thread(target=self._sample, name="ProfileSampler", daemon=True)
+        self._sampler.start()
+        self.profile = cProfile.Profile()
+        self.started = time.perf_counter()
+        self.profile.enable()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self._take_snapshot()
+
+    def _take_snapshot(self):
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self._peak_current:
+            self._peak_current = current
+            self._peak_snapshot = tracemalloc.take_snapshot()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profile.disable()
+        elapsed = time.perf_counter() - self.started
+        self._stop.set()
+        self._sampler.join()
+        self._take_snapshot()
+        snapshot = self._peak_snapshot
+        _, peak = tracemalloc.get_traced_memory()
+        if self._started_tracing:
+            tracemalloc.stop()
+        try:
+            self.save(snapshot, peak, elapsed, exc)
+        except OSError as e:
+            print(f"保存性能分析结果失败: {e}")
+        return False
+
+    def save(self, snapshot, peak, elapsed, exc=None):
+        output_dir = self.output_dir
+        if output_dir is None:
+            from config import get_app_data_dir
+            output_dir = get_app_data_dir() / PROFILE_DIR
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{self.name}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        self.prof_path = output_dir / f"{stem}.prof"
+        self.report_path = output_dir / f"{stem}.txt"
+
+        self.profile.dump_stats(str(self.prof_path))
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        allocations = snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+
+        with open(self.report_path, 'w', encoding='utf-8') as f:
+            f.write(f"操作: {self.name}\n")
+            f.write(f"耗时: {elapsed:.3f} 秒\n")
+            f.write(f"峰值内存分配: {peak / 1024 / 1024:.2f} MB\n")
+            if exc is not None:
+                f.write(f"出错: {type(exc).__name__}: {exc}\n")
+            f.write(f"\n内存占用最高时（采样到 {self._peak_current / 1024 / 1024:.2f} MB）分配最多的 {len(allocations)} 个位置:\n")
+            for stat in allocations:
+                frame = stat.traceback[0]
+                f.write(f"{stat.size / 1024:10.1f} KB {stat.count:8d} 块  {frame.filename}:{frame.lineno}\n")
+            f.write(f"\n累计耗时最多的 {TOP_FUNCTIONS} 个函数（仅本线程）:\n")
+            f.write(stream.getvalue())
+
+        if self.debug:
+            print(f"[调试] 性能分析结果已保存: {self.prof_path}, {self.report_path}")
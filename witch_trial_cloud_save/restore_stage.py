@@ -0,0 +1,164 @@
+import os
+import time
+import zlib
+import shutil
+from pathlib import Path
+from file_index import scan_save_dir, hash_file
+
+# 重命名被占用的存档目录时的重试次数
+SWAP_RETRIES = 5
+SWAP_RETRY_DELAY = 0.5
+
+
+def _staging_paths(save_dir):
+    """暂存目录和交换时保留旧存档的目录，与存档目录在同一个父目录下，保证重命名是原子操作"""
+    save_dir = Path(save_dir)
+    return (
+        save_dir.with_name(f".{save_dir.name}.restore"),
+        save_dir.with_name(f".{save_dir.name}.restore-old")
+    )
+
+
+def _rename(src, dst):
+    """重命名目录，游戏占用文件导致的共享冲突等待后重试"""
+    for attempt in range(SWAP_RETRIES):
+        try:
+            os.rename(src, dst)
+            return
+        except PermissionError:
+            if attempt == SWAP_RETRIES - 1:
+                raise
+            time.sleep(SWAP_RETRY_DELAY * (attempt + 1))
+
+
+def _crc32_file(file_path):
+    crc = 0
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+
+def recover_restore(save_dir, debug=False):
+    """处理上一次恢复中断后留下的目录，保证存档目录是完整的旧存档或完整的新存档"""
+    staging_dir, old_dir = _staging_paths(save_dir)
+    if old_dir.exists():
+        if Path(save_dir).exists():
+            # 新存档已换入，只是旧存档还没删除
+            shutil.rmtree(old_dir, ignore_errors=True)
+        else:
+            # 两次重命名之间中断，换回旧存档
+            os.rename(old_dir, save_dir)
+            if debug:
+                print(f"[调试] 上次恢复未完成，已还原旧存档: {save_dir}")
+    if staging_dir.exists():
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+class RestoreStage:
+    def __init__(self, save_dir, debug=False):
+        """在存档目录旁的暂存目录中组装恢复后的存档，完成后一次性换入
+
+        内容与当前存档相同的文件用硬链接（不支持时复制）放入暂存目录，不重新
+        写入；只有内容不同的文件才写入暂存目录。commit() 用两次重命名交换目录，
+        旧存档保留到交换成功后才删除；恢复失败或中断时当前存档不受影响。
+        """
+        self.save_dir = Path(save_dir)
+        self.debug = debug
+        recover_restore(save_dir, debug=debug)
+        self.staging_dir, self.old_dir = _staging_paths(save_dir)
+        self.staging_dir.mkdir(parents=True)
+        self.kept = set()
+        self.written = set()
+
+    @staticmethod
+    def _parts(rel_path):
+        """去掉绝对路径和 .. 防止写到目录之外"""
+        return [p for p in rel_path.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+
+    def keep(self, rel_path, size=None, sha256=None, crc=None):
+        """当前存档中的文件与备份内容相同时直接放入暂存目录并返回True
+
+        比较大小以及 sha256（或 zip 条目的 CRC32）；返回False时调用方需要写入该文件。
+        """
+        parts = self._parts(rel_path)
+        current = self.save_dir.joinpath(*parts)
+        try:
+            if size is not None and os.path.getsize(current) != size:
+                return False
+            if sha256 is not None:
+                if hash_file(current) != sha256:
+                    return False
+            elif crc is not None:
+                if _crc32_file(current) != crc:
+                    return False
+            else:
+                return False
+        except OSError:
+            return False
+
+        dst_path = self.staging_dir.joinpath(*parts)
+        dst_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(current, dst_path)
+        except OSError:
+            shutil.copy2(current, dst_path)
+        self.kept.add("/".join(parts))
+        return True
+
+    def path(self, rel_path):
+        """返回文件在暂存目录中的写入路径"""
+        parts = self._parts(rel_path)
+        dst_path = self.staging_dir.joinpath(*parts)
+        dst_path.parent.mkdir(parents=True, exist_ok=True)
+        self.written.add("/".join(parts))
+        return dst_path
+
+    def makedirs(self, rel_path):
+        self.staging_dir.joinpath(*self._parts(rel_path)).mkdir(parents=True, exist_ok=True)
+
+    def write(self, rel_path, data, mtime_ns=None):
+        dst_path = self.path(rel_path)
+        with open(dst_path, 'wb') as f:
+            f.write(data)
+        if mtime_ns:
+            os.utime(dst_path, ns=(mtime_ns, mtime_ns))
+
+    def commit(self):
+        """用暂存目录替换存档目录，返回是否实际替换
+
+        所有文件都与当前存档相同且没有多余文件时不替换，直接删除暂存目录。
+        """
+        if not self.written and self.save_dir.exists() and set(scan_save_dir(self.save_dir)) == self.kept:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+            if self.debug:
+                print(f"[调试] 存档与备份相同，无需替换（{len(self.kept)} 个文件）")
+            return False
+
+        if self.save_dir.exists():
+            _rename(self.save_dir, self.old_dir)
+            try:
+                _rename(self.staging_dir, self.save_dir)
+            except OSError:
+                os.rename(self.old_dir, self.save_dir)
+                raise
+            shutil.rmtree(self.old_dir, ignore_errors=True)
+        else:
+            self.save_dir.parent.mkdir(parents=True, exist_ok=True)
+            _rename(self.staging_dir, self.save_dir)
+
+        if self.debug:
+            print(f"[调试] 存档已替换：写入 {len(self.written)} 个文件，未变化 {len(self.kept)} 个文件")
+        return True
+
+    def abort(self):
+        """放弃恢复，删除暂存目录，当前存档保持不变"""
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        return False
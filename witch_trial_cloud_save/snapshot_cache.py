@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from pathlib import Path
+from file_index import scan_save_dir, open_stable, check_unchanged
+from restore_stage import RestoreStage
+
+# 默认缓存容量上限
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+class SnapshotCache:
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, debug=False):
+        """本机最近上传和下载过的备份，恢复命中时不需要访问网络
+
+        文件内容按SHA256存放在 objects 目录（不同备份中相同的文件只存一份），
+        index.db 记录每个备份包含的文件和最近使用时间。总大小超过 max_bytes
+        时按最近最少使用的顺序淘汰整个备份。
+        """
+        if cache_dir is None:
+            from config import get_app_data_dir
+            cache_dir = get_app_data_dir() / "snapshot_cache"
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.debug = debug
+        self.conn = sqlite3.connect(str(self.cache_dir / "index.db"))
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    name TEXT PRIMARY KEY,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    snapshot TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    chunks TEXT,
+                    PRIMARY KEY (snapshot, path)
+                )
+            ''')
+
+    def _object_path(self, sha256):
+        return self.objects_dir / sha256
+
+    def load_object(self, sha256):
+        """读取指定内容，缓存中没有时返回None"""
+        try:
+            with open(self._object_path(sha256), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if hashlib.sha256(data).hexdigest() != sha256:
+            return None
+        return data
+
+    def _store_file(self, file_path, sha256):
+        """把存档文件复制到缓存，内容与 sha256 不一致（已被修改）时返回False"""
+        object_path = self._object_path(sha256)
+        if object_path.exists():
+            return True
+        tmp_path = object_path.with_name(f"{sha256}.tmp")
+        digest = hashlib.sha256()
+        try:
+            src, stat = open_stable(file_path)
+            with src, open(tmp_path, 'wb') as dst:
+                for block in iter(lambda: src.read(COPY_BLOCK_SIZE), b""):
+                    digest.update(block)
+                    dst.write(block)
+            check_unchanged(file_path, stat)
+            if digest.hexdigest() != sha256:
+                os.remove(tmp_path)
+                return False
+            os.replace(tmp_path, object_path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def put(self, name, save_dir, entries=None):
+        """把存档目录当前的内容作为备份 name 加入缓存
+
+        entries 为该备份的文件状态（路径、大小、修改时间、内容哈希），省略时
+        读取整个存档目录计算。文件已被修改、与备份内容不一致时不缓存该备份。
+        """
+        if entries is None:
+            entries = []
+            for rel_path, (size, mtime_ns) in sorted(scan_save_dir(save_dir).items()):
+                digest = hashlib.sha256()
+                try:
+                    with open(os.path.join(save_dir, rel_path), 'rb') as f:
+                        for block in iter(lambda: f.read(COPY_BLOCK_SIZE), b""):
+                            digest.update(block)
+                except OSError:
+                    return False
+                entries.append({"path": rel_path, "size": size, "mtime_ns": mtime_ns, "sha256": digest.hexdigest()})
+
+        total = sum(entry["size"] for entry in entries)
+        if total > self.max_bytes:
+            if self.debug:
+                print(f"[调试] 备份 {name} 超过缓存容量，不缓存")
+            return False
+
+        for entry in entries:
+            if not self._store_file(os.path.join(save_dir, entry["path"]), entry["sha256"]):
+                if self.debug:
+                    print(f"[调试] 存档文件已变化，不缓存备份 {name}: {entry['path']}")
+                self._remove_unused()
+                return False
+
+        with self.conn:
+            self.conn.execute("DELETE FROM files WHERE snapshot = ?", (name,))
+            self.conn.execute("INSERT OR REPLACE INTO snapshots (name, last_used) VALUES (?, ?)", (name, time.time()))
+            self.conn.executemany(
+                "INSERT INTO files (snapshot, path, size, mtime_ns, sha256, chunks) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        name,
+                        entry["path"],
+                        entry["size"],
+                        entry["mtime_ns"],
+                        entry["sha256"],
+                        json.dumps(entry["chunks"]) if entry.get("chunks") is not None else None
+                    )
+                    for entry in entries
+                ]
+            )
+        if self.debug:
+            print(f"[调试] 已缓存备份 {name}: {len(entries)} 个文件, {total} 字节")
+        self._evict()
+        return True
+
+    def get(self, name):
+        """返回缓存中备份 name 的文件状态列表，没有缓存或内容不完整时返回None"""
+        if self.conn.execute("SELECT 1 FROM snapshots WHERE name = ?", (name,)).fetchone() is None:
+            return None
+        rows = self.conn.execute(
+            "SELECT path, size, mtime_ns, sha256, chunks FROM files WHERE snapshot = ? ORDER BY path",
+            (name,)
+        ).fetchall()
+        entries = []
+        for path, size, mtime_ns, sha256, chunks in rows:
+            try:
+                if os.path.getsize(self._object_path(sha256)) != size:
+                    raise OSError("大小不一致")
+            except OSError:
+                # 内容文件丢失或损坏，放弃这个缓存
+                self.discard(name)
+                return None
+            entries.append({
+                "path": path,
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "sha256": sha256,
+                "chunks": json.loads(chunks) if chunks else None
+            })
+
+        with self.conn:
+            self.conn.execute("UPDATE snapshots SET last_used = ? WHERE name = ?", (time.time(), name))
+        return entries
+
+    def restore(self, entries, save_dir):
+        """把 get() 返回的文件恢复到存档目录并还原修改时间，返回是否实际替换了存档
+
+        与当前存档相同的文件不重新写入，全部写入暂存目录并校验后才替换存档目录。
+        """
+        with RestoreStage(save_dir, debug=self.debug) as stage:
+            for entry in entries:
+                if stage.keep(entry["path"], size=entry["size"], sha256=entry["sha256"]):
+                    continue
+                dst_path = stage.path(entry["path"])
+                digest = hashlib.sha256()
+                with open(self._object_path(entry["sha256"]), 'rb') as src, open(dst_path, 'wb') as dst:
+                    for block in iter(lambda: src.read(COPY_BLOCK_SIZE), b""):
+                        digest.update(block)
+                        dst.write(block)
+                if digest.hexdigest() != entry["sha256"]:
+                    raise ValueError(f"缓存文件校验失败: {entry['path']}")
+                os.utime(dst_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+                if self.debug:
+                    print(f"[调试] 从缓存恢复文件: {entry['path']}")
+            return stage.commit()
+
+    def discard(self, name):
+        """删除备份 name 的缓存（云端备份已删除）"""
+        with self.conn:
+            self.conn.execute("DELETE FROM snapshots WHERE name = ?", (name,))
+            self.conn.execute("DELETE FROM files WHERE snapshot = ?", (name,))
+        self._remove_unused()
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM snapshots")
+            self.conn.execute("DELETE FROM files")
+        self._remove_unused()
+
+    def total_size(self):
+        """缓存中所有内容文件的总大小（相同内容只计一次）"""
+        row = self.conn.execute("SELECT SUM(size) FROM (SELECT DISTINCT sha256, size FROM files)").fetchone()
+        return row[0] or 0
+
+    def _evict(self):
+        """超过容量上限时淘汰最久未使用的备份"""
+        while self.total_size() > self.max_bytes:
+            row = self.conn.execute("SELECT name FROM snapshots ORDER BY last_used LIMIT 1").fetchone()
+            if row is None:
+                break
+            if self.debug:
+                print(f"[调试] 缓存超过容量，淘汰备份: {row[0]}")
+            with self.conn:
+                self.conn.execute("DELETE FROM snapshots WHERE name = ?", (row[0],))
+                self.conn.execute("DELETE FROM files WHERE snapshot = ?", (row[0],))
+        self._remove_unused()
+
+    def _remove_unused(self):
+        """删除没有备份引用的内容文件和中断留下的临时文件"""
+        keep = {row[0] for row in self.conn.execute("SELECT DISTINCT sha256 FROM files")}
+        for path in self.objects_dir.iterdir():
+            if path.name not in keep:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def close(self):
+        """关闭数据库连接，必须在创建它的线程中调用"""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -0,0 +1,192 @@
+import os
+import sys
+import math
+import time
+import queue
+import threading
+import traceback
+from collections import deque
+
+# 卡顿日志的大小上限和保留的旧文件数
+STALL_LOG = "stalls.log"
+STALL_LOG_MAX_BYTES = 1024 * 1024
+STALL_LOG_BACKUPS = 2
+
+
+def percentile(values, p):
+    """values 的第 p 百分位数（最近秩法），没有数据时返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = math.ceil(p / 100 * len(ordered))
+    return ordered[min(len(ordered), max(rank, 1)) - 1]
+
+
+class StallDetector:
+    # 主线程每隔多久响应一次检测（秒）
+    INTERVAL = 0.1
+    # 事件循环被阻塞超过多久算作卡顿（秒）
+    THRESHOLD = 0.25
+    # 用于计算百分位数的最近检测次数
+    SAMPLES = 3000
+
+    def __init__(self, root, threshold=None, interval=None, log_dir=None, debug=False):
+        """检测Tk主线程卡顿
+
+        主线程通过 root.after() 定期响应检测，实际响应时间比预定时间晚多少就是
+        事件循环的延迟。后台线程发现主线程超过 threshold 秒没有响应时，立即记录
+        主线程当时的调用栈（即阻塞事件循环的代码）；主线程恢复后把卡顿交给后台线程，
+        由后台线程把卡顿时长和调用栈写入应用数据目录下的 stalls.log，写日志不会
+        占用主线程。必须在主线程中创建。
+        """
+        self.root = root
+        self.threshold = self.THRESHOLD if threshold is None else threshold
+        self.interval = self.INTERVAL if interval is None else interval
+        self.log_dir = log_dir
+        self.debug = debug
+        self.main_thread_id = threading.get_ident()
+
+        self.latencies = deque(maxlen=self.SAMPLES)
+        self.stalls = deque(maxlen=self.SAMPLES)
+        self.beats = 0
+        self.stall_count = 0
+        self.stalled_seconds = 0.0
+
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._scheduled = None
+        self._stack = None
+        self._thread = None
+        self._logger = None
+        # 主线程记录的卡顿 (时长, 调用栈)，由后台线程写入日志
+        self._pending = queue.Queue()
+
+    def start(self):
+        self._schedule()
+        self._thread = threading.Thread(target=self._watch, name="StallDetector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止检测，把本次运行的界面响应统计写入日志"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        # 后台线程退出前没来得及写入的卡顿
+        self._write_stalls()
+        summary = self.format_stats()
+        if self.debug:
+            print(f"[调试] {summary}")
+        try:
+            self._log(summary)
+        except OSError:
+            pass
+        if self._logger is not None:
+            for handler in list(self._logger.handlers):
+                self._logger.removeHandler(handler)
+                handler.close()
+            self._logger = None
+
+    def _schedule(self):
+        with self._lock:
+            self._scheduled = time.perf_counter() + self.interval
+        self.root.after(int(self.interval * 1000), self._beat)
+
+    def _beat(self):
+        """在主线程中执行：记录本次响应比预定时间晚了多久"""
+        latency = max(0.0, time.perf_counter() - self._scheduled)
+        with self._lock:
+            self.beats += 1
+            self.latencies.append(latency)
+            stack, self._stack = self._stack, None
+        if latency >= self.threshold:
+            self._record_stall(latency, stack)
+        if not self._stopped.is_set():
+            self._schedule()
+
+    def _watch(self):
+        """后台线程：主线程超时未响应时记录它当前的调用栈，并写入主线程记录的卡顿"""
+        while not self._stopped.wait(self.interval / 2):
+            self._capture_stack()
+            self._write_stalls()
+
+    def _capture_stack(self):
+        with self._lock:
+            if self._scheduled is None or self._stack is not None:
+                return
+            if time.perf_counter() - self._scheduled < self.threshold:
+                return
+            frame = sys._current_frames().get(self.main_thread_id)
+            self._stack = traceback.format_stack(frame) if frame is not None else []
+
+    def _record_stall(self, latency, stack):
+        """在主线程中执行：只更新统计，日志交给后台线程写入"""
+        with self._lock:
+            self.stall_count += 1
+            self.stalled_seconds += latency
+            self.stalls.append(latency)
+        self._pending.put((latency, stack))
+
+    def _write_stalls(self):
+        """写入主线程记录的卡顿，在后台线程中执行（停止检测时由 stop() 写入剩余的）"""
+        while True:
+            try:
+                latency, stack = self._pending.get_nowait()
+            except queue.Empty:
+                return
+            self._write_stall(latency, stack)
+
+    def _write_stall(self, latency, stack):
+        message = f"界面卡顿 {latency * 1000:.0f} 毫秒"
+        if stack:
+            message += "，主线程调用栈:\n" + "".join(stack).rstrip()
+        else:
+            message += "（卡顿期间未能记录调用栈）"
+        if self.debug:
+            print(f"[调试] {message}")
+        try:
+            self._log(message)
+        except OSError as e:
+            if self.debug:
+                print(f"[调试] 写入卡顿日志失败: {e}")
+
+    def _log(self, message):
+        if self._logger is None:
+            import logging
+            from logging.handlers import RotatingFileHandler
+            log_dir = self.log_dir
+            if log_dir is None:
+                from config import get_app_data_dir
+                log_dir = get_app_data_dir()
+            handler = RotatingFileHandler(
+                os.path.join(str(log_dir), STALL_LOG),
+                maxBytes=STALL_LOG_MAX_BYTES,
+                backupCount=STALL_LOG_BACKUPS,
+                encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self._logger = logging.getLogger(f"witch_trial_cloud_save.stalls.{id(self)}")
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            self._logger.addHandler(handler)
+        self._logger.info(message)
+
+    def stats(self):
+        """界面响应统计：检测次数、卡顿次数和总时长、事件循环延迟的百分位数（毫秒）"""
+        with self._lock:
+            latencies = list(self.latencies)
+            result = {
+                "beats": self.beats,
+                "stalls": self.stall_count,
+                "stalled_ms": round(self.stalled_seconds * 1000, 1),
+            }
+        for p in (50, 95, 99):
+            value = percentile(latencies, p)
+            result[f"p{p}_ms"] = None if value is None else round(value * 1000, 1)
+        result["max_ms"] = round(max(latencies) * 1000, 1) if latencies else None
+        return result
+
+    def format_stats(self):
+        stats = self.stats()
+        return (f"界面响应：检测 {stats['beats']} 次，卡顿 {stats['stalls']} 次共 {stats['stalled_ms']:.0f} 毫秒，"
+                f"延迟 p50 {stats['p50_ms']} / p95 {stats['p95_ms']} / p99 {stats['p99_ms']} / 最长 {stats['max_ms']} 毫秒")
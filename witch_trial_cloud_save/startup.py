@@ -0,0 +1,36 @@
+import time
+
+# 启动耗时预算（秒），从 main.py 开始执行算起
+# 导入界面模块：不应在启动时导入 requests、cryptography、watchdog 等较慢的库
+IMPORT_BUDGET = 0.3
+# 窗口第一次绘制完成
+FIRST_PAINT_BUDGET = 1.0
+
+# 启动时不应导入的模块，需要时在函数内导入
+DEFERRED_MODULES = ("requests", "cryptography", "watchdog", "plyer", "numpy")
+
+_started = time.perf_counter()
+_marks = {}
+
+
+def mark(name):
+    """记录从启动到现在的耗时（秒）"""
+    _marks[name] = time.perf_counter() - _started
+    return _marks[name]
+
+
+def elapsed(name):
+    return _marks.get(name)
+
+
+def report(debug=False):
+    """输出启动耗时，超出预算时给出警告"""
+    budgets = {"import": IMPORT_BUDGET, "first_paint": FIRST_PAINT_BUDGET}
+    for name, budget in budgets.items():
+        value = _marks.get(name)
+        if value is None:
+            continue
+        if value > budget:
+            print(f"警告：启动阶段 {name} 耗时 {value * 1000:.0f} 毫秒，超出预算 {budget * 1000:.0f} 毫秒")
+        elif debug:
+            print(f"[调试] 启动阶段 {name} 耗时 {value * 1000:.0f} 毫秒（预算 {budget * 1000:.0f} 毫秒）")
@@ -0,0 +1,36 @@
+import sys
+import os
+import json
+import tempfile
+from pathlib import Path
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark import generate_save_tree, run_suite, compare
+from file_index import FileIndex, scan_save_dir
+
+
+def _tree_hashes(root):
+    return [entry["sha256"] for entry in FileIndex.hash_changed(root, scan_save_dir(root), {})]
+
+
+def test_generated_tree_is_reproducible():
+    with tempfile.TemporaryDirectory() as a, tempfile.TemporaryDirectory() as b:
+        assert generate_save_tree(a, scale="tiny", seed=1) == generate_save_tree(b, scale="tiny", seed=1)
+        assert _tree_hashes(a) == _tree_hashes(b)
+
+
+def test_suite_results_are_json():
+    result = run_suite(["restore_unchanged", "get_current_files"], scale="tiny", repeat=1, isolate=False)
+    result = json.loads(json.dumps(result))
+    assert result["meta"]["tree"]["files"] > 0
+    for name in ["restore_unchanged", "get_current_files"]:
+        assert result["results"][name]["seconds"] > 0
+    assert set(compare(result, result).values()) == {1.0}
+
+
+if __name__ == "__main__":
+    test_generated_tree_is_reproducible()
+    test_suite_results_are_json()
+    print("所有性能测试工具测试通过！")
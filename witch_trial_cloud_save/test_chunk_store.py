@@ -0,0 +1,205 @@
+import sys
+import os
+import random
+import hashlib
+import tempfile
+from pathlib import Path
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import chunk_store
+from chunk_store import ChunkStore, iter_chunks, encode_chunk, decode_chunk, chunk_path
+from file_index import FileIndex, scan_save_dir, scan_changed
+from fake_github import FakeGitHub
+
+
+def _random_bytes(size, seed):
+    rng = random.Random(seed)
+    return bytes(rng.getrandbits(8) for _ in range(size))
+
+
+def test_chunks_cover_data():
+    data = _random_bytes(600 * 1024, 1)
+    pieces = list(iter_chunks(data))
+    assert pieces[0][0] == 0
+    assert sum(size for _, size in pieces) == len(data)
+
+
+def test_cut_points_are_stable():
+    # 切分点改变会使远端已有的数据块全部失效，numpy 和逐字节计算的结果必须与之前完全相同
+    rng = random.Random(11)
+    data = rng.randbytes(2 * 1024 * 1024) + b"save " * 100000 + rng.randbytes(300000)
+
+    def digest(pieces):
+        return hashlib.sha256(repr(list(pieces)).encode()).hexdigest()
+
+    assert digest(iter_chunks(data)) == "c7fd06a263ec8a0093a5cc5c16d2bd813b9f9b656b369b2c15065f0564cf121b"
+    small = data[:200000]
+    assert digest(iter_chunks(small, 64, 256, 1024)) == "2bc2d268ac304e0478e4319afe68a42f422b11b6d675a984156edb06d339f63e"
+    assert list(iter_chunks(small, 16, 64, 128)) == list(chunk_store._iter_chunks_python(small, 16, 64, 128))
+
+
+def test_insert_only_changes_nearby_chunks():
+    data = _random_bytes(1024 * 1024, 2)
+    edited = data[:300000] + b"slot" + data[300000:]
+
+    def hashes(buf):
+        return [hashlib.sha256(buf[o:o + n]).hexdigest() for o, n in iter_chunks(buf)]
+
+    before = set(hashes(data))
+    after = hashes(edited)
+    reused = sum(1 for h in after if h in before)
+    assert reused >= len(after) - 2
+
+
+def test_snapshot_roundtrip():
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+        (Path(src) / "slot").mkdir()
+        (Path(src) / "slot" / "save_01.dat").write_bytes(_random_bytes(200 * 1024, 3))
+        (Path(src) / "system.dat").write_bytes(b"settings")
+
+        manifest, chunks = ChunkStore.build_snapshot(src)
+        assert {entry["path"] for entry in manifest["files"]} == {"slot/save_01.dat", "system.dat"}
+
+        # 模拟上传再下载的编码过程
+        fetched = {h: decode_chunk(encode_chunk(data), h) for h, data in chunks.items()}
+        ChunkStore.restore_snapshot(manifest, fetched, dst)
+
+        assert (Path(dst) / "slot" / "save_01.dat").read_bytes() == (Path(src) / "slot" / "save_01.dat").read_bytes()
+        assert (Path(dst) / "system.dat").read_bytes() == b"settings"
+
+
+def test_unchanged_files_are_not_reread():
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as db_dir:
+        (Path(src) / "save_01.dat").write_bytes(_random_bytes(100 * 1024, 4))
+        (Path(src) / "save_02.dat").write_bytes(_random_bytes(100 * 1024, 5))
+
+        index = FileIndex(Path(db_dir) / "file_index.db")
+        manifest, chunks = ChunkStore.build_snapshot(src, previous=index.load(src))
+        index.record(src, manifest["files"])
+        previous = index.load(src)
+
+        # 没有变化时不读取任何文件，内容与索引一致
+        manifest, chunks = ChunkStore.build_snapshot(src, previous=previous)
+        assert chunks == {}
+        assert FileIndex.same_content(previous, manifest["files"])
+
+        # 只改写一个存档槽位
+        (Path(src) / "save_02.dat").write_bytes(_random_bytes(100 * 1024, 6))
+        os.utime(Path(src) / "save_02.dat", ns=(1, 1))
+        manifest, chunks = ChunkStore.build_snapshot(src, previous=previous)
+        changed = [e for e in manifest["files"] if e["chunks"][0] in chunks]
+        assert [e["path"] for e in changed] == ["save_02.dat"]
+        assert not FileIndex.same_content(previous, manifest["files"])
+        index.close()
+
+
+def test_scan_changed_matches_full_scan():
+    with tempfile.TemporaryDirectory() as src:
+        (Path(src) / "save_01.dat").write_bytes(b"a")
+        (Path(src) / "save_02.dat").write_bytes(b"b")
+        previous = {
+            path: {"path": path, "size": size, "mtime_ns": mtime_ns}
+            for path, (size, mtime_ns) in scan_save_dir(src).items()
+        }
+
+        # 监控记录的变化：修改、新建、删除，以及被忽略的临时文件
+        (Path(src) / "save_01.dat").write_bytes(b"changed")
+        (Path(src) / "save_03.dat").write_bytes(b"c")
+        (Path(src) / "save_02.dat").unlink()
+        (Path(src) / "save_03.dat.tmp").write_bytes(b"t")
+        changed = {"save_01.dat", "save_02.dat", "save_03.dat", "save_03.dat.tmp"}
+
+        ignore = ["*.tmp"]
+        assert scan_changed(src, previous, changed, ignore=ignore) == scan_save_dir(src, ignore=ignore)
+        assert "save_03.dat.tmp" not in scan_changed(src, previous, None, ignore=ignore)
+
+
+def test_unreadable_files_fail_the_snapshot():
+    from file_index import TornReadError
+    with tempfile.TemporaryDirectory() as src:
+        (Path(src) / "save_01.dat").write_bytes(b"a" * 1000)
+        (Path(src) / "save_02.dat").write_bytes(b"b" * 1000)
+        chunk_file = ChunkStore._chunk_file
+
+        def failing(error):
+            def _chunk_file(src_path, chunks):
+                if src_path.endswith("save_02.dat"):
+                    raise error
+                return chunk_file(src_path, chunks)
+            return staticmethod(_chunk_file)
+
+        try:
+            # 被占用或一直在被写入的文件不能从快照中漏掉，否则恢复时会删掉这个存档
+            for error in (PermissionError("文件被占用"), TornReadError("文件在读取过程中被修改")):
+                ChunkStore._chunk_file = failing(error)
+                try:
+                    ChunkStore.build_snapshot(src)
+                except type(error):
+                    pass
+                else:
+                    raise AssertionError(f"{type(error).__name__} 应使快照失败")
+
+            # 扫描后被删除的文件不在存档中，跳过即可
+            ChunkStore._chunk_file = failing(FileNotFoundError("文件已被删除"))
+            manifest, chunks = ChunkStore.build_snapshot(src)
+            assert [entry["path"] for entry in manifest["files"]] == ["save_01.dat"]
+        finally:
+            ChunkStore._chunk_file = staticmethod(chunk_file)
+
+
+def test_garbage_collection_keeps_referenced_chunks():
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as tmp, FakeGitHub() as github:
+        git_api = github.client(blob_cache_file=Path(tmp) / "blob_cache.json")
+        store = ChunkStore(git_api)
+        shared = _random_bytes(100 * 1024, 7)
+        (Path(src) / "shared.dat").write_bytes(shared)
+
+        for name, seed in [("2024-01-01_00-00-00", 8), ("2024-01-02_00-00-00", 9)]:
+            (Path(src) / "slot.dat").write_bytes(_random_bytes(100 * 1024, seed))
+            manifest, chunks = ChunkStore.build_snapshot(src)
+            assert store.upload_snapshot(src, manifest, chunks, name, "备份") is not None
+        old_chunks = set(git_api.list_chunk_hashes())
+
+        assert git_api.delete_backup("2024-01-01_00-00-00")
+        assert store.collect_garbage() > 0
+        assert store.collect_garbage() == 0
+
+        # 剩下的快照引用的块（包括两个快照共用的块）仍然存在，可以完整恢复
+        manifest = store.fetch_manifest("2024-01-02_00-00-00")
+        remaining = git_api.list_chunk_hashes()
+        assert remaining < old_chunks
+        assert remaining == {h for entry in manifest["files"] for h in entry["chunks"]}
+        fetched = store.fetch_chunks(manifest)
+        ChunkStore.restore_snapshot(manifest, fetched, Path(tmp) / "restored")
+        assert (Path(tmp) / "restored" / "shared.dat").read_bytes() == shared
+
+
+def test_garbage_collection_gives_up_when_branch_moves():
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as tmp, FakeGitHub() as github:
+        git_api = github.client(blob_cache_file=Path(tmp) / "blob_cache.json")
+        (Path(src) / "slot.dat").write_bytes(_random_bytes(50 * 1024, 10))
+        manifest, chunks = ChunkStore.build_snapshot(src)
+        assert ChunkStore(git_api).upload_snapshot(src, manifest, chunks, "2024-01-01_00-00-00", "备份") is not None
+        assert git_api.delete_backup("2024-01-01_00-00-00")
+
+        # 读取清单之后分支被其他设备更新，基于旧提交得出的删除列表不再可靠
+        builder = git_api.new_commit("清理", base=git_api.get_head())
+        assert git_api.upload_bytes("other.txt", b"other", "其他设备的提交")
+        builder.delete_file(chunk_path(next(iter(chunks))))
+        assert builder.commit() is None
+        assert git_api.list_chunk_hashes() == set(chunks)
+
+
+if __name__ == "__main__":
+    test_chunks_cover_data()
+    test_cut_points_are_stable()
+    test_insert_only_changes_nearby_chunks()
+    test_snapshot_roundtrip()
+    test_unchanged_files_are_not_reread()
+    test_scan_changed_matches_full_scan()
+    test_unreadable_files_fail_the_snapshot()
+    test_garbage_collection_keeps_referenced_chunks()
+    test_garbage_collection_gives_up_when_branch_moves()
+    print("所有分块存储测试通过！")
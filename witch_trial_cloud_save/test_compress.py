@@ -0,0 +1,217 @@
+import sys
+import os
+import random
+import hashlib
+import zipfile
+import tempfile
+from pathlib import Path
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import compress
+from compress import CompressManager, available_codecs, choose_codec
+from delta import DeltaBase, encode_delta, apply_delta, delta_blocks, DELTA_INDEX
+from file_index import TornReadError
+
+
+def _make_save(root):
+    rng = random.Random(7)
+    (Path(root) / "slot").mkdir()
+    (Path(root) / "slot" / "save_01.dat").write_bytes(b"progress " * 20000)
+    (Path(root) / "slot" / "image.png").write_bytes(bytes(rng.getrandbits(8) for _ in range(40000)))
+    (Path(root) / "system.dat").write_bytes(b"x")
+
+
+def _assert_restored(src, dst):
+    for path in ["slot/save_01.dat", "slot/image.png", "system.dat"]:
+        assert (Path(dst) / path).read_bytes() == (Path(src) / path).read_bytes()
+
+
+def test_every_codec_roundtrips():
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as out:
+        _make_save(src)
+        for codec in ["auto"] + available_codecs():
+            zip_path = Path(out) / f"{codec}.zip"
+            zip_path.write_bytes(b"".join(CompressManager.iter_backup(src, codec=codec)))
+            CompressManager.restore_backup(zip_path, Path(out) / codec)
+            _assert_restored(src, Path(out) / codec)
+
+
+def test_large_files_are_streamed():
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as out:
+        _make_save(src)
+        limit = compress.STABLE_READ_LIMIT
+        compress.STABLE_READ_LIMIT = 1024
+        try:
+            zip_path = Path(out) / "backup.zip"
+            zip_path.write_bytes(b"".join(CompressManager.iter_backup(src, block_size=4096)))
+        finally:
+            compress.STABLE_READ_LIMIT = limit
+        CompressManager.restore_backup(zip_path, Path(out) / "restored")
+        _assert_restored(src, Path(out) / "restored")
+
+
+def test_parallel_output_is_deterministic():
+    with tempfile.TemporaryDirectory() as src:
+        _make_save(src)
+        for i in range(6):
+            (Path(src) / f"save_{i:02d}.dat").write_bytes(f"slot {i} ".encode() * 5000)
+        single = b"".join(CompressManager.iter_backup(src, codec="deflate-6", workers=1))
+        parallel = b"".join(CompressManager.iter_backup(src, codec="deflate-6", workers=4))
+        assert single == parallel
+
+
+def test_written_lists_only_archived_files():
+    with tempfile.TemporaryDirectory() as src:
+        _make_save(src)
+        written = []
+        # 扫描后被删除的文件不会写入压缩包
+        paths = ["slot/save_01.dat", "slot/deleted.dat", "system.dat"]
+        b"".join(CompressManager.iter_backup(src, paths=paths, written=written))
+        assert [entry["path"] for entry in written] == ["slot/save_01.dat", "system.dat"]
+        # 哈希在打包时顺便计算
+        assert written[1]["sha256"] == hashlib.sha256(b"x").hexdigest()
+        assert written[1]["size"] == 1
+
+
+def test_torn_read_fails_backup():
+    with tempfile.TemporaryDirectory() as src:
+        _make_save(src)
+
+        def torn(file_path):
+            raise TornReadError(f"文件在读取过程中被修改: {file_path}")
+
+        read_stable = compress.read_stable
+        compress.read_stable = torn
+        try:
+            b"".join(CompressManager.iter_backup(src))
+        except TornReadError:
+            pass
+        else:
+            assert False, "读取失败的文件不能被静默跳过"
+        finally:
+            compress.read_stable = read_stable
+
+
+def test_unknown_compression_method_is_bad_zip():
+    import struct
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as out:
+        _make_save(src)
+        data = bytearray(b"".join(CompressManager.iter_backup(src, codec="store")))
+        # 把 system.dat 的压缩方式改为未知的 99（本地文件头和中央目录中各一处）
+        zip_path = Path(out) / "backup.zip"
+        zip_path.write_bytes(bytes(data))
+        with zipfile.ZipFile(zip_path) as zipf:
+            member = zipf.getinfo("system.dat")
+        struct.pack_into("<H", data, member.header_offset + 8, 99)
+        central = bytes(data).index(b"PK\x01\x02")
+        while data[central:central + 4] == b"PK\x01\x02":
+            name_length, extra_length, comment_length = struct.unpack_from("<HHH", data, central + 28)
+            if bytes(data[central + 46:central + 46 + name_length]) == b"system.dat":
+                struct.pack_into("<H", data, central + 10, 99)
+            central += 46 + name_length + extra_length + comment_length
+        zip_path.write_bytes(bytes(data))
+
+        # 无效的压缩包，调用方按 BadZipFile 处理
+        try:
+            CompressManager.restore_backup(zip_path, Path(out) / "restored")
+        except zipfile.BadZipFile as e:
+            assert "99" in str(e)
+        else:
+            raise AssertionError("未知的压缩方式应当恢复失败")
+        assert not (Path(out) / "restored").exists()
+
+
+def test_incompressible_and_tiny_files_are_stored():
+    rng = random.Random(8)
+    assert choose_codec(bytes(rng.getrandbits(8) for _ in range(60000)), "deflate-9") == "store"
+    assert choose_codec(b"tiny", "auto") == "store"
+    assert choose_codec(b"text " * 10000, "lzma") == "lzma"
+
+
+def test_delta_roundtrip():
+    rng = random.Random(9)
+    base = bytes(rng.getrandbits(8) for _ in range(100000))
+    target = base[:30000] + b"new flag" + base[30010:]
+    delta = encode_delta(base, target)
+    assert len(delta) < len(target) // 10
+    assert apply_delta(base, delta) == target
+
+
+def test_delta_backups_restore_through_chain():
+    rng = random.Random(10)
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as out:
+        save = Path(src) / "save_01.dat"
+        data = bytearray(rng.getrandbits(8) for _ in range(200000))
+        base = DeltaBase(src, store_dir=Path(out) / "base")
+        backups = {}
+        for i in range(3):
+            data[i * 1000:i * 1000 + 4] = b"turn"
+            save.write_bytes(bytes(data))
+            name = f"b{i}"
+            backups[name] = Path(out) / f"{name}.zip"
+            backups[name].write_bytes(b"".join(CompressManager.iter_backup(src, base=base)))
+            base.commit(name)
+        # 第一次备份写入完整文件，之后只保存增量
+        assert backups["b2"].stat().st_size < backups["b0"].stat().st_size // 10
+
+        def resolve_base(name, rel_path, sha256):
+            return CompressManager.read_backup_file(backups[name], rel_path, resolve_base)
+
+        CompressManager.restore_backup(backups["b2"], Path(out) / "restored", resolve_base=resolve_base)
+        assert (Path(out) / "restored" / "save_01.dat").read_bytes() == bytes(data)
+
+
+def test_delta_base_reuses_block_index():
+    rng = random.Random(11)
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as out:
+        save = Path(src) / "save_01.dat"
+        data = bytearray(rng.getrandbits(8) for _ in range(100000))
+        base = DeltaBase(src, store_dir=Path(out) / "base")
+        for i in range(2):
+            data[i * 500:i * 500 + 4] = b"turn"
+            save.write_bytes(bytes(data))
+            b"".join(CompressManager.iter_backup(src, base=base))
+            base.commit(f"b{i}")
+
+        # 计算增量时切分的结果被缓存，下一次备份不再切分基准内容
+        found = base.lookup("save_01.dat")
+        assert found[0] == bytes(data)
+        assert found[3] == delta_blocks(bytes(data))
+        assert base._blocks_path(found[1]).exists()
+        target = bytes(data[:50000]) + b"edit" + bytes(data[50004:])
+        assert encode_delta(found[0], target, found[3]) == encode_delta(found[0], target)
+
+
+def test_large_files_are_not_delta_encoded():
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as out:
+        (Path(src) / "save_01.dat").write_bytes(b"progress " * 20000)
+        base = DeltaBase(src, store_dir=Path(out) / "base")
+        limit = compress.DELTA_MAX_FILE_SIZE
+        compress.DELTA_MAX_FILE_SIZE = 1024
+        try:
+            for name in ["b0", "b1"]:
+                zip_path = Path(out) / f"{name}.zip"
+                zip_path.write_bytes(b"".join(CompressManager.iter_backup(src, base=base)))
+                base.commit(name)
+        finally:
+            compress.DELTA_MAX_FILE_SIZE = limit
+        with zipfile.ZipFile(zip_path) as zipf:
+            assert zipf.namelist() == ["save_01.dat"]
+        assert base.lookup("save_01.dat") is None
+
+
+if __name__ == "__main__":
+    test_every_codec_roundtrips()
+    test_large_files_are_streamed()
+    test_parallel_output_is_deterministic()
+    test_written_lists_only_archived_files()
+    test_torn_read_fails_backup()
+    test_unknown_compression_method_is_bad_zip()
+    test_incompressible_and_tiny_files_are_stored()
+    test_delta_roundtrip()
+    test_delta_backups_restore_through_chain()
+    test_delta_base_reuses_block_index()
+    test_large_files_are_not_delta_encoded()
+    print("所有压缩测试通过！")
@@ -0,0 +1,191 @@
+import sys
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config
+from config import Config, load_key, generate_key, KEY_CACHE_NAME
+
+
+class _AppDataDir:
+    """把应用数据目录换成临时目录，并统计派生密钥的次数"""
+
+    def __enter__(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name)
+        self.derived = 0
+        self._get_app_data_dir = config.get_app_data_dir
+        self._generate_key = config.generate_key
+        config.get_app_data_dir = lambda: self.path
+        config.generate_key = self._count_generate_key
+        return self
+
+    def _count_generate_key(self):
+        self.derived += 1
+        return self._generate_key()
+
+    def __exit__(self, exc_type, exc, tb):
+        config.get_app_data_dir = self._get_app_data_dir
+        config.generate_key = self._generate_key
+        self.tmp.cleanup()
+        return False
+
+    def stored_keys(self):
+        """直接读取数据库中保存的配置项"""
+        conn = sqlite3.connect(str(self.path / "config.db"))
+        try:
+            return {key for key, in conn.execute("SELECT key FROM config")}
+        finally:
+            conn.close()
+
+
+def test_key_is_derived_once_and_cached():
+    with _AppDataDir() as app:
+        key_path = app.path / KEY_CACHE_NAME
+        key = load_key(key_path)
+        assert app.derived == 1
+        assert key_path.read_bytes() == key
+        assert not key_path.with_suffix(".tmp").exists()
+
+        # 之后直接读取缓存
+        assert load_key(key_path) == key
+        assert app.derived == 1
+
+        # 缓存损坏或要求刷新时重新派生
+        key_path.write_bytes(b"broken")
+        assert load_key(key_path) == key
+        assert load_key(key_path, refresh=True) == key
+        assert app.derived == 3
+        assert key_path.read_bytes() == key
+
+
+def test_key_is_loaded_lazily():
+    with _AppDataDir() as app:
+        with Config() as cfg:
+            # 没有保存过配置时不需要密钥
+            assert cfg.get("auto_action") == "none"
+            assert app.derived == 0
+            assert not (app.path / KEY_CACHE_NAME).exists()
+
+
+def test_only_changed_settings_are_written():
+    with _AppDataDir() as app:
+        with Config() as cfg:
+            # 与当前值相同时不写数据库
+            cfg.set("auto_action", "none")
+            assert not cfg.dirty and app.stored_keys() == set()
+            assert app.derived == 0
+
+            cfg.set("github_owner", "owner")
+            assert not cfg.dirty
+            assert app.stored_keys() == {"github_owner"}
+            cfg.set("backup_interval", 10)
+            assert app.stored_keys() == {"github_owner", "backup_interval"}
+            # 密钥只派生一次
+            assert app.derived == 1
+
+        with Config() as cfg:
+            assert cfg.get("github_owner") == "owner"
+            assert cfg.get("backup_interval") == 10
+            assert cfg.get("github_token") == ""
+            assert not cfg.dirty
+            assert app.derived == 1
+
+
+def test_batch_saves_once_at_the_end():
+    with _AppDataDir() as app:
+        with Config() as cfg:
+            with cfg.batch():
+                cfg.set("github_owner", "owner")
+                with cfg.batch():
+                    cfg.set("github_repo", "saves")
+                # 内层结束时还在外层批量修改中，不写数据库
+                assert app.stored_keys() == set()
+                cfg.set("github_token", "token")
+                assert cfg.dirty == {"github_owner", "github_repo", "github_token"}
+                assert app.stored_keys() == set()
+            assert not cfg.dirty
+            assert app.stored_keys() == {"github_owner", "github_repo", "github_token"}
+
+            # 批量修改中出错时，已修改的配置项仍然保存
+            try:
+                with cfg.batch():
+                    cfg.set("auto_action", "pull")
+                    raise ValueError("设置页面出错")
+            except ValueError:
+                pass
+            assert "auto_action" in app.stored_keys()
+
+        with Config() as cfg:
+            assert cfg.get("github_repo") == "saves"
+            assert cfg.get("auto_action") == "pull"
+
+
+def test_database_uses_wal():
+    with _AppDataDir() as app:
+        with Config() as cfg:
+            assert cfg.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            # synchronous=NORMAL
+            assert cfg.conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+            cfg.set("github_owner", "owner")
+            assert (app.path / "config.db-wal").exists()
+
+
+def test_mismatched_cached_key_is_rederived():
+    with _AppDataDir() as app:
+        with Config() as cfg:
+            cfg.set("github_token", "secret")
+
+        # 缓存了格式正确但不匹配的密钥
+        from cryptography.fernet import Fernet
+        key_path = app.path / KEY_CACHE_NAME
+        key_path.write_bytes(Fernet.generate_key())
+        with Config() as cfg:
+            assert cfg.get("github_token") == "secret"
+            assert key_path.read_bytes() == generate_key()
+
+
+def test_corrupt_rows_rederive_the_key_once():
+    with _AppDataDir() as app:
+        with Config() as cfg:
+            cfg.set("github_owner", "owner")
+        assert app.derived == 1
+
+        conn = sqlite3.connect(str(app.path / "config.db"))
+        with conn:
+            for key in ("github_repo", "github_token", "auto_action"):
+                conn.execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (key, "损坏的数据"))
+        conn.close()
+
+        # 缓存的密钥仍然可用：只重新派生一次，损坏的配置项使用默认值
+        with Config() as cfg:
+            assert cfg.get("github_owner") == "owner"
+            assert cfg.get("github_repo") == ""
+            assert cfg.get("auto_action") == "none"
+        assert app.derived == 2
+
+
+def test_close_releases_the_database():
+    with _AppDataDir() as app:
+        cfg = Config()
+        cfg.close()
+        assert cfg.conn is None
+        # 重复关闭不出错
+        cfg.close()
+        assert not hasattr(Config, "__del__")
+
+
+if __name__ == "__main__":
+    test_key_is_derived_once_and_cached()
+    test_key_is_loaded_lazily()
+    test_only_changed_settings_are_written()
+    test_batch_saves_once_at_the_end()
+    test_database_uses_wal()
+    test_mismatched_cached_key_is_rederived()
+    test_corrupt_rows_rederive_the_key_once()
+    test_close_releases_the_database()
+    print("所有配置测试通过！")
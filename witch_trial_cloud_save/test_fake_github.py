@@ -0,0 +1,121 @@
+import sys
+import os
+import tempfile
+from pathlib import Path
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_github import FakeGitHub
+
+
+def _write_backup(root, name, data):
+    zip_path = Path(root) / name / "backup.zip"
+    zip_path.parent.mkdir()
+    zip_path.write_bytes(data)
+    return zip_path
+
+
+def test_backup_roundtrip_against_fake_github():
+    with tempfile.TemporaryDirectory() as tmp, FakeGitHub() as github:
+        git_api = github.client(blob_cache_file=Path(tmp) / "blob_cache.json")
+        assert git_api.list_backups() == []
+
+        # 空仓库先走内容API创建第一个提交，之后走Git数据API
+        first = _write_backup(tmp, "2024-01-01_00-00-00", b"first" * 1000)
+        second = _write_backup(tmp, "2024-01-02_00-00-00", b"second" * 1000)
+        assert git_api.upload_file(first, "备份1", catalog_entry={"name": first.parent.name})
+        assert git_api.upload_file(second, "备份2", catalog_entry={"name": second.parent.name})
+        assert git_api.list_backups() == ["2024-01-02_00-00-00", "2024-01-01_00-00-00"]
+
+        github.reset_stats()
+        output_path = Path(tmp) / "download.zip"
+        assert git_api.download_backup(first.parent.name, output_path)
+        assert output_path.read_bytes() == b"first" * 1000
+        stats = github.snapshot_stats()
+        assert stats["round_trips"] == 2
+        assert stats["bytes_received"] > 5000
+
+        assert git_api.delete_all_backups()
+        assert git_api.list_backups() == []
+        assert git_api.list_backup_dirs() == []
+
+
+def test_injected_faults_are_retried():
+    with tempfile.TemporaryDirectory() as tmp, FakeGitHub() as github:
+        git_api = github.client(token="fault-token", blob_cache_file=Path(tmp) / "blob_cache.json")
+        backup = _write_backup(tmp, "2024-01-01_00-00-00", b"data")
+        assert git_api.upload_file(backup, "备份", catalog_entry={"name": backup.parent.name})
+
+        github.reset_stats()
+        github.fail_next(503)
+        github.fail_next(429, headers={"Retry-After": "0"})
+        catalog = git_api.load_catalog(retry_delay=0.01)
+        assert [entry["name"] for entry in catalog["backups"]] == ["2024-01-01_00-00-00"]
+        assert github.snapshot_stats()["round_trips"] == 3
+
+        # 没有限流响应头的403是权限问题，不重试
+        github.fail_next(403)
+        assert git_api.load_catalog(retry_delay=0.01) is None
+
+
+def test_catalog_keeps_delta_bases():
+    with tempfile.TemporaryDirectory() as tmp, FakeGitHub() as github:
+        git_api = github.client(blob_cache_file=Path(tmp) / "blob_cache.json")
+        base = _write_backup(tmp, "2024-01-01_00-00-00", b"base")
+        delta = _write_backup(tmp, "2024-01-02_00-00-00", b"delta")
+        assert git_api.upload_file(base, "备份1", catalog_entry={"name": base.parent.name})
+        assert git_api.upload_file(delta, "备份2", catalog_entry={"name": delta.parent.name, "delta_base": base.parent.name})
+
+        # 基准备份仍被增量备份引用，不能删除
+        assert not git_api.delete_backup(base.parent.name)
+        assert git_api.list_backups() == [delta.parent.name, base.parent.name]
+
+        # 基准备份已被删除时，以它为基准的增量备份不能提交
+        assert git_api.delete_backup(delta.parent.name)
+        assert git_api.delete_backup(base.parent.name)
+        orphan = _write_backup(tmp, "2024-01-03_00-00-00", b"orphan")
+        assert not git_api.upload_file(orphan, "备份3", catalog_entry={"name": orphan.parent.name, "delta_base": base.parent.name})
+        assert git_api.list_backups() == []
+
+
+def test_catalog_failure_is_not_empty():
+    with tempfile.TemporaryDirectory() as tmp, FakeGitHub() as github:
+        git_api = github.client(blob_cache_file=Path(tmp) / "blob_cache.json")
+        backup = _write_backup(tmp, "2024-01-01_00-00-00", b"data")
+        assert git_api.upload_file(backup, "备份", catalog_entry={"name": backup.parent.name})
+
+        # 读取失败与没有备份不同，不能因此认为云端已清空
+        github.fail_next(403)
+        assert git_api.list_backup_entries() is None
+        github.fail_next(403)
+        assert git_api.list_backups() is None
+        github.fail_next(403)
+        assert not git_api.delete_all_backups()
+        assert git_api.list_backups() == [backup.parent.name]
+
+
+def test_first_upload_fails_without_catalog():
+    with tempfile.TemporaryDirectory() as tmp:
+        backup = _write_backup(tmp, "2024-01-01_00-00-00", b"data")
+        # 基准备份不存在时补写备份目录的提交被放弃
+        entry = {"name": backup.parent.name, "delta_base": "2023-12-31_00-00-00"}
+        uploads = [
+            lambda git_api: git_api.upload_file(backup, "备份", catalog_entry=entry),
+            lambda git_api: git_api.upload_bytes(f"{backup.parent.name}/backup.zip", b"data", "备份", catalog_entry=entry),
+        ]
+        for upload in uploads:
+            with FakeGitHub() as github:
+                git_api = github.client(blob_cache_file=Path(tmp) / "blob_cache.json")
+                # 空仓库先走内容API创建第一个提交，之后补写备份目录；补写失败时不能报告成功
+                assert not upload(git_api)
+                assert git_api.load_catalog()["backups"] == [{"name": backup.parent.name}]
+
+
+if __name__ == "__main__":
+    test_backup_roundtrip_against_fake_github()
+    test_injected_faults_are_retried()
+    test_catalog_keeps_delta_bases()
+    test_catalog_failure_is_not_empty()
+    test_first_upload_fails_without_catalog()
+    print("所有模拟服务器测试通过！")
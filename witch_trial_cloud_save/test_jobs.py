@@ -0,0 +1,183 @@
+import sys
+import os
+import time
+import threading
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from jobs import Job, JobQueue
+
+
+class _Root:
+    """只记录 after() 的假Tk窗口，回调由测试调用 _poll 手动执行"""
+
+    def after(self, ms, callback):
+        pass
+
+
+def _wait_idle(jobs, timeout=5):
+    """等待工作线程执行完所有排队的任务"""
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        with jobs._lock:
+            if not jobs._pending and jobs._running is None:
+                return
+        time.sleep(0.01)
+    raise AssertionError("任务队列没有在限定时间内空闲")
+
+
+def _blocker(jobs):
+    """提交一个等待放行的任务占住工作线程，返回放行用的Event"""
+    started = threading.Event()
+    release = threading.Event()
+
+    def work(job):
+        started.set()
+        release.wait(5)
+
+    jobs.submit(Job(Job.LIST, work))
+    assert started.wait(5)
+    return release
+
+
+def test_duplicate_jobs_are_coalesced():
+    jobs = JobQueue(_Root())
+    try:
+        release = _blocker(jobs)
+        ran = []
+        results = []
+        first = jobs.submit(Job(Job.UPLOAD, lambda job: ran.append("first") or "first",
+                                on_done=lambda value: results.append(("first", value))))
+        second = jobs.submit(Job(Job.UPLOAD, lambda job: ran.append("second") or "second",
+                                 on_done=lambda value: results.append(("second", value))))
+        # 第二次提交合并进排队中的任务，不再单独排队
+        assert second is first
+        assert len(jobs._pending) == 1
+        assert jobs.is_busy(Job.UPLOAD)
+
+        release.set()
+        _wait_idle(jobs)
+        jobs._poll()
+        # 只执行一次，使用最后一次提交的工作函数，结果交给最后一次提交的调用方
+        assert ran == ["second"]
+        assert results == [("second", "second")]
+        assert not jobs.is_busy()
+    finally:
+        jobs.stop()
+
+
+def test_running_job_is_not_coalesced():
+    jobs = JobQueue(_Root())
+    try:
+        started = threading.Event()
+        release = threading.Event()
+        ran = []
+
+        def slow(job):
+            started.set()
+            release.wait(5)
+            ran.append("running")
+
+        running = jobs.submit(Job(Job.UPLOAD, slow))
+        assert started.wait(5)
+        # 执行中的任务可能已经读过旧的存档，新的修改要另外排队
+        queued = jobs.submit(Job(Job.UPLOAD, lambda job: ran.append("queued")))
+        assert queued is not running
+
+        release.set()
+        _wait_idle(jobs)
+        assert ran == ["running", "queued"]
+    finally:
+        jobs.stop()
+
+
+def test_cancelled_jobs_do_not_run_or_report():
+    jobs = JobQueue(_Root())
+    try:
+        started = threading.Event()
+        release = threading.Event()
+        ran = []
+        results = []
+
+        def slow(job):
+            started.set()
+            release.wait(5)
+            ran.append("running")
+            return "stale"
+
+        jobs.submit(Job(Job.PULL, slow, on_done=results.append))
+        assert started.wait(5)
+        jobs.submit(Job(Job.UPLOAD, lambda job: ran.append("upload"), on_done=results.append))
+        jobs.submit(Job(Job.DELETE, lambda job: ran.append("delete") or "deleted", on_done=results.append))
+
+        jobs.cancel(Job.UPLOAD)
+        jobs.cancel(Job.PULL)
+        assert jobs.is_busy(Job.DELETE)
+        assert not jobs.is_busy(Job.UPLOAD) and not jobs.is_busy(Job.PULL)
+
+        # 取消后重新提交的任务不会合并进已取消的任务
+        resubmitted = jobs.submit(Job(Job.UPLOAD, lambda job: ran.append("upload again")))
+        assert not resubmitted.cancelled
+
+        release.set()
+        _wait_idle(jobs)
+        jobs._poll()
+        # 执行中被取消的任务照常结束，但结果被丢弃；排队中被取消的任务不再执行
+        assert ran == ["running", "delete", "upload again"]
+        assert results == ["deleted"]
+    finally:
+        jobs.stop()
+
+
+def test_callbacks_run_on_poll():
+    jobs = JobQueue(_Root())
+    try:
+        main_thread = threading.get_ident()
+        calls = []
+
+        def fail(job):
+            raise ValueError("网络错误")
+
+        def broken_callback(value):
+            raise RuntimeError("回调出错")
+
+        jobs.submit(Job(Job.LIST, lambda job: [1, 2],
+                        on_done=lambda value: calls.append(("done", value, threading.get_ident()))))
+        jobs.submit(Job(Job.UPLOAD, fail,
+                        on_error=lambda e: calls.append(("error", str(e), threading.get_ident()))))
+        jobs.submit(Job(Job.DELETE, lambda job: None, on_done=broken_callback))
+        jobs.submit(Job(Job.PULL, lambda job: "pulled",
+                        on_done=lambda value: calls.append(("done", value, threading.get_ident()))))
+        _wait_idle(jobs)
+        # 工作线程不直接调用回调
+        assert calls == []
+
+        jobs._poll()
+        # 回调按完成顺序在调用 _poll 的线程中执行，一个回调出错不影响后面的回调
+        assert calls == [
+            ("done", [1, 2], main_thread),
+            ("error", "网络错误", main_thread),
+            ("done", "pulled", main_thread),
+        ]
+    finally:
+        jobs.stop()
+
+
+def test_stopped_queue_ignores_new_jobs():
+    jobs = JobQueue(_Root())
+    jobs.stop()
+    ran = []
+    jobs.submit(Job(Job.UPLOAD, lambda job: ran.append("upload")))
+    time.sleep(0.05)
+    assert ran == []
+    assert not jobs.is_busy()
+
+
+if __name__ == "__main__":
+    test_duplicate_jobs_are_coalesced()
+    test_running_job_is_not_coalesced()
+    test_cancelled_jobs_do_not_run_or_report()
+    test_callbacks_run_on_poll()
+    test_stopped_queue_ignores_new_jobs()
+    print("所有任务队列测试通过！")
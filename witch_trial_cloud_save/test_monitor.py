@@ -0,0 +1,232 @@
+import sys
+import os
+import time
+import tempfile
+import threading
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from watchdog.events import FileModifiedEvent, FileCreatedEvent, FileMovedEvent, DirCreatedEvent, DirModifiedEvent
+from monitor import SaveMonitor, SaveEventHandler, MAX_CHANGED_PATHS
+
+QUIET = 0.1
+
+
+class _Recorder:
+    """记录回调的参数和时间"""
+
+    def __init__(self):
+        self.calls = []
+        self.fired = threading.Event()
+
+    def __call__(self, changed):
+        self.calls.append((time.monotonic(), None if changed is None else set(changed)))
+        self.fired.set()
+
+
+def _write(save_dir, rel_path, data=b"save"):
+    path = os.path.join(save_dir, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_events_within_quiet_window_trigger_once():
+    with tempfile.TemporaryDirectory() as save_dir:
+        recorder = _Recorder()
+        handler = SaveEventHandler(recorder, save_dir=save_dir, quiet_seconds=QUIET)
+        first = _write(save_dir, "slot1/data.sav")
+        second = _write(save_dir, "slot2/data.sav")
+
+        started = time.monotonic()
+        # 持续 3 个静默窗口的连续写入
+        while time.monotonic() - started < QUIET * 3:
+            handler.dispatch(FileModifiedEvent(first))
+            handler.dispatch(FileCreatedEvent(second))
+            time.sleep(QUIET / 5)
+        last_event = time.monotonic()
+
+        assert recorder.fired.wait(5)
+        time.sleep(QUIET * 3)
+        assert len(recorder.calls) == 1
+        fired_at, changed = recorder.calls[0]
+        # 最后一次事件之后至少静默一个窗口才触发
+        assert fired_at - last_event >= QUIET
+        assert changed == {"slot1/data.sav", "slot2/data.sav"}
+
+
+def test_waits_for_writes_that_produce_no_events():
+    with tempfile.TemporaryDirectory() as save_dir:
+        recorder = _Recorder()
+        handler = SaveEventHandler(recorder, save_dir=save_dir, quiet_seconds=QUIET)
+        path = _write(save_dir, "slot1/data.sav")
+        handler.dispatch(FileModifiedEvent(path))
+
+        # 事件之后文件仍在增长，但没有新的事件（事件滞后或被合并）
+        writes_done = threading.Event()
+
+        def keep_writing():
+            for i in range(8):
+                with open(path, "ab") as f:
+                    f.write(b"x" * 100)
+                time.sleep(QUIET / 2)
+            writes_done.set()
+
+        writer = threading.Thread(target=keep_writing)
+        writer.start()
+        assert recorder.fired.wait(5)
+        writer.join()
+        # 大小和修改时间稳定后才触发，不会备份写了一半的存档
+        assert writes_done.is_set()
+        assert len(recorder.calls) == 1
+        assert recorder.calls[0][1] == {"slot1/data.sav"}
+
+
+def test_too_many_paths_fall_back_to_full_scan():
+    with tempfile.TemporaryDirectory() as save_dir:
+        recorder = _Recorder()
+        # 静默窗口放宽，避免记录路径期间计时器到期
+        handler = SaveEventHandler(recorder, save_dir=save_dir, quiet_seconds=QUIET * 5)
+        for i in range(MAX_CHANGED_PATHS + 1):
+            handler.dispatch(FileModifiedEvent(os.path.join(save_dir, f"slot{i}.sav")))
+        # 超出上限后不再保存路径
+        assert handler._overflow and not handler._changed
+        handler.dispatch(FileModifiedEvent(os.path.join(save_dir, "more.sav")))
+        assert not handler._changed
+
+        assert recorder.fired.wait(5)
+        assert recorder.calls[0][1] is None
+
+        # 触发后重新开始记录路径
+        recorder.fired.clear()
+        _write(save_dir, "slot0.sav")
+        handler.dispatch(FileModifiedEvent(os.path.join(save_dir, "slot0.sav")))
+        assert recorder.fired.wait(5)
+        assert recorder.calls[1][1] == {"slot0.sav"}
+
+
+def test_directory_events():
+    with tempfile.TemporaryDirectory() as save_dir:
+        recorder = _Recorder()
+        handler = SaveEventHandler(recorder, save_dir=save_dir, quiet_seconds=QUIET)
+        # 目录的修改事件只是附带事件，不触发备份
+        handler.dispatch(DirModifiedEvent(os.path.join(save_dir, "slot1")))
+        assert not recorder.fired.wait(QUIET * 3)
+
+        # 新建的目录中的文件不一定各自产生事件，需要完整扫描
+        os.makedirs(os.path.join(save_dir, "slot2"))
+        handler.dispatch(DirCreatedEvent(os.path.join(save_dir, "slot2")))
+        handler.dispatch(FileModifiedEvent(os.path.join(save_dir, "slot1", "data.sav")))
+        assert recorder.fired.wait(5)
+        assert recorder.calls == [(recorder.calls[0][0], None)]
+
+
+def test_moves_and_ignored_files():
+    with tempfile.TemporaryDirectory() as save_dir:
+        recorder = _Recorder()
+        handler = SaveEventHandler(recorder, save_dir=save_dir, quiet_seconds=QUIET, ignore=("*.tmp",))
+        handler.dispatch(FileModifiedEvent(os.path.join(save_dir, "data.sav.tmp")))
+        handler.dispatch(FileModifiedEvent(os.path.join(os.path.dirname(save_dir), "elsewhere.sav")))
+        assert not recorder.fired.wait(QUIET * 3)
+
+        # 游戏先写临时文件再改名：只记录改名后的路径
+        _write(save_dir, "data.sav")
+        handler.dispatch(FileMovedEvent(os.path.join(save_dir, "data.sav.tmp"), os.path.join(save_dir, "data.sav")))
+        assert recorder.fired.wait(5)
+        assert recorder.calls[0][1] == {"data.sav"}
+
+
+def test_cancel_discards_pending_events():
+    with tempfile.TemporaryDirectory() as save_dir:
+        recorder = _Recorder()
+        handler = SaveEventHandler(recorder, save_dir=save_dir, quiet_seconds=QUIET)
+        handler.dispatch(FileModifiedEvent(_write(save_dir, "data.sav")))
+        handler.cancel()
+        assert not recorder.fired.wait(QUIET * 3)
+        assert not handler._changed
+
+
+def test_pause_keeps_pending_changes():
+    with tempfile.TemporaryDirectory() as save_dir:
+        recorder = _Recorder()
+        handler = SaveEventHandler(recorder, save_dir=save_dir, quiet_seconds=QUIET)
+        handler.dispatch(FileModifiedEvent(_write(save_dir, "slot1/data.sav")))
+        handler.pause()
+        # 暂停期间停止计时，也不因滞后到达的事件重新计时
+        handler.dispatch(FileModifiedEvent(_write(save_dir, "slot2/data.sav")))
+        assert not recorder.fired.wait(QUIET * 3)
+
+        resumed = time.monotonic()
+        handler.resume()
+        assert recorder.fired.wait(5)
+        fired_at, changed = recorder.calls[0]
+        assert fired_at - resumed >= QUIET
+        assert changed == {"slot1/data.sav", "slot2/data.sav"}
+
+        # 没有待备份的变化时恢复不会触发
+        recorder.fired.clear()
+        handler.pause()
+        handler.resume()
+        assert not recorder.fired.wait(QUIET * 3)
+
+
+def test_monitor_pause_backs_up_earlier_edits():
+    with tempfile.TemporaryDirectory() as save_dir:
+        recorder = _Recorder()
+        monitor = SaveMonitor(save_dir, recorder, quiet_seconds=0.5)
+        assert monitor.start()
+        try:
+            _write(save_dir, "data.sav")
+            # 等文件系统事件送达，但还在静默窗口内
+            deadline = time.monotonic() + 5
+            while not monitor.event_handler._changed and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert "data.sav" in monitor.event_handler._changed
+
+            # 恢复存档前暂停监控：暂停前的修改不能丢失
+            monitor.pause()
+            assert not recorder.fired.wait(1.0)
+            monitor.resume()
+            assert recorder.fired.wait(5)
+            assert "data.sav" in recorder.calls[0][1]
+
+            # 退出时停止监控，丢弃尚未触发的备份
+            recorder.fired.clear()
+            _write(save_dir, "data.sav", b"changed")
+            deadline = time.monotonic() + 5
+            while not monitor.event_handler._changed and time.monotonic() < deadline:
+                time.sleep(0.01)
+            monitor.stop()
+            assert not recorder.fired.wait(1.0)
+        finally:
+            monitor.stop()
+
+
+def test_continuous_writes_trigger_after_max_wait():
+    with tempfile.TemporaryDirectory() as save_dir:
+        recorder = _Recorder()
+        handler = SaveEventHandler(recorder, save_dir=save_dir, quiet_seconds=QUIET, max_wait=QUIET * 3)
+        path = _write(save_dir, "data.sav")
+        started = time.monotonic()
+        while not recorder.fired.is_set() and time.monotonic() - started < 5:
+            handler.dispatch(FileModifiedEvent(path))
+            time.sleep(QUIET / 5)
+        # 持续写入时不会无限推迟备份
+        assert recorder.fired.is_set()
+        assert recorder.calls[0][0] - started < QUIET * 6
+        handler.cancel()
+
+
+if __name__ == "__main__":
+    test_events_within_quiet_window_trigger_once()
+    test_waits_for_writes_that_produce_no_events()
+    test_too_many_paths_fall_back_to_full_scan()
+    test_directory_events()
+    test_moves_and_ignored_files()
+    test_cancel_discards_pending_events()
+    test_pause_keeps_pending_changes()
+    test_monitor_pause_backs_up_earlier_edits()
+    test_continuous_writes_trigger_after_max_wait()
+    print("所有存档监控测试通过！")
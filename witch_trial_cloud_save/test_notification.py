@@ -4,24 +4,162 @@ import os
 # 添加当前目录到Python路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from notification import Notifier
+import time
+from notification import Notifier, NotificationDispatcher, NotifyHelper
 
-# 测试通知功能
-print("测试通知功能...")
 
-# 测试备份成功通知
-print("\n1. 测试备份成功通知:")
-result = Notifier.backup_success()
-print(f"备份成功通知结果: {result}")
+def test_dispatcher_coalesces_without_blocking():
+    shown = []
+    calls = {"broken": 0}
 
-# 测试恢复成功通知
-print("\n2. 测试恢复成功通知:")
-result = Notifier.restore_success()
-print(f"恢复成功通知结果: {result}")
+    def broken(title, message):
+        calls["broken"] += 1
+        raise OSError("不支持")
 
-# 测试自定义错误通知
-print("\n3. 测试错误通知:")
-result = Notifier.error("测试错误消息")
-print(f"错误通知结果: {result}")
+    def working(title, message):
+        time.sleep(0.2)
+        shown.append((title, message))
+        return True
 
-print("\n所有通知测试完成！")
\ No newline at end of file
+    dispatcher = NotificationDispatcher([("broken", broken), ("working", working)], coalesce_window=0.2, min_interval=0)
+    started = time.time()
+    for _ in range(5):
+        dispatcher.submit("备份成功", "存档已成功备份到云端")
+    dispatcher.submit("操作失败", "上传失败")
+    # 提交通知不等待显示
+    assert time.time() - started < 0.1
+    assert dispatcher.flush(timeout=5)
+    assert shown == [("备份成功", "存档已成功备份到云端（共 5 次）"), ("操作失败", "上传失败")]
+    assert calls["broken"] == 2
+    assert dispatcher.working == "working"
+
+    # 连续失败 3 次后暂停使用
+    dispatcher.submit("恢复成功", "存档已从云端成功恢复")
+    assert dispatcher.flush(timeout=5)
+    dispatcher.submit("恢复成功", "存档已从云端成功恢复")
+    assert dispatcher.flush(timeout=5)
+    assert calls["broken"] == 3
+    assert len(shown) == 4
+
+
+def test_transient_failure_keeps_preferred_backend():
+    shown = []
+    calls = {"helper": 0}
+
+    def helper(title, message):
+        # 第一次调用时常驻进程正在重启
+        calls["helper"] += 1
+        if calls["helper"] == 1:
+            return False
+        shown.append(("helper", message))
+        return True
+
+    def fallback(title, message):
+        shown.append(("fallback", message))
+        return True
+
+    dispatcher = NotificationDispatcher([("helper", helper), ("fallback", fallback)], coalesce_window=0, min_interval=0)
+    for message in ("第一条", "第二条"):
+        dispatcher.submit("备份成功", message)
+        assert dispatcher.flush(timeout=5)
+    # 偶尔失败一次不影响之后优先使用
+    assert shown == [("fallback", "第一条"), ("helper", "第二条")]
+    assert dispatcher.working == "helper"
+    assert not dispatcher.failures
+
+
+def test_disabled_backend_is_retried_after_cooldown():
+    calls = {"flaky": 0}
+    healthy = {"value": False}
+
+    def flaky(title, message):
+        calls["flaky"] += 1
+        return healthy["value"]
+
+    dispatcher = NotificationDispatcher([("flaky", flaky)], coalesce_window=0, min_interval=0,
+                                        max_failures=2, failure_cooldown=0.3)
+    for _ in range(3):
+        dispatcher.submit("备份成功", "存档已成功备份到云端")
+        assert dispatcher.flush(timeout=5)
+    # 第 3 条通知时已暂停使用
+    assert calls["flaky"] == 2
+
+    time.sleep(0.35)
+    healthy["value"] = True
+    dispatcher.submit("备份成功", "存档已成功备份到云端")
+    assert dispatcher.flush(timeout=5)
+    assert calls["flaky"] == 3
+    assert dispatcher.working == "flaky" and not dispatcher.failures and not dispatcher.disabled_until
+
+
+# 代替 PowerShell 的常驻进程：回复 ok，消息为 error 时报告错误，为 hang 时不回复，为 exit 时退出
+_FAKE_HELPER = r"""
+import sys, json, time, base64
+for line in sys.stdin:
+    item = json.loads(base64.b64decode(line))
+    if item["message"] == "hang":
+        time.sleep(60)
+    if item["message"] == "exit":
+        sys.exit(1)
+    sys.stdout.write("error 不支持\n" if item["message"] == "error" else "ok\n")
+    sys.stdout.flush()
+"""
+
+
+def test_helper_waits_for_ack():
+    helper = NotifyHelper(command=[sys.executable, "-c", _FAKE_HELPER], ack_timeout=2)
+    try:
+        assert helper("备份成功", "存档已成功备份到云端")
+        process = helper.process
+        assert helper("备份成功", "第二条")
+        # 同一个进程显示多条通知
+        assert helper.process is process
+
+        # 报告错误时保留进程
+        assert not helper("备份成功", "error")
+        assert helper.process is process
+
+        # 进程退出后下一条通知重新启动
+        assert not helper("备份成功", "exit")
+        assert helper.process is None
+        assert helper("备份成功", "重新启动")
+        assert helper.process is not process
+
+        # 没有响应的进程被结束
+        helper.ack_timeout = 0.3
+        process = helper.process
+        started = time.time()
+        assert not helper("备份成功", "hang")
+        assert time.time() - started < 2.5
+        assert helper.process is None and process.poll() is not None
+    finally:
+        helper.close()
+
+
+if __name__ == "__main__":
+    # 测试通知功能
+    print("测试通知功能...")
+
+    # 测试备份成功通知
+    print("\n1. 测试备份成功通知:")
+    result = Notifier.backup_success()
+    print(f"备份成功通知结果: {result}")
+
+    # 测试恢复成功通知
+    print("\n2. 测试恢复成功通知:")
+    result = Notifier.restore_success()
+    print(f"恢复成功通知结果: {result}")
+
+    # 测试自定义错误通知
+    print("\n3. 测试错误通知:")
+    result = Notifier.error("测试错误消息")
+    print(f"错误通知结果: {result}")
+
+    # 通知在后台线程中显示，等待显示完成
+    Notifier.dispatcher().flush(timeout=15)
+
+    test_dispatcher_coalesces_without_blocking()
+    test_transient_failure_keeps_preferred_backend()
+    test_disabled_backend_is_retried_after_cooldown()
+    test_helper_waits_for_ack()
+    print("\n所有通知测试完成！")
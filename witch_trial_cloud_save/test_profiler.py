@@ -0,0 +1,31 @@
+import sys
+import os
+import tempfile
+from pathlib import Path
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from compress import CompressManager
+from profiler import ProfileCapture
+
+
+def test_capture_writes_profile_and_allocation_report():
+    with tempfile.TemporaryDirectory() as tmp:
+        save = Path(tmp) / "save"
+        save.mkdir()
+        (save / "save_01.dat").write_bytes(os.urandom(256 * 1024))
+
+        with ProfileCapture("upload", output_dir=Path(tmp) / "profiles") as capture:
+            data = b"".join(CompressManager.iter_backup(save))
+        assert data
+
+        assert capture.prof_path.stat().st_size > 0
+        report = capture.report_path.read_text(encoding="utf-8")
+        assert "峰值内存分配" in report
+        assert "iter_backup" in report
+
+
+if __name__ == "__main__":
+    test_capture_writes_profile_and_allocation_report()
+    print("所有性能分析测试通过！")
@@ -0,0 +1,92 @@
+import sys
+import os
+import zipfile
+import tempfile
+from pathlib import Path
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from compress import CompressManager
+from restore_stage import RestoreStage, recover_restore
+
+
+def _make_save(root):
+    (Path(root) / "slot").mkdir(parents=True)
+    (Path(root) / "slot" / "save_01.dat").write_bytes(b"progress " * 2000)
+    (Path(root) / "system.dat").write_bytes(b"settings")
+
+
+def test_identical_restore_is_noop_and_only_changed_files_are_written():
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as out:
+        _make_save(src)
+        zip_path = Path(out) / "backup.zip"
+        zip_path.write_bytes(b"".join(CompressManager.iter_backup(src)))
+
+        save = Path(out) / "save"
+        _make_save(save)
+        inode = os.stat(save / "system.dat").st_ino
+        assert CompressManager.restore_backup(zip_path, save) is False
+        assert os.stat(save / "system.dat").st_ino == inode
+
+        (save / "slot" / "save_01.dat").write_bytes(b"changed")
+        (save / "extra.tmp").write_bytes(b"x")
+        assert CompressManager.restore_backup(zip_path, save) is True
+        assert (save / "slot" / "save_01.dat").read_bytes() == b"progress " * 2000
+        assert not (save / "extra.tmp").exists()
+        assert sorted(os.listdir(out)) == ["backup.zip", "save"]
+
+
+def test_failed_restore_keeps_current_save():
+    with tempfile.TemporaryDirectory() as out:
+        save = Path(out) / "save"
+        _make_save(save)
+        try:
+            with RestoreStage(save) as stage:
+                stage.write("system.dat", b"half")
+                raise ValueError("下载中断")
+        except ValueError:
+            pass
+        assert (save / "system.dat").read_bytes() == b"settings"
+        assert os.listdir(out) == ["save"]
+
+
+def test_corrupt_archive_keeps_current_save():
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as out:
+        _make_save(src)
+        data = bytearray(b"".join(CompressManager.iter_backup(src, codec="store")))
+        offset = bytes(data).index(b"progress progress")
+        data[offset] ^= 0xFF
+        zip_path = Path(out) / "backup.zip"
+        zip_path.write_bytes(bytes(data))
+
+        save = Path(out) / "save"
+        (save / "slot").mkdir(parents=True)
+        (save / "slot" / "save_01.dat").write_bytes(b"current")
+        try:
+            CompressManager.restore_backup(zip_path, save, workers=4)
+            assert False, "损坏的压缩包应当恢复失败"
+        except zipfile.BadZipFile:
+            pass
+        assert (save / "slot" / "save_01.dat").read_bytes() == b"current"
+        assert sorted(os.listdir(out)) == ["backup.zip", "save"]
+
+
+def test_recover_after_interrupted_swap():
+    with tempfile.TemporaryDirectory() as out:
+        save = Path(out) / "save"
+        _make_save(save)
+        # 模拟在两次重命名之间退出：旧存档已移走，新存档尚未换入
+        os.rename(save, Path(out) / ".save.restore-old")
+        (Path(out) / ".save.restore").mkdir()
+        recover_restore(save)
+        assert (save / "system.dat").read_bytes() == b"settings"
+        assert os.listdir(out) == ["save"]
+
+
+if __name__ == "__main__":
+    test_identical_restore_is_noop_and_only_changed_files_are_written()
+    test_failed_restore_keeps_current_save()
+    test_corrupt_archive_keeps_current_save()
+    test_recover_after_interrupted_swap()
+    print("所有恢复测试通过！")
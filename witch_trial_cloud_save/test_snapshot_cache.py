@@ -0,0 +1,68 @@
+import sys
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from snapshot_cache import SnapshotCache
+from file_index import FileIndex
+
+
+def test_restore_from_cache_and_lru_eviction():
+    with tempfile.TemporaryDirectory() as save, tempfile.TemporaryDirectory() as cache_dir, \
+            tempfile.TemporaryDirectory() as restored:
+        cache = SnapshotCache(cache_dir, max_bytes=25000)
+        (Path(save) / "slot").mkdir()
+        (Path(save) / "system.dat").write_bytes(b"s" * 1000)
+        for i in range(3):
+            (Path(save) / "slot" / "save_01.dat").write_bytes(bytes([i]) * 10000)
+            assert cache.put(f"b{i}", save)
+
+        # 容量只够两个备份，最久未使用的 b0 被淘汰，相同的 system.dat 只存一份
+        assert cache.get("b0") is None
+        entries = cache.get("b1")
+        assert entries is not None
+        assert cache.total_size() == 21000
+
+        cache.restore(entries, restored)
+        assert (Path(restored) / "slot" / "save_01.dat").read_bytes() == bytes([1]) * 10000
+        assert (Path(restored) / "system.dat").read_bytes() == b"s" * 1000
+        mtime_ns = os.stat(Path(restored) / "system.dat").st_mtime_ns
+        assert mtime_ns == next(e for e in entries if e["path"] == "system.dat")["mtime_ns"]
+
+        # b1 刚被使用过，再加入新备份时淘汰 b2
+        (Path(save) / "slot" / "save_01.dat").write_bytes(b"\x09" * 10000)
+        assert cache.put("b3", save)
+        assert cache.get("b2") is None
+        assert cache.get("b1") is not None
+
+        cache.discard("b1")
+        assert cache.get("b1") is None
+        assert len(os.listdir(Path(cache_dir) / "objects")) == 2
+        cache.close()
+
+
+def test_connections_are_closed_by_owning_thread():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        opened = []
+
+        def work():
+            # sqlite连接只能在创建它的线程中关闭，用完在工作线程中关闭
+            with SnapshotCache(cache_dir) as cache, FileIndex(Path(cache_dir) / "file_index.db") as index:
+                opened.extend([cache, index])
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+        assert [obj.conn for obj in opened] == [None, None]
+        # 垃圾回收可能发生在任意线程，不能在 __del__ 中访问连接
+        assert not hasattr(SnapshotCache, "__del__") and not hasattr(FileIndex, "__del__")
+
+
+if __name__ == "__main__":
+    test_restore_from_cache_and_lru_eviction()
+    test_connections_are_closed_by_owning_thread()
+    print("所有缓存测试通过！")
@@ -0,0 +1,93 @@
+import sys
+import os
+import time
+import heapq
+import tempfile
+import threading
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stall_detector import StallDetector, percentile
+
+
+class _EventLoop:
+    """只实现 after() 的单线程事件循环，代替测试环境中无法创建的Tk窗口"""
+
+    def __init__(self):
+        self.timers = []
+        self.count = 0
+
+    def after(self, ms, callback):
+        self.count += 1
+        heapq.heappush(self.timers, (time.perf_counter() + ms / 1000, self.count, callback))
+
+    def run(self, seconds):
+        end = time.perf_counter() + seconds
+        while self.timers and time.perf_counter() < end:
+            due, _, callback = self.timers[0]
+            wait = min(due, end) - time.perf_counter()
+            if due > time.perf_counter():
+                time.sleep(max(wait, 0))
+                continue
+            heapq.heappop(self.timers)
+            callback()
+
+
+def _blocking_call():
+    time.sleep(0.4)
+
+
+def test_stall_is_logged_with_main_thread_stack():
+    with tempfile.TemporaryDirectory() as tmp:
+        loop = _EventLoop()
+        detector = StallDetector(loop, threshold=0.15, interval=0.02, log_dir=tmp)
+        detector.start()
+        loop.run(0.2)
+        loop.after(0, _blocking_call)
+        loop.run(0.6)
+        detector.stop()
+
+        stats = detector.stats()
+        assert stats["stalls"] == 1
+        assert stats["max_ms"] >= 300
+        assert stats["p50_ms"] < 150
+        log = open(os.path.join(tmp, "stalls.log"), encoding="utf-8").read()
+        assert "界面卡顿" in log and "_blocking_call" in log
+        assert "界面响应" in log
+
+
+def test_stall_log_is_written_off_the_main_thread():
+    with tempfile.TemporaryDirectory() as tmp:
+        loop = _EventLoop()
+        detector = StallDetector(loop, threshold=0.15, interval=0.02, log_dir=tmp)
+        writers = []
+        log = detector._log
+
+        def recording_log(message):
+            writers.append((threading.get_ident(), message))
+            log(message)
+
+        detector._log = recording_log
+        detector.start()
+        loop.run(0.1)
+        loop.after(0, _blocking_call)
+        loop.run(0.5)
+        stalls = [ident for ident, message in writers if message.startswith("界面卡顿")]
+        # 卡顿日志由后台线程写入，不占用被检测的主线程
+        assert stalls and threading.get_ident() not in stalls
+        detector.stop()
+        assert detector.stats()["stalls"] == 1
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2, 4], 50) == 2
+    assert percentile(list(range(1, 101)), 99) == 99
+
+
+if __name__ == "__main__":
+    test_stall_is_logged_with_main_thread_stack()
+    test_stall_log_is_written_off_the_main_thread()
+    test_percentile()
+    print("所有卡顿检测测试通过！")
@@ -0,0 +1,37 @@
+import sys
+import os
+import json
+import subprocess
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import startup
+
+_CHECK = """
+import sys, json, startup
+import gui
+print(json.dumps({
+    "import": startup.mark("import"),
+    "loaded": [name for name in startup.DEFERRED_MODULES if name in sys.modules]
+}))
+"""
+
+
+def test_startup_import_budget():
+    # 在新进程中导入界面模块，与 main.py 启动时的情况一致
+    output = subprocess.run(
+        [sys.executable, "-c", _CHECK],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    assert result["loaded"] == []
+    assert result["import"] < startup.IMPORT_BUDGET
+
+
+if __name__ == "__main__":
+    test_startup_import_budget()
+    print("启动耗时测试通过！")
@@ -0,0 +1,52 @@
+import sys
+import os
+import tempfile
+from pathlib import Path
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tracing
+from fake_github import FakeGitHub
+
+
+def test_disabled_tracing_is_noop():
+    tracing.configure(False)
+    assert tracing.span("scan") is tracing.span("compress")
+    assert list(tracing.traced_iter("compress", [b"a", b"b"])) == [b"a", b"b"]
+    assert tracing.current() is None
+
+
+def test_spans_nest_and_rotate():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = tracing.configure(True, trace_dir=tmp, max_bytes=4096, backup_count=2)
+        try:
+            with FakeGitHub() as github:
+                git_api = github.client(token="trace-token", blob_cache_file=Path(tmp) / "blob_cache.json")
+                with tracing.span("backup") as root:
+                    stream = lambda: tracing.traced_iter("compress", iter([b"x" * 1000, b"y" * 1000]))
+                    assert git_api.upload_stream("2024-01-01_00-00-00/backup.zip", stream, "备份")
+                    github.fail_next(503)
+                    assert git_api.list_backup_dirs(retry_delay=0.01) == ["2024-01-01_00-00-00"]
+
+            records = tracing.load(path)
+            spans = [r for r in records if r["trace"] == root.id]
+            names = {r["name"] for r in spans}
+            assert {"backup", "http", "encode", "compress"} <= names
+            compress = next(r for r in spans if r["name"] == "compress")
+            assert compress["bytes"] == 2000
+            assert any(r["name"] == "http" and r.get("retries") == 1 for r in spans)
+            assert "backup:" in tracing.summarize(records, trace=root.id)
+
+            for _ in range(200):
+                with tracing.span("scan", files=1):
+                    pass
+            assert sorted(name for name in os.listdir(tmp) if name.startswith("trace")) == ["trace.jsonl", "trace.jsonl.1", "trace.jsonl.2"]
+        finally:
+            tracing.configure(False)
+
+
+if __name__ == "__main__":
+    test_disabled_tracing_is_noop()
+    test_spans_nest_and_rotate()
+    print("所有耗时追踪测试通过！")
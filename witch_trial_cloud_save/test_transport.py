@@ -0,0 +1,183 @@
+import sys
+import os
+import time
+import random
+import socket
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+from fake_github import FakeGitHub
+from transport import HttpTransport, CircuitOpenError, get_transport
+
+# 空仓库的内容列表请求，正常返回404
+PATH = "/repos/bench/saves/contents/"
+
+
+def _transport(**kwargs):
+    kwargs.setdefault("retry_delay", 0.01)
+    return HttpTransport(**kwargs)
+
+
+def _response(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return response
+
+
+def _closed_port_url():
+    """一个没有服务在监听的本机地址"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}{PATH}"
+
+
+def test_server_errors_are_retried():
+    with FakeGitHub() as github:
+        transport = _transport()
+        github.fail_next(503)
+        github.fail_next(502)
+        response = transport.request("GET", github.url + PATH)
+        assert response.status_code == 404
+        assert github.snapshot_stats()["round_trips"] == 3
+
+        # 重试耗尽时返回最后一次的错误响应
+        github.reset_stats()
+        github.fail_next(500, count=3)
+        response = transport.request("GET", github.url + PATH)
+        assert response.status_code == 500
+        assert github.snapshot_stats()["round_trips"] == 3
+
+        # 客户端错误不重试
+        github.reset_stats()
+        github.fail_next(422)
+        assert transport.request("GET", github.url + PATH).status_code == 422
+        assert github.snapshot_stats()["round_trips"] == 1
+        transport.close()
+
+
+def test_connection_errors_are_retried_then_raised():
+    transport = _transport(max_retries=3)
+    attempts = []
+    send = transport.session.request
+
+    def counting_request(*args, **kwargs):
+        attempts.append(time.perf_counter())
+        return send(*args, **kwargs)
+
+    transport.session.request = counting_request
+    try:
+        transport.request("GET", _closed_port_url(), timeout=1)
+    except requests.exceptions.ConnectionError as e:
+        assert not isinstance(e, CircuitOpenError)
+    else:
+        raise AssertionError("无法连接时应抛出ConnectionError")
+    assert len(attempts) == 3
+    transport.close()
+
+
+def test_backoff_grows_exponentially_with_jitter():
+    transport = _transport(retry_delay=1.0, max_delay=5.0)
+    random.seed(1)
+    for attempt, (low, high) in enumerate([(0.5, 1.0), (1.0, 2.0), (2.0, 4.0), (2.5, 5.0), (2.5, 5.0)]):
+        delays = [transport._backoff(attempt, 1.0) for _ in range(200)]
+        assert low <= min(delays) and max(delays) <= high
+        # 带抖动，不是固定的等待时间
+        assert max(delays) - min(delays) > (high - low) / 2
+
+
+def test_rate_limit_wait():
+    transport = _transport(retry_delay=1.0, max_delay=30.0)
+    assert transport._rate_limit_wait(_response(200), 0, 1.0) is None
+    assert transport._rate_limit_wait(_response(503), 0, 1.0) is None
+    assert transport._rate_limit_wait(_response(429, {"Retry-After": "7"}), 0, 1.0) == 7.0
+    assert transport._rate_limit_wait(_response(403, {"Retry-After": "3"}), 0, 1.0) == 3.0
+
+    reset = time.time() + 20
+    wait = transport._rate_limit_wait(_response(403, {"X-RateLimit-Remaining": "0",
+                                                     "X-RateLimit-Reset": str(reset)}), 0, 1.0)
+    assert 20 <= wait <= 21.5
+    # 重置时间已过，稍等一秒
+    wait = transport._rate_limit_wait(_response(403, {"X-RateLimit-Remaining": "0",
+                                                     "X-RateLimit-Reset": str(time.time() - 5)}), 0, 1.0)
+    assert 0.9 <= wait <= 1.1
+
+    # 没有给出等待时间的429按指数退避，403权限错误不重试
+    assert 2.0 <= transport._rate_limit_wait(_response(429), 2, 1.0) <= 4.0
+    assert transport._rate_limit_wait(_response(403), 0, 1.0) is None
+
+
+def test_rate_limited_requests_wait_and_retry():
+    with FakeGitHub() as github:
+        transport = _transport(failure_threshold=1)
+        github.fail_next(429, headers={"Retry-After": "0.2"})
+        started = time.perf_counter()
+        response = transport.request("GET", github.url + PATH)
+        assert response.status_code == 404
+        assert time.perf_counter() - started >= 0.2
+        assert github.snapshot_stats()["round_trips"] == 2
+        # 限流不计入熔断
+        assert transport._consecutive_failures == 0 and not transport._open_until
+
+        # 需要等待太久时直接返回限流响应
+        github.reset_stats()
+        transport.max_rate_limit_wait = 1
+        github.fail_next(429, headers={"Retry-After": "120"})
+        started = time.perf_counter()
+        assert transport.request("GET", github.url + PATH).status_code == 429
+        assert time.perf_counter() - started < 1
+        assert github.snapshot_stats()["round_trips"] == 1
+
+        # 没有限流响应头的403是权限错误
+        github.reset_stats()
+        github.fail_next(403)
+        assert transport.request("GET", github.url + PATH).status_code == 403
+        assert github.snapshot_stats()["round_trips"] == 1
+        transport.close()
+
+
+def test_circuit_breaker_opens_and_recovers():
+    with FakeGitHub() as github:
+        transport = _transport(max_retries=1, failure_threshold=2, cooldown=0.3)
+        github.fail_next(503, count=2)
+        assert transport.request("GET", github.url + PATH).status_code == 503
+        assert transport.request("GET", github.url + PATH).status_code == 503
+
+        # 熔断期间请求不发出，直接失败
+        github.reset_stats()
+        try:
+            transport.request("GET", github.url + PATH)
+        except CircuitOpenError:
+            pass
+        else:
+            raise AssertionError("熔断期间应抛出CircuitOpenError")
+        assert github.snapshot_stats()["round_trips"] == 0
+
+        # 冷却结束后恢复，成功的请求清零失败计数
+        time.sleep(0.35)
+        assert transport.request("GET", github.url + PATH).status_code == 404
+        assert transport._consecutive_failures == 0 and not transport._open_until
+        github.fail_next(503)
+        assert transport.request("GET", github.url + PATH).status_code == 503
+        assert transport.request("GET", github.url + PATH).status_code == 404
+        transport.close()
+
+
+def test_transport_is_shared_per_key():
+    first = get_transport("test-token-a")
+    assert get_transport("test-token-a") is first
+    assert get_transport("test-token-b") is not first
+
+
+if __name__ == "__main__":
+    test_server_errors_are_retried()
+    test_connection_errors_are_retried_then_raised()
+    test_backoff_grows_exponentially_with_jitter()
+    test_rate_limit_wait()
+    test_rate_limited_requests_wait_and_retry()
+    test_circuit_breaker_opens_and_recovers()
+    test_transport_is_shared_per_key()
+    print("所有传输层测试通过！")
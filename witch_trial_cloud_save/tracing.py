@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import time
+import itertools
+import threading
+
+# 追踪文件的大小上限和保留的旧文件数
+TRACE_FILE = "trace.jsonl"
+TRACE_MAX_BYTES = 5 * 1024 * 1024
+TRACE_BACKUPS = 3
+
+_enabled = False
+_logger = None
+_ids = itertools.count(1)
+_local = threading.local()
+
+
+def configure(enabled, trace_dir=None, max_bytes=TRACE_MAX_BYTES, backup_count=TRACE_BACKUPS):
+    """开启或关闭耗时追踪，开启时写入 trace_dir（默认应用数据目录）下的 trace.jsonl
+
+    文件超过 max_bytes 后轮换为 trace.jsonl.1 ~ trace.jsonl.N。
+    """
+    global _enabled, _logger
+    if _logger is not None:
+        for handler in list(_logger.handlers):
+            _logger.removeHandler(handler)
+            handler.close()
+        _logger = None
+    _enabled = bool(enabled)
+    if not _enabled:
+        return None
+
+    import logging
+    from logging.handlers import RotatingFileHandler
+    if trace_dir is None:
+        from config import get_app_data_dir
+        trace_dir = get_app_data_dir()
+    path = os.path.join(str(trace_dir), TRACE_FILE)
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _logger = logging.getLogger("witch_trial_cloud_save.trace")
+    _logger.propagate = False
+    _logger.setLevel(logging.INFO)
+    _logger.addHandler(handler)
+    return path
+
+
+def enabled():
+    return _enabled
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def current():
+    """当前线程中最内层的追踪段，传给其他线程中的 span(parent=...) 以保持父子关系"""
+    stack = _stack() if _enabled else None
+    return stack[-1] if stack else None
+
+
+class Span:
+    def __init__(self, name, parent=None, **fields):
+        """一段被追踪的操作，结束时写入一行JSON：耗时（毫秒）、字节数、重试次数等字段
+
+        可以作为上下文管理器使用，也可以调用 start() / finish()（例如跨越生成器的多次 yield）。
+        """
+        self.name = name
+        self.parent = parent
+        self.fields = fields
+        self.id = None
+        self.started = None
+
+    def start(self):
+        stack = _stack()
+        if self.parent is None and stack:
+            self.parent = stack[-1]
+        self.id = next(_ids)
+        self.trace = self.parent.trace if self.parent is not None else self.id
+        self.wall = time.time()
+        self.started = time.perf_counter()
+        stack.append(self)
+        return self
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def add(self, **counts):
+        """累加计数字段，如 bytes=len(block)"""
+        for key, value in counts.items():
+            self.fields[key] = self.fields.get(key, 0) + value
+
+    def finish(self, error=None):
+        if self.started is None:
+            return
+        elapsed = time.perf_counter() - self.started
+        stack = _stack()
+        # 生成器中的追踪段可能不在栈顶
+        if self in stack:
+            stack.remove(self)
+        record = {
+            "ts": round(self.wall, 3),
+            "trace": self.trace,
+            "id": self.id,
+            "parent": self.parent.id if self.parent is not None else None,
+            "name": self.name,
+            "ms": round(elapsed * 1000, 3),
+            "thread": threading.current_thread().name,
+        }
+        for key, value in self.fields.items():
+            record[key] = round(value, 3) if isinstance(value, float) else value
+        if error is not None:
+            record["error"] = type(error).__name__
+        self.started = None
+        logger = _logger
+        if logger is not None:
+            logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(exc)
+        return False
+
+
+class _NullSpan:
+    """关闭追踪时使用，所有操作都是空操作"""
+    trace = None
+    id = None
+
+    def start(self):
+        return self
+
+    def set(self, **fields):
+        pass
+
+    def add(self, **counts):
+        pass
+
+    def finish(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, parent=None, **fields):
+    """创建追踪段，关闭追踪时返回共享的空对象，不产生任何开销"""
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, parent=parent, **fields)
+
+
+def traced_iter(name, blocks, **fields):
+    """追踪字节块迭代器：busy_ms 为产生数据本身的耗时，ms 为从开始到结束的总时间
+
+    用于边生成边上传的数据流，例如压缩包生成器；两者的差值是等待网络的时间。
+    """
+    if not _enabled:
+        yield from blocks
+        return
+    with Span(name, **fields) as sp:
+        busy = 0.0
+        size = 0
+        blocks = iter(blocks)
+        try:
+            while True:
+                started = time.perf_counter()
+                block = next(blocks, None)
+                busy += time.perf_counter() - started
+                if block is None:
+                    break
+                size += len(block)
+                yield block
+        finally:
+            sp.set(busy_ms=busy * 1000, bytes=size)
+
+
+def load(path):
+    """读取追踪文件中的所有记录，跳过写了一半的行"""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def summarize(records, trace=None):
+    """把一次操作（默认最后一次）的追踪段按父子关系排成缩进的文字"""
+    if not records:
+        return ""
+    if trace is None:
+        trace = records[-1]["trace"]
+    spans = [r for r in records if r["trace"] == trace]
+    children = {}
+    for record in spans:
+        children.setdefault(record["parent"], []).append(record)
+
+    skip = {"ts", "trace", "id", "parent", "name", "ms", "thread"}
+    lines = []
+
+    def walk(parent, depth):
+        for record in sorted(children.get(parent, []), key=lambda r: r["ts"]):
+            extra = ", ".join(f"{k}={v}" for k, v in record.items() if k not in skip)
+            lines.append(f"{'  ' * depth}{record['name']}: {record['ms']:.1f} 毫秒" + (f" ({extra})" if extra else ""))
+            walk(record["id"], depth + 1)
+
+    walk(None, 0)
+    roots = {r["id"] for r in spans}
+    # 父段尚未写入（仍在进行或已轮换）的记录放在最后
+    for record in spans:
+        if record["parent"] is not None and record["parent"] not in roots:
+            lines.append(f"? {record['name']}: {record['ms']:.1f} 毫秒")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python tracing.py [trace.jsonl]：显示最后一次操作的耗时分布
+    if len(sys.argv) > 1:
+        trace_path = sys.argv[1]
+    else:
+        from config import get_app_data_dir
+        trace_path = get_app_data_dir() / TRACE_FILE
+    print(summarize(load(trace_path)))
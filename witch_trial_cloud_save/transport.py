@@ -0,0 +1,170 @@
+import time
+import random
+import threading
+import requests
+import urllib.parse
+from requests.adapters import HTTPAdapter
+import tracing
+
+# 需要重试的服务器状态码
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """GitHub连续不可用时熔断，请求直接失败而不再等待超时"""
+
+
+class HttpTransport:
+    def __init__(self, pool_size=16, max_retries=3, retry_delay=1.0, max_delay=30.0,
+                 max_rate_limit_wait=60.0, failure_threshold=5, cooldown=30.0):
+        """带连接池的HTTP传输层，所有GitHub请求共用一套重试策略
+
+        - 复用keep-alive连接，避免每次请求都重新进行TCP和TLS握手
+        - 连接错误、超时和5xx使用带随机抖动的指数退避重试
+        - 遵守Retry-After和X-RateLimit-Reset，等待限流解除后再重试
+        - 连续失败达到阈值后熔断一段时间，期间请求直接失败
+        """
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_delay = max_delay
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+
+    def _backoff(self, attempt, base_delay):
+        """第attempt次重试前的等待时间：指数增长，加全抖动避免多个请求同时重试"""
+        delay = min(self.max_delay, base_delay * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    def _rate_limit_wait(self, response, attempt, base_delay):
+        """根据限流响应头计算需要等待的秒数，不是限流响应时返回None"""
+        if response.status_code not in (403, 429):
+            return None
+
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                pass
+
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            reset = response.headers.get("X-RateLimit-Reset")
+            try:
+                return max(0.0, float(reset) - time.time()) + 1
+            except (TypeError, ValueError):
+                return self.max_delay
+
+        if response.status_code == 429:
+            # 没有给出等待时间的限流按指数退避处理
+            return self._backoff(attempt, base_delay)
+        # 其他403是权限问题，不重试
+        return None
+
+    def _check_circuit(self):
+        with self._lock:
+            if self._open_until and time.time() < self._open_until:
+                raise CircuitOpenError(f"GitHub暂时不可用，{self._open_until - time.time():.0f} 秒后重试")
+
+    def _record_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._open_until = 0.0
+
+    def _record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.failure_threshold:
+                self._open_until = time.time() + self.cooldown
+
+    def request(self, method, url, max_retries=None, retry_delay=None, timeout=10, debug=False, **kwargs):
+        """发送请求并按统一策略重试
+
+        返回最后一次的响应（可能是错误状态码）；重试耗尽仍无法连接时抛出
+        requests的ConnectionError或Timeout，熔断时抛出CircuitOpenError。
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        base_delay = self.retry_delay if retry_delay is None else retry_delay
+
+        with tracing.span("http", method=method.upper(), path=urllib.parse.urlsplit(url).path) as sp:
+            response = self._request(method, url, max_retries, base_delay, timeout, debug, sp, **kwargs)
+            data = kwargs.get("data")
+            if isinstance(data, (bytes, bytearray)):
+                sp.set(bytes_out=len(data))
+            sp.set(status=response.status_code, bytes_in=int(response.headers.get("Content-Length") or 0))
+            return response
+
+    def _request(self, method, url, max_retries, base_delay, timeout, debug, sp, **kwargs):
+        """request() 的重试循环，重试次数和等待时间记录到追踪段 sp"""
+        attempt = 0
+        while True:
+            sp.set(retries=attempt)
+            self._check_circuit()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record_failure()
+                attempt += 1
+                if attempt >= max_retries:
+                    raise
+                delay = self._backoff(attempt - 1, base_delay)
+                if debug:
+                    print(f"[调试] 请求失败: {e}")
+                    print(f"[调试] 等待 {delay:.1f} 秒后重试 ({attempt}/{max_retries})...")
+                sp.add(wait_ms=delay * 1000)
+                time.sleep(delay)
+                continue
+
+            wait = self._rate_limit_wait(response, attempt, base_delay)
+            if wait is not None:
+                attempt += 1
+                if attempt >= max_retries or wait > self.max_rate_limit_wait:
+                    if debug:
+                        print(f"[调试] API限流，需要等待 {wait:.0f} 秒，放弃重试")
+                    return response
+                if debug:
+                    print(f"[调试] API限流，等待 {wait:.1f} 秒后重试 ({attempt}/{max_retries})...")
+                sp.add(wait_ms=wait * 1000)
+                time.sleep(wait)
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES:
+                self._record_failure()
+                attempt += 1
+                if attempt >= max_retries:
+                    return response
+                delay = self._backoff(attempt - 1, base_delay)
+                if debug:
+                    print(f"[调试] 服务器错误 {response.status_code}，等待 {delay:.1f} 秒后重试 ({attempt}/{max_retries})...")
+                sp.add(wait_ms=delay * 1000)
+                time.sleep(delay)
+                continue
+
+            self._record_success()
+            return response
+
+    def close(self):
+        self.session.close()
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(key="default"):
+    """获取共享的传输层实例，同一个令牌在整个程序中复用同一个连接池"""
+    with _transports_lock:
+        transport = _transports.get(key)
+        if transport is None:
+            transport = HttpTransport()
+            _transports[key] = transport
+        return transport